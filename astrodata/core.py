@@ -11,6 +11,14 @@ from functools import wraps
 import inspect
 from collections import namedtuple
 from copy import deepcopy
+from datetime import date, time, timedelta
+from numbers import Number
+
+from future.utils import string_types
+
+# Descriptor values of these types can be handed out straight from the cache
+_IMMUTABLE_VALUES = string_types + (bytes, Number, date, time, timedelta,
+                                    type(None))
 
 
 class TagSet(namedtuple('TagSet', 'add remove blocked_by blocks if_present')):
@@ -65,8 +73,12 @@ def astro_data_descriptor(fn):
     Useful to produce list of descriptors, for example.
 
     If used in combination with other decorators, this one *must* be the
-    one on the top (ie. the last one applying). It doesn't modify the
-    method in any other way.
+    one on the top (ie. the last one applying).
+
+    The method is wrapped so that its results are memoized by the `AstroData`
+    instance, as long as the headers are not modified. Arguments to the
+    descriptor are part of the cache key; calls with unhashable arguments
+    are not cached.
 
     Args
     -----
@@ -75,10 +87,14 @@ def astro_data_descriptor(fn):
 
     Returns
     --------
-    The tagged method (not a wrapper)
+    A wrapper function
     """
-    fn.descriptor_method = True
-    return fn
+    @wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        return self._cached_descriptor_call(fn, args, kwargs)
+
+    wrapper.descriptor_method = True
+    return wrapper
 
 
 def returns_list(fn):
@@ -373,6 +389,22 @@ class DataProvider(with_metaclass(ABCMeta, object)):
         """
         pass
 
+    @property
+    def header_version(self):
+        """
+        A value that changes every time the metadata (headers, structure) held
+        by this provider is modified. `AstroData` uses it to know when the
+        cached tags and descriptor values have become stale.
+
+        Providers that cannot keep track of their modifications return `None`,
+        which disables the caching.
+
+        Returns
+        --------
+        A comparable object, or `None`
+        """
+        return None
+
     @property
     def exposed(self):
         """
@@ -448,7 +480,43 @@ class DataProvider(with_metaclass(ABCMeta, object)):
 #     return decorator
 
 
-class AstroData(object):
+class AstroDataMeta(type):
+    """
+    Metaclass for `AstroData`.
+
+    It keeps a registry of the tag methods and descriptors of each class,
+    built once at class creation time, sparing `tags` and `descriptors` the
+    need to inspect the whole class hierarchy on every call. The registry is
+    stored in two class attributes:
+
+    - `_tag_methods`: a tuple with the tag methods, sorted by name
+    - `_descriptor_names`: a tuple with the names of the descriptors, sorted
+
+    Tag methods and descriptors set on the class after its creation are
+    added to its registry, but not to the ones of its existing subclasses.
+    """
+    def __init__(cls, name, bases, dict_):
+        type.__init__(cls, name, bases, dict_)
+        cls._update_registry()
+
+    def _update_registry(cls):
+        tag_methods = []
+        descriptors = []
+        for mname, member in inspect.getmembers(cls):
+            if hasattr(member, 'tag_method'):
+                tag_methods.append(member)
+            if hasattr(member, 'descriptor_method'):
+                descriptors.append(mname)
+        type.__setattr__(cls, '_tag_methods', tuple(tag_methods))
+        type.__setattr__(cls, '_descriptor_names', tuple(descriptors))
+
+    def __setattr__(cls, name, value):
+        type.__setattr__(cls, name, value)
+        if hasattr(value, 'tag_method') or hasattr(value, 'descriptor_method'):
+            cls._update_registry()
+
+
+class AstroData(with_metaclass(AstroDataMeta, object)):
     """
     AstroData(provider)
 
@@ -469,6 +537,8 @@ class AstroData(object):
             raise ValueError("AstroData is initialized with a DataProvider object. You may want to use ad.open('...') instead")
         self._dataprov = provider
         self._processing_tags = False
+        self._tag_cache = None
+        self._descriptor_cache = {}
 
     def __deepcopy__(self, memo):
         """
@@ -503,14 +573,10 @@ class AstroData(object):
         self._processing_tags = True
         try:
             results = []
-            # Calling inspect.getmembers on `self` would trigger all the properties (tags,
-            # phu, hdr, etc.), and that's undesirable. To prevent that, we'll inspect the
-            # *class*. But that returns us unbound methods. We use `method.__get__(self)` to
-            # get a bound version.
-            #
-            # It's a bit of a roundabout way to get to what we want, but it's better than
-            # the option...
-            for mname, method in inspect.getmembers(self.__class__, lambda x: hasattr(x, 'tag_method')):
+            # The tag methods are collected from the *class* when it is created (see
+            # AstroDataMeta). That gives us unbound methods. We use `method.__get__(self)`
+            # to get a bound version.
+            for method in self._tag_methods:
                 ts = method.__get__(self)()
                 plus, minus, blocked_by, blocks, if_present = ts
                 if plus or minus or blocks:
@@ -547,8 +613,50 @@ class AstroData(object):
     def tags(self):
         """
         A set of strings that represent the tags defining this instance
+
+        The tags are computed once and reused until the headers change.
+        """
+        version = self._dataprov.header_version
+        cached = self._tag_cache
+        if version is not None and cached is not None and cached[0] == version:
+            return set(cached[1])
+
+        if self._processing_tags:
+            # We're being called from within a tag method. Don't cache
+            return self.__process_tags()
+
+        tags = self.__process_tags()
+        if version is not None:
+            self._tag_cache = (version, frozenset(tags))
+        return tags
+
+    def _cached_descriptor_call(self, fn, args, kwargs):
+        """
+        Calls the descriptor method `fn`, reusing the result of a previous
+        call with the same arguments, if the headers haven't been modified
+        since.
         """
-        return self.__process_tags()
+        version = self._dataprov.header_version
+        # Values computed while figuring out the tags may depend on an
+        # incomplete tag set. Don't memoize them.
+        if version is None or self._processing_tags:
+            return fn(self, *args, **kwargs)
+
+        try:
+            key = (fn.__name__, args, frozenset(kwargs.items()))
+            cached = self._descriptor_cache.get(key)
+        except TypeError:
+            # Unhashable arguments
+            return fn(self, *args, **kwargs)
+
+        if cached is not None and cached[0] == version:
+            ret = cached[1]
+        else:
+            ret = fn(self, *args, **kwargs)
+            self._descriptor_cache[key] = (version, ret)
+
+        # Don't let the caller modify the cached object, or anything in it
+        return ret if isinstance(ret, _IMMUTABLE_VALUES) else deepcopy(ret)
 
     @property
     def descriptors(self):
@@ -560,9 +668,7 @@ class AstroData(object):
         --------
         A tuple of str
         """
-        members = inspect.getmembers(self.__class__,
-                                     lambda x: hasattr(x, 'descriptor_method'))
-        return tuple(mname for (mname, method) in members)
+        return self._descriptor_names
 
     def __iter__(self):
         for single in self._dataprov:
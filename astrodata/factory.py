@@ -11,7 +11,10 @@ from .core import AstroDataError
 def fits_opener(source):
     if isinstance(source, HDUList):
         return source
-    return fits.open(source, memmap=True)
+    # Open the file the same way FitsLoader would. The resulting HDUList is
+    # passed verbatim to the loader, so that the file is opened (and its
+    # headers parsed) only once.
+    return fits.open(source, memmap=True, do_not_scale_image_data=True, mode='readonly')
 
 class AstroDataFactory(object):
     _file_openers = (
@@ -53,19 +56,14 @@ class AstroDataFactory(object):
             raise AttributeError("Class '{}' has no '_matches_data' method".format(cls.__name__))
         self._registry.add(cls)
 
-    def getAstroData(self, source):
+    def getAstroDataClass(self, opened):
         """
-        Takes either a string (with the path to a file) or an HDUList as input, and
-        tries to return an AstroData instance.
-
-        It will raise exceptions if the file is not found, or if there is no match
-        for the HDUList, among the registered AstroData classes.
+        Takes an HDUList and returns the registered AstroData class that
+        matches it, without instantiating it.
 
-        Returns an instantiated object, or raises AstroDataError if it was
-        not possible to find a match
+        Raises AstroDataError if there is no match, or if more than one
+        class is candidate for the dataset.
         """
-
-        opened = self._openFile(source)
         candidates = []
         for adclass in self._registry:
             try:
@@ -87,7 +85,46 @@ class AstroDataFactory(object):
         elif not final_candidates:
             raise AstroDataError("No class matches this dataset")
 
-        return final_candidates[0].load(source)
+        return final_candidates[0]
+
+    @staticmethod
+    def isPhuSufficient(adclass):
+        """
+        Tells if the tags of `adclass` can be computed from the PHU alone,
+        ie. an instance created from just the PHU of a file has the same
+        tags as one created from the whole file.
+
+        Classes state this by setting ``_phu_sufficient = True`` in their
+        own body. The flag is not inherited, as a derived class may add tag
+        methods that look at the extensions.
+        """
+        return vars(adclass).get('_phu_sufficient', False)
+
+    def getAstroData(self, source):
+        """
+        Takes either a string (with the path to a file) or an HDUList as input, and
+        tries to return an AstroData instance.
+
+        It will raise exceptions if the file is not found, or if there is no match
+        for the HDUList, among the registered AstroData classes.
+
+        Returns an instantiated object, or raises AstroDataError if it was
+        not possible to find a match
+
+        The file is opened only once: the same `HDUList` used to find the
+        matching class is passed on to its `load` method. The `_matches_data`
+        methods are expected to look only at the headers (typically, just the
+        PHU), which are parsed once and cached by the `HDUList`.
+        """
+
+        opened = self._openFile(source)
+        ad = self.getAstroDataClass(opened).load(opened)
+        if opened is not source:
+            # We opened the file ourselves. Let the object know where it
+            # comes from
+            ad.path = source
+
+        return ad
 
     def createFromScratch(self, phu, extensions=None):
         """
@@ -12,7 +12,10 @@ import logging
 import warnings
 import gc
 import inspect
+import itertools
+import threading
 import traceback
+from multiprocessing.pool import ThreadPool
 
 try:
     # Python 3
@@ -25,7 +28,7 @@ from .nddata import NDAstroData as NDDataObject, new_variance_uncertainty_instan
 
 import astropy
 from astropy.io import fits
-from astropy.io.fits import HDUList, Header, DELAYED
+from astropy.io.fits import HDUList, Header, Card, DELAYED
 from astropy.io.fits import PrimaryHDU, ImageHDU, BinTableHDU
 from astropy.io.fits import Column, FITS_rec
 from astropy.io.fits.hdu.table import _TableBaseHDU
@@ -75,6 +78,118 @@ class KeywordCallableWrapper(object):
             return self.coercion_fn(ret)
         return wrapper
 
+# Source of stamps for the modifications of headers and providers. Every
+# modification takes a new value, which is larger than any previous one, so
+# that the latest stamp out of a group of objects tells if any of them has
+# been modified.
+_modification_stamps = itertools.count(1)
+
+def new_modification_stamp():
+    return next(_modification_stamps)
+
+class TrackedCard(Card):
+    """
+    A ``Card`` that stamps its own modifications (eg, ``card.value = 3``),
+    which its ``TrackedHeader`` can't see. ``last_edit`` is the latest stamp
+    of any of them, to let the headers skip looking at their cards when no
+    card has been edited.
+    """
+    _stamp = 0
+    last_edit = 0
+
+    @property
+    def _modified(self):
+        return self.__dict__.get('_modified', False)
+
+    @_modified.setter
+    def _modified(self, value):
+        self.__dict__['_modified'] = value
+        if value:
+            self._stamp = TrackedCard.last_edit = new_modification_stamp()
+
+class TrackedHeader(Header):
+    """
+    A ``Header`` that stamps every modification made to it, or to its cards,
+    allowing ``FitsProvider`` to know when cached tags and descriptors are
+    stale.
+
+    Instances are not created directly: ``track_modifications`` turns regular
+    headers into ``TrackedHeader``, preserving their identity.
+    """
+    _stamp = 0
+    _cards_checked = 0
+
+    def _touch(self):
+        self._stamp = new_modification_stamp()
+        self._track_cards()
+
+    def _track_cards(self):
+        # Any new cards have to report their own modifications, too
+        for card in self._cards:
+            if type(card) is Card:
+                card.__class__ = TrackedCard
+
+    @property
+    def modification_stamp(self):
+        """
+        The stamp of the latest modification to this header or its cards
+        """
+        last_edit = TrackedCard.last_edit
+        if self._cards_checked < last_edit:
+            self._cards_checked = last_edit
+            self._stamp = max([self._stamp] + [getattr(card, '_stamp', 0)
+                                               for card in self._cards])
+        return self._stamp
+
+    @property
+    def _modified(self):
+        return Header._modified.fget(self)
+
+    @_modified.setter
+    def _modified(self, value):
+        # Astropy flags every structural change this way
+        Header._modified.fset(self, value)
+        if value:
+            self._touch()
+
+    def __setitem__(self, key, value):
+        super(TrackedHeader, self).__setitem__(key, value)
+        self._touch()
+
+    def __delitem__(self, key):
+        super(TrackedHeader, self).__delitem__(key)
+        self._touch()
+
+    def _update(self, card):
+        super(TrackedHeader, self)._update(card)
+        self._touch()
+
+    def append(self, *args, **kw):
+        super(TrackedHeader, self).append(*args, **kw)
+        self._touch()
+
+    def insert(self, *args, **kw):
+        super(TrackedHeader, self).insert(*args, **kw)
+        self._touch()
+
+    def clear(self):
+        super(TrackedHeader, self).clear()
+        self._touch()
+
+    def strip(self):
+        super(TrackedHeader, self).strip()
+        self._touch()
+
+def track_modifications(header):
+    """
+    Makes ``header`` keep track of its modifications (see ``TrackedHeader``).
+    Objects other than plain ``Header`` instances are returned untouched.
+    """
+    if type(header) is Header:
+        header.__class__ = TrackedHeader
+        header._track_cards()
+    return header
+
 class FitsHeaderCollection(object):
     """
     FitsHeaderCollection(headers)
@@ -345,6 +460,10 @@ class FitsProviderProxy(DataProvider):
     def is_single(self):
         return self._single
 
+    @property
+    def header_version(self):
+        return self._provider.header_version
+
     def __deepcopy__(self, memo):
         return self._provider._clone(mapping=self._mapping)
 
@@ -459,6 +578,10 @@ class FitsProviderProxy(DataProvider):
         self._provider._standard_nddata_op(NDDataObject.divide, operand, self._mapping)
         return self
 
+    def _in_place_op(self, fn, operand):
+        self._provider._standard_nddata_op(fn, operand, self._mapping,
+                                           in_place=True)
+
     def __rdiv__(self, operand):
         self._provider._oper(self._provider._rdiv, operand, self._mapping)
         return self
@@ -485,6 +608,8 @@ class FitsProviderProxy(DataProvider):
         # and know what we're doing, isn't it?
         if hasattr(value, 'shape'):
             ext._data = value
+            # Some descriptors depend on the shape of the data
+            self._provider._touch()
         else:
             raise AttributeError("Trying to assign data to be something with no shape")
 
@@ -525,11 +650,7 @@ class FitsProviderProxy(DataProvider):
     def variance(self, value):
         if not self.is_single:
             raise ValueError("Trying to assign to an AstroData object that is not a single slice")
-        nd = self._mapped_nddata(0)
-        if value is None:
-            nd.uncertainty = None
-        else:
-            nd.uncertainty = new_variance_uncertainty_instance(value)
+        self._mapped_nddata(0).variance = value
 
     @property
     def nddata(self):
@@ -548,6 +669,7 @@ class FitsProviderProxy(DataProvider):
 
     def crop(self, x1, y1, x2, y2):
         self._crop_impl(x1, y1, x2, y2, self._mapped_nddata)
+        self._provider._touch()
 
     def append(self, ext, name):
         if not self.is_single:
@@ -596,6 +718,7 @@ class FitsProvider(DataProvider):
             '_tables': {},
             '_exposed': set(),
             '_resetting': False,
+            '_stamp': 0,
             '_fixed_settable': set([
                 'data',
                 'uncertainty',
@@ -681,6 +804,7 @@ class FitsProvider(DataProvider):
         try:
             del self._tables[attribute]
             del self.__dict__[attribute]
+            self._touch()
         except KeyError:
             raise AttributeError("'{}' is not a global table for this instance".format(attribute))
 
@@ -705,9 +829,22 @@ class FitsProvider(DataProvider):
             for n in indices:
                 self._set_nddata(n, operator(self._nddata[n], operand))
 
-    def _standard_nddata_op(self, fn, operand, indices=None):
-        return self._oper(partial(fn, handle_mask=np.bitwise_or, handle_meta='first_found'),
-                          operand, indices)
+    def _standard_nddata_op(self, fn, operand, indices=None, in_place=False):
+        standard_op = partial(fn, handle_mask=np.bitwise_or, handle_meta='first_found')
+        if not in_place:
+            return self._oper(standard_op, operand, indices)
+
+        # Modify the arrays in place when possible, rather than letting
+        # NDArithmeticMixin create new ones
+        def operator(nddata, operand):
+            if nddata.arithmetic_in_place(fn.__name__, operand):
+                return nddata
+            return standard_op(nddata, operand)
+
+        return self._oper(operator, operand, indices)
+
+    def _in_place_op(self, fn, operand):
+        self._standard_nddata_op(fn, operand, in_place=True)
 
     def __iadd__(self, operand):
         self._standard_nddata_op(NDDataObject.add, operand)
@@ -735,8 +872,19 @@ class FitsProvider(DataProvider):
         # Divide method works with the operand first
         return NDDataObject.divide(operand, ndd)
 
+    def _touch(self):
+        self._stamp = new_modification_stamp()
+
+    @property
+    def header_version(self):
+        headers = [self._phu] + [track_modifications(nd.meta.get('header'))
+                                 for nd in self._nddata]
+        return max([self._stamp] + [getattr(h, 'modification_stamp', 0)
+                                     for h in headers])
+
     def set_phu(self, phu):
-        self._phu = phu
+        self._phu = track_modifications(phu)
+        self._touch()
 
     def info(self, tags, indices=None):
         print("Filename: {}".format(self.path if self.path else "Unknown"))
@@ -782,7 +930,7 @@ class FitsProvider(DataProvider):
             header = obj.meta['header']
             other_objects = []
             uncer = obj.uncertainty
-            fixed = (('variance', None if uncer is None else uncer.as_variance()), ('mask', obj.mask))
+            fixed = (('variance', None if uncer is None else uncer.array), ('mask', obj.mask))
             for name, other in fixed + tuple(sorted(obj.meta['other'].items())):
                 if other is not None:
                     if isinstance(other, Table):
@@ -847,6 +995,7 @@ class FitsProvider(DataProvider):
 
     def __delitem__(self, idx):
         del self._nddata[idx]
+        self._touch()
 
     def __len__(self):
         return len(self._nddata)
@@ -947,6 +1096,7 @@ class FitsProvider(DataProvider):
         if self._path is None and value is not None:
             self._orig_filename = os.path.basename(value)
         self._path = value
+        self._touch()
 
     @property
     def filename(self):
@@ -971,7 +1121,7 @@ class FitsProvider(DataProvider):
         if isinstance(obj, int):
             # Assume that 'obj' is an index
             obj = self.nddata[obj]
-        return obj.meta['header']
+        return track_modifications(obj.meta['header'])
 
     def _get_raw_headers(self, with_phu=False, indices=None):
         if indices is None:
@@ -1014,7 +1164,7 @@ class FitsProvider(DataProvider):
 
             hlst.append(new_imagehdu(ext.data, header))
             if ext.uncertainty is not None:
-                hlst.append(new_imagehdu(ext.uncertainty.array ** 2, header, 'VAR'))
+                hlst.append(new_imagehdu(ext.uncertainty.array, header, 'VAR'))
             if ext.mask is not None:
                 hlst.append(new_imagehdu(ext.mask, header, 'DQ'))
 
@@ -1069,7 +1219,7 @@ class FitsProvider(DataProvider):
     def variance(self):
         def variance_for(nd):
             if nd.uncertainty is not None:
-                return nd.uncertainty.array**2
+                return nd.uncertainty.array
 
         return [variance_for(nd) for nd in self._nddata]
 
@@ -1101,6 +1251,7 @@ class FitsProvider(DataProvider):
 
     def crop(self, x1, y1, x2, y2):
         self._crop_impl(x1, y1, x2, y2)
+        self._touch()
 
     def _add_to_other(self, add_to, name, data, header=None):
         meta = add_to.meta
@@ -1142,10 +1293,10 @@ class FitsProvider(DataProvider):
                 add_to.mask = data
                 ret = data
             elif name == 'VAR':
-                std_un = new_variance_uncertainty_instance(data)
-                std_un.parent_nddata = add_to
-                add_to.uncertainty = std_un
-                ret = std_un
+                var_un = new_variance_uncertainty_instance(data, copy=True)
+                var_un.parent_nddata = add_to
+                add_to.uncertainty = var_un
+                ret = var_un
             else:
                 self._add_to_other(add_to, name, data, header=header)
                 ret = data
@@ -1193,6 +1344,7 @@ class FitsProvider(DataProvider):
 
     def _set_nddata(self, n, new_nddata):
         self._nddata[n] = new_nddata
+        self._touch()
 
     def _append_table(self, new_table, name, header, add_to, reset_ver=True):
         tb = self._process_table(new_table, name, header)
@@ -1238,6 +1390,7 @@ class FitsProvider(DataProvider):
         if isinstance(ext, PrimaryHDU):
             raise ValueError("Only one Primary HDU allowed. Use set_phu if you really need to set one")
 
+        self._touch()
         dispatcher = (
                 (NDData, self._append_raw_nddata),
                 ((Table, _TableBaseHDU), self._append_table),
@@ -1311,6 +1464,10 @@ def fits_ext_comp_key(ext):
     return ret
 
 class FitsLazyLoadable(object):
+    # Number of pixels decoded at a time when scaling, to bound the size of
+    # the (double precision) temporary arrays
+    _scaling_chunk = 1 << 20
+
     def __init__(self, obj):
         self._obj = obj
         self.lazy = True
@@ -1318,16 +1475,50 @@ class FitsLazyLoadable(object):
     def _create_result(self, shape):
         return np.empty(shape, dtype=self.dtype)
 
-    def _scale(self, data):
+    def read(self, section=None, out=None):
+        """
+        Decodes the pixels (or a section of them) into ``out``, creating a
+        new array if it's not provided. Only the requested pixels are taken
+        from the file (memory-mapped or tile-compressed), and the conversion
+        to native byte order and the BSCALE/BZERO scaling happen while
+        writing them to ``out``, without making a full-size temporary copy.
+
+        Args
+        -----
+        section : slice or tuple of slices
+            The section to read (all the pixels, if `None`)
+        out : ndarray
+            Where to write the pixels. It must have the shape of the section,
+            but can be of any dtype (eg., a window of a larger buffer)
+
+        Returns
+        --------
+        The array with the pixels (``out``, if provided)
+        """
+        # Only the section is read: for tile-compressed HDUs, .data would
+        # decompress (and keep) the whole image
+        raw = self._obj.data if section is None else self._obj.section[section]
+        if out is None:
+            out = self._create_result(raw.shape)
         bscale = self._obj._orig_bscale
         bzero = self._obj._orig_bzero
         if bscale == 1 and bzero == 0:
-            return data
-        return (bscale * data + bzero).astype(self.dtype)
+            out[...] = raw
+        elif raw.ndim == 0:
+            out[...] = bscale * np.float64(raw) + bzero
+        else:
+            # Same arithmetic as scaling the whole array in double precision,
+            # a few rows at a time
+            step = max(self._scaling_chunk // max(raw[0].size, 1), 1)
+            for start in range(0, raw.shape[0], step):
+                chunk = np.multiply(raw[start:start+step], bscale,
+                                    dtype=np.float64)
+                chunk += bzero
+                out[start:start+step] = chunk
+        return out
 
     def __getitem__(self, sl):
-        # TODO: We may want (read: should) create an empty result array before scaling
-        return self._scale(self._obj.section[sl])
+        return self.read(sl)
 
     @property
     def header(self):
@@ -1335,9 +1526,7 @@ class FitsLazyLoadable(object):
 
     @property
     def data(self):
-        res = self._create_result(self.shape)
-        res[:] = self._scale(self._obj.data)
-        return res
+        return self.read()
 
     @property
     def shape(self):
@@ -1495,7 +1684,28 @@ class FitsLoader(object):
 
         return provider
 
-def windowedOp(fn, sequence, kernel, shape=None, dtype=None, with_uncertainty=False, with_mask=False):
+def _load_window(window):
+    # Reads the contents of a window into memory
+    return NDDataObject(window.data, uncertainty=window.uncertainty,
+                        mask=window.mask)
+
+def windowedOp(fn, sequence, kernel, shape=None, dtype=None, with_uncertainty=False, with_mask=False,
+               num_workers=1):
+    """
+    Applies ``fn`` to a sequence of ``NDAstroData`` objects, one window at a
+    time, and puts together the results.
+
+    The full shape is divided into boxes of size ``kernel``. For each box,
+    ``fn`` receives an iterable with the corresponding windows from every
+    element in ``sequence``, and must return an ``NDData``-like object with
+    the result for that box.
+
+    If ``num_workers`` is larger than 1, the boxes are processed concurrently
+    by a pool of threads. The pixels for each box are read from the inputs
+    one box at a time (reading from the files is not thread-safe), but the
+    calls to ``fn`` run in parallel. The caller is responsible for sizing the
+    kernel so that ``num_workers`` boxes fit in memory at the same time.
+    """
     def generate_boxes(shape, kernel):
         if len(shape) != len(kernel):
             raise AssertionError("Incompatible shape ({}) and kernel ({})".format(shape, kernel))
@@ -1523,18 +1733,46 @@ def windowedOp(fn, sequence, kernel, shape=None, dtype=None, with_uncertainty=Fa
     # The Astropy logger's "INFO" messages aren't warnings, so have to fudge
     log_level = astropy.logger.conf.log_level
     astropy.log.setLevel(astropy.logger.WARNING)
-    for coords in generate_boxes(shape, kernel):
-        # The coordinates come as ((x1, x2, ..., xn), (y1, y2, ..., yn), ...)
-        # Zipping them will get us a more desirable ((x1, y1, ...), (x2, y2, ...), ..., (xn, yn, ...))
-        # box = list(zip(*coords))
-        section = tuple([slice(start, end) for (start, end) in coords])
-        result.set_section(section, fn((element.window[section] for element in sequence)))
-        gc.collect()
-    astropy.log.setLevel(log_level)  # and reset
+    # The coordinates come as ((x1, x2, ..., xn), (y1, y2, ..., yn), ...)
+    # Zipping them will get us a more desirable ((x1, y1, ...), (x2, y2, ...), ..., (xn, yn, ...))
+    # box = list(zip(*coords))
+    sections = [tuple([slice(start, end) for (start, end) in coords])
+                for coords in generate_boxes(shape, kernel)]
+    try:
+        if num_workers > 1 and len(sections) > 1:
+            io_lock = threading.Lock()
+
+            def process_box(section):
+                with io_lock:
+                    windows = [_load_window(element.window[section]) for element in sequence]
+                return section, fn(windows)
+
+            pool = ThreadPool(min(num_workers, len(sections)))
+            try:
+                # Only the main thread writes to the result
+                for section, output in pool.imap_unordered(process_box, sections):
+                    result.set_section(section, output)
+            finally:
+                pool.terminate()
+                pool.join()
+        else:
+            for section in sections:
+                result.set_section(section, fn((element.window[section] for element in sequence)))
+    finally:
+        astropy.log.setLevel(log_level)  # and reset
+
+    # The temporary arrays are released as soon as each box is done with.
+    # Collect whatever may be left in reference cycles only once, at the end
+    gc.collect()
 
     return result
 
 class AstroDataFits(AstroData):
+    # Classes whose matching and tags only need the PHU say so, to let
+    # tools classify files without reading their extensions. Each class
+    # has to state it for itself (see AstroDataFactory.isPhuSufficient)
+    _phu_sufficient = True
+
     # Derived classes may provide their own __keyword_dict. Being a private
     # variable, each class will preserve its own, and there's no risk of
     # overriding the whole thing
@@ -1585,6 +1823,26 @@ class AstroDataFits(AstroData):
         else:
             raise AttributeError("No match for '{}'".format(name))
 
+    def _arithmetic_in_place(self, operation, operand):
+        """
+        Same as the ``add``, ``subtract``, ``multiply`` or ``divide`` methods
+        (named by ``operation``), but modifying the data, mask and variance
+        arrays of the extensions in place when the results fit in them (see
+        `NDAstroData.arithmetic_in_place`), instead of replacing them.
+
+        Any other reference to those arrays (an ``ext.data`` taken earlier, an
+        array assigned to ``ext.variance``, another `AstroData` holding the
+        same `NDData`...) sees the results too, so this is only meant for
+        callers that own the arrays, like the primitives applying
+        calibrations to their inputs.
+
+        Returns
+        --------
+        `self`
+        """
+        self._dataprov._in_place_op(getattr(NDDataObject, operation), operand)
+        return self
+
     @staticmethod
     def _matches_data(dataprov):
         # This one is trivial. As long as we get a FITS file...
@@ -8,7 +8,7 @@ from __future__ import (absolute_import, division, print_function)
 from copy import deepcopy
 
 from astropy.nddata import NDData
-from astropy.nddata import StdDevUncertainty
+from astropy.nddata import StdDevUncertainty, VarianceUncertainty
 from astropy.nddata.mixins.ndslicing import NDSlicingMixin
 from astropy.nddata.mixins.ndarithmetic import NDArithmeticMixin
 from astropy.io.fits import ImageHDU
@@ -16,18 +16,28 @@ import numpy as np
 
 __all__ = ['NDAstroData']
 
-class StdDevAsVariance(object):
-    def as_variance(self):
-        if self.array is not None:
-            return self.array ** 2
-        else:
-            return None
+def new_variance_uncertainty_instance(array, copy=False):
+    """
+    Wraps a variance array in an uncertainty object, without copying it
+    unless ``copy`` is set. The uncertainties are stored as variance, so that
+    the ``variance`` of an ``NDAstroData`` (and the VAR extension of a file)
+    is the array itself. Arrays passed in by users are copied, so that they
+    don't change with the (in place) arithmetic done on the ``NDAstroData``.
+    """
+    return VarianceUncertainty(array, copy=copy)
 
-def new_variance_uncertainty_instance(array):
-    obj = StdDevUncertainty(np.sqrt(array))
-    cls = obj.__class__
-    obj.__class__ = cls.__class__(cls.__name__ + "WithAsVariance", (cls, StdDevAsVariance), {})
-    return obj
+def as_variance_uncertainty(uncertainty):
+    """
+    Returns ``uncertainty`` as a ``VarianceUncertainty``. Only standard
+    deviations are converted (anything else is returned unchanged).
+    """
+    if isinstance(uncertainty, StdDevUncertainty):
+        unit = uncertainty.unit
+        return VarianceUncertainty(None if uncertainty.array is None
+                                   else np.square(uncertainty.array),
+                                   unit=None if unit is None else unit ** 2,
+                                   copy=False)
+    return uncertainty
 
 class FakeArray(object):
     def __init__(self, very_faked):
@@ -79,12 +89,151 @@ class NDWindowingAstroData(NDArithmeticMixin, NDSlicingMixin, NDData):
     def variance(self):
         un = self.uncertainty
         if un is not None:
-            return un.array**2
+            return un.array
 
     @property
     def mask(self):
         return self._target._get_simple('_mask', section=self._window)
 
+    @property
+    def shape(self):
+        return np.broadcast_to(0, self._target.shape)[self._window].shape
+
+    def read_into(self, plane, out):
+        """
+        Writes the window of ``plane`` into ``out``. See
+        ``NDAstroData.read_into``.
+        """
+        return self._target.read_into(plane, out, section=self._window)
+
+    def plane_dtype(self, plane):
+        """See ``NDAstroData.plane_dtype``"""
+        return self._target.plane_dtype(plane)
+
+class NDPlacedAstroData(object):
+    """
+    Presents an ``NDAstroData`` instance as if it had been copied into a
+    larger array of shape ``shape``, with its first pixel at ``origin``.
+    The rest of that array has no data: it is zero (with zero variance),
+    and flagged with ``mask_fill`` in the mask.
+
+    Only windowed access is provided, and only the part of the data that
+    overlaps a window is read, so a set of placed images can be combined
+    with ``windowedOp`` without making any full-size arrays.
+    """
+    def __init__(self, target, origin, shape, mask_fill=0):
+        self._target = target
+        self.origin = tuple(origin)
+        self.shape = tuple(shape)
+        self.mask_fill = mask_fill
+
+    @property
+    def meta(self):
+        return self._target.meta
+
+    @property
+    def unit(self):
+        return self._target.unit
+
+    @property
+    def wcs(self):
+        return self._target.wcs
+
+    @property
+    def window(self):
+        return NDWindowing(self)
+
+    def _overlap(self, section):
+        # Returns the shape of the window, and the matching sections of the
+        # window and of the target where they overlap
+        if not isinstance(section, tuple):
+            section = (section,)
+        section += (slice(None),) * (len(self.shape) - len(section))
+        window_shape, window_section, target_section = [], [], []
+        for slice_, origin, length, target_length in zip(section, self.origin,
+                                                         self.shape,
+                                                         self._target.shape):
+            start, stop, step = slice_.indices(length)
+            if step != 1:
+                raise ValueError("Placed data can only be windowed with "
+                                 "contiguous sections")
+            stop = max(stop, start)
+            low = min(max(start, origin), stop)
+            high = max(min(stop, origin + target_length), low)
+            window_shape.append(stop - start)
+            window_section.append(slice(low - start, high - start))
+            target_section.append(slice(low - origin, high - origin))
+        overlaps = all(sec.stop > sec.start for sec in target_section)
+        return (tuple(window_shape), tuple(window_section),
+                tuple(target_section) if overlaps else None)
+
+    def target_window(self, section=None):
+        """
+        The window of the target covered by ``section`` of the larger array
+        (all of it, if `None`), or `None` if they don't overlap. Unlike with
+        ``window``, the parts of the section outside the target aren't made
+        up, so this only reads the target's own pixels.
+        """
+        target_section = self._overlap(slice(None) if section is None
+                                       else section)[2]
+        if target_section is not None:
+            return self._target.window[target_section]
+
+    def _get_simple(self, target, section=None):
+        source = getattr(self._target, target)
+        if source is not None:
+            window_shape, window_section, target_section = self._overlap(section)
+            dtype = source.dtype if is_lazy(source) else np.asarray(source).dtype
+            ret = np.full(window_shape, self.mask_fill if target == '_mask'
+                          else 0, dtype=dtype)
+            if target_section is not None:
+                ret[window_section] = self._target._get_simple(target,
+                                                    section=target_section)
+            return ret
+
+    def _get_uncertainty(self, section=None):
+        source = self._target._uncertainty
+        if source is not None:
+            window_shape, window_section, target_section = self._overlap(section)
+            dtype = source.dtype if is_lazy(source) else source.array.dtype
+            ret = new_variance_uncertainty_instance(np.zeros(window_shape,
+                                                             dtype=dtype))
+            if target_section is not None:
+                ret.array[window_section] = self._target._get_uncertainty(
+                    section=target_section).array
+            return ret
+
+    def read_into(self, plane, out, section=None):
+        """
+        Writes a section of ``plane`` into ``out``, including the parts that
+        fall outside the target. See ``NDAstroData.read_into``.
+        """
+        source = getattr(self._target, _PLANES[plane])
+        if source is not None:
+            window_shape, window_section, target_section = self._overlap(section)
+            out[...] = self.mask_fill if plane == 'mask' else 0
+            if target_section is not None:
+                return self._target.read_into(plane, out[window_section],
+                                              section=target_section)
+            return _plane_dtype(source)
+
+    def plane_dtype(self, plane):
+        """See ``NDAstroData.plane_dtype``"""
+        return self._target.plane_dtype(plane)
+
+# Attributes of NDAstroData holding each plane
+_PLANES = {'data': '_data', 'mask': '_mask', 'variance': '_uncertainty'}
+
+def _plane_dtype(source):
+    if is_lazy(source):
+        return np.dtype(source.dtype)
+    return (source.array if isinstance(source, VarianceUncertainty)
+            else np.asarray(source)).dtype
+
+# The operations that can be done in place, and the ufuncs that do them
+_IN_PLACE_UFUNCS = {'add': np.add, 'subtract': np.subtract,
+                    'multiply': np.multiply, 'divide': np.true_divide}
+
 def is_lazy(item):
     return isinstance(item, ImageHDU) or (hasattr(item, 'lazy') and item.lazy)
 
@@ -101,6 +250,10 @@ class NDAstroData(NDArithmeticMixin, NDSlicingMixin, NDData):
     differences in the interface (eg. ``.data`` lets you reset its contents after
     initialization).
 
+    The uncertainty is always stored as a ``VarianceUncertainty`` (a
+    ``StdDevUncertainty`` is converted when it is set), so that reading or
+    writing the variance does not involve any computation.
+
     Documentation is provided where our class differs.
 
     See also
@@ -114,12 +267,12 @@ class NDAstroData(NDArithmeticMixin, NDSlicingMixin, NDData):
     The mixins allow operation that are not possible with ``NDData`` or
     ``NDDataBase``, i.e. simple arithmetics::
 
-        >>> from astropy.nddata import NDAstroData, StdDevUncertainty
+        >>> from astropy.nddata import NDAstroData, VarianceUncertainty
         >>> import numpy as np
 
         >>> data = np.ones((3,3), dtype=np.float)
-        >>> ndd1 = NDAstroData(data, uncertainty=StdDevUncertainty(data))
-        >>> ndd2 = NDAstroData(data, uncertainty=StdDevUncertainty(data))
+        >>> ndd1 = NDAstroData(data, uncertainty=VarianceUncertainty(data))
+        >>> ndd2 = NDAstroData(data, uncertainty=VarianceUncertainty(data))
 
         >>> ndd3 = ndd1.add(ndd2)
         >>> ndd3.data
@@ -127,9 +280,9 @@ class NDAstroData(NDArithmeticMixin, NDSlicingMixin, NDData):
                [ 2.,  2.,  2.],
                [ 2.,  2.,  2.]])
         >>> ndd3.uncertainty.array
-        array([[ 1.41421356,  1.41421356,  1.41421356],
-               [ 1.41421356,  1.41421356,  1.41421356],
-               [ 1.41421356,  1.41421356,  1.41421356]])
+        array([[ 2.,  2.,  2.],
+               [ 2.,  2.,  2.],
+               [ 2.,  2.,  2.]])
 
     see ``NDArithmeticMixin`` for a complete list of all supported arithmetic
     operations.
@@ -140,7 +293,7 @@ class NDAstroData(NDArithmeticMixin, NDSlicingMixin, NDData):
         >>> ndd4.data
         array([ 2.,  2.,  2.])
         >>> ndd4.uncertainty.array
-        array([ 1.41421356,  1.41421356,  1.41421356])
+        array([ 2.,  2.,  2.])
 
     See ``NDSlicingMixin`` for a description how slicing works (which attributes)
     are sliced.
@@ -210,8 +363,7 @@ class NDAstroData(NDArithmeticMixin, NDSlicingMixin, NDData):
         if source is not None:
             if is_lazy(source):
                 if section is None:
-                    ret = np.empty(source.shape, dtype=source.dtype)
-                    ret[:] = source.data
+                    ret = source.data
                     setattr(self, target, ret)
                 else:
                     ret = source[section]
@@ -246,6 +398,7 @@ class NDAstroData(NDArithmeticMixin, NDSlicingMixin, NDData):
     @uncertainty.setter
     def uncertainty(self, value):
         if value is not None and not is_lazy(value):
+            value = as_variance_uncertainty(value)
             if value._parent_nddata is not None:
                 value = value.__class__(value, copy=False)
             value.parent_nddata = self
@@ -262,16 +415,67 @@ class NDAstroData(NDArithmeticMixin, NDSlicingMixin, NDData):
     @property
     def variance(self):
         """
-        A convenience property to access the contents of ``uncertainty``,
-        squared (as the uncertainty data is stored as standard deviation).
+        A convenience property to access the contents of ``uncertainty``.
+        The uncertainty is stored as variance, so this is the array itself,
+        not a copy: modifying it in place modifies the uncertainty. The
+        standard deviation has to be computed explicitly from it. Arrays
+        assigned to it are copied.
         """
         arr = self._get_uncertainty()
         if arr is not None:
-            return arr.array**2
+            return arr.array
 
     @variance.setter
     def variance(self, value):
-        self.uncertainty = new_variance_uncertainty_instance(value)
+        current = self._uncertainty
+        if value is not None and isinstance(current, VarianceUncertainty):
+            if value is current.array:
+                # Eg, after ``ndd.variance += 1``. Nothing to copy
+                return
+        self.uncertainty = (None if value is None else
+                            new_variance_uncertainty_instance(value, copy=True))
+
+    def read_into(self, plane, out, section=None):
+        """
+        Writes the contents of one of the planes (or a section of it) into
+        an existing array. Lazily-loaded pixels are decoded straight from the
+        file into ``out``, so that filling a window of a larger buffer takes
+        a single copy.
+
+        Args
+        -----
+        plane : str
+            'data', 'mask' or 'variance'
+        out : ndarray
+            The destination, of the same shape as the section. The pixels
+            are converted to its dtype
+        section : slice or tuple of slices
+            The section to read (the full plane, if `None`)
+
+        Returns
+        --------
+        The dtype of the plane, or `None` if this instance doesn't have it
+        (and nothing was written)
+        """
+        source = getattr(self, _PLANES[plane])
+        if source is not None:
+            if is_lazy(source):
+                source.read(section, out=out)
+            else:
+                arr = (source.array if isinstance(source, VarianceUncertainty)
+                       else np.asarray(source))
+                out[...] = arr if section is None else arr[section]
+            return _plane_dtype(source)
+
+    def plane_dtype(self, plane):
+        """
+        The dtype of one of the planes ('data', 'mask' or 'variance'), found
+        without reading its pixels, or `None` if this instance doesn't have
+        it. This is the dtype that ``read_into`` returns.
+        """
+        source = getattr(self, _PLANES[plane])
+        if source is not None:
+            return _plane_dtype(source)
 
     def set_section(self, section, input):
         """
@@ -300,6 +504,108 @@ class NDAstroData(NDArithmeticMixin, NDSlicingMixin, NDData):
         if self.mask is not None:
             self.mask[section] = input.mask
 
+    def arithmetic_in_place(self, operation, operand):
+        """
+        Adds, subtracts, multiplies or divides by ``operand`` modifying the
+        data, uncertainty and mask arrays of this instance, instead of
+        creating new ones like the ``NDArithmeticMixin`` methods. The results
+        are the same as those methods give with ``handle_mask=np.bitwise_or``
+        and ``handle_meta='first_found'``: the variances are propagated with
+        the same formulae (and order of operations) and the masks are ORed.
+
+        This is only possible when the results have the same types and shapes
+        as the arrays of this instance, and there are no units to deal with.
+        Otherwise nothing is modified, and the regular methods should be used.
+
+        Anything else referencing these arrays sees the results too, so only
+        use it on arrays that nobody else holds.
+
+        Args
+        -----
+        operation : str
+            'add', 'subtract', 'multiply' or 'divide'
+        operand : ``NDData``-like instance, array, or number
+            The second operand
+
+        Returns
+        --------
+        `True` if the operation was done in place, `False` otherwise
+        """
+        ufunc = _IN_PLACE_UFUNCS.get(operation)
+        if ufunc is None or self.unit is not None or is_lazy(self._data):
+            return False
+        data, mask, uncertainty = self.data, self.mask, self.uncertainty
+        if not (isinstance(data, np.ndarray) and data.flags.writeable):
+            return False
+
+        if isinstance(operand, NDData):
+            if (operand.unit is not None or
+                    (self.wcs is None and operand.wcs is not None) or
+                    (not self.meta and operand.meta)):
+                return False
+            other, other_mask = np.asarray(operand.data), operand.mask
+            other_uncertainty = operand.uncertainty
+        else:
+            if isinstance(operand, np.ma.MaskedArray):
+                return False
+            if np.isscalar(operand) and not isinstance(operand, np.number):
+                # Python scalars keep the type of the data (NEP 50)
+                other = np.array(operand, dtype=np.result_type(data, operand))
+            else:
+                other = np.asarray(operand)
+            other_mask = other_uncertainty = None
+
+        # The arrays of this instance must be able to hold the results
+        # (and must not be the operand's arrays, or views of them)
+        var = other_var = None
+        if other_uncertainty is not None:
+            if uncertainty is None or not isinstance(other_uncertainty,
+                                                     VarianceUncertainty):
+                return False
+            other_var = other_uncertainty.array
+        if uncertainty is not None:
+            if not isinstance(uncertainty, VarianceUncertainty):
+                return False
+            var = uncertainty.array
+            if (np.result_type(*[arr for arr in (data, other, var, other_var)
+                                 if arr is not None]) != var.dtype):
+                return False
+        if other_mask is not None:
+            if mask is not None and (mask.dtype != np.result_type(mask,
+                                                                  other_mask)):
+                return False
+            other_mask = np.asarray(other_mask)
+        arrays = [arr for arr in (data, mask, var) if arr is not None]
+        others = [arr for arr in (other, other_mask, other_var)
+                  if arr is not None]
+        if (np.result_type(data, other) != data.dtype or
+                np.broadcast(*(arrays + others)).shape != data.shape or
+                any(np.may_share_memory(arr, other_arr)
+                    for arr in arrays for other_arr in others)):
+            return False
+
+        if var is not None:
+            if operation in ('add', 'subtract'):
+                if other_var is not None:
+                    var += other_var
+            else:
+                # left = |B**2 * dA|, right = |A**2 * dB|
+                np.multiply(np.square(other), var, out=var)
+                np.abs(var, out=var)
+                if other_var is not None:
+                    right = np.square(data) * other_var
+                    var += np.abs(right, out=right)
+                if operation == 'divide':
+                    var /= np.power(other, 4)
+
+        ufunc(data, other, out=data)
+        if other_mask is not None:
+            if mask is None:
+                self.mask = deepcopy(other_mask)
+            else:
+                np.bitwise_or(mask, other_mask, out=mask)
+        return True
+
     def __repr__(self):
         if is_lazy(self._data):
             return self.__class__.__name__ + '(Memmapped)'
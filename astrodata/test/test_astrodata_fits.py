@@ -127,3 +127,338 @@ def test_write_without_exceptions():
     ad = from_chara('N20131215S0202_refcatAdded.fits')
     with tempfile.TemporaryFile() as tf:
         ad.write(tf)
+
+# The factory should open a file only once, passing the HDUList it used for
+# matching on to the loader
+def test_open_file_only_once(monkeypatch):
+    from astropy.io import fits
+    hdul = fits.HDUList([fits.PrimaryHDU(),
+                         fits.ImageHDU(np.zeros((4, 4), dtype=np.float32), name='SCI')])
+    hdul[1].header['EXTVER'] = 1
+    tmpdir = tempfile.mkdtemp()
+    path = os.path.join(tmpdir, 'single_open.fits')
+    hdul.writeto(path)
+
+    calls = []
+    fits_open = fits.open
+    def counting_open(*args, **kw):
+        calls.append(args)
+        return fits_open(*args, **kw)
+    monkeypatch.setattr(fits, 'open', counting_open)
+
+    ad = astrodata.open(path)
+    assert len(calls) == 1
+    assert ad.path == path
+    assert ad.orig_filename == 'single_open.fits'
+    assert len(ad) == 1
+
+# Tags and descriptors are cached, but the cache is invalidated when the
+# headers change
+def test_tags_and_descriptors_follow_header_changes():
+    from astropy.io import fits
+
+    class AstroDataCacheTest(astrodata.AstroDataFits):
+        @astrodata.astro_data_tag
+        def _tag_bias(self):
+            if self.phu.get('OBSTYPE') == 'BIAS':
+                return astrodata.TagSet(['BIAS', 'CAL'])
+
+        @astrodata.astro_data_descriptor
+        def gain(self):
+            return self.hdr.get('GAIN')
+
+        @astrodata.astro_data_descriptor
+        def exposure_time(self):
+            return self.phu.get('EXPTIME')
+
+        @astrodata.astro_data_descriptor
+        def naxis(self):
+            return self.phu.get('NAXIS')
+
+    hdul = fits.HDUList([fits.PrimaryHDU(),
+                         fits.ImageHDU(np.zeros((4, 4), dtype=np.float32), name='SCI')])
+    hdul[0].header['OBSTYPE'] = 'BIAS'
+    hdul[1].header['EXTVER'] = 1
+    hdul[1].header['GAIN'] = 2.0
+    ad = AstroDataCacheTest.load(hdul)
+
+    assert ad.tags == set(['BIAS', 'CAL'])
+    ad.phu['OBSTYPE'] = 'OBJECT'
+    assert ad.tags == set()
+    assert ad.gain() == [2.0]
+    ad.hdr['GAIN'] = 3.0
+    assert ad.gain() == [3.0]
+    ad[0].hdr.set('GAIN', 4.0)
+    assert ad.gain() == [4.0]
+
+    # Including the changes made to the cards themselves
+    ad.phu['EXPTIME'] = 10.
+    assert ad.exposure_time() == 10.
+    ad.phu.cards['EXPTIME'].value = 20.
+    assert ad.exposure_time() == 20.
+    ad[0].hdr.cards['GAIN'].value = 5.0
+    assert ad.gain() == [5.0]
+    ad.phu.cards['OBSTYPE'].value = 'BIAS'
+    assert ad.tags == set(['BIAS', 'CAL'])
+    assert ad.naxis() == 0
+    ad.phu.strip()
+    assert ad.naxis() is None
+
+# The cached descriptor values can't be changed through the returned objects
+def test_cached_descriptors_are_copied():
+    from astropy.io import fits
+
+    class AstroDataCacheTest(astrodata.AstroDataFits):
+        @astrodata.astro_data_descriptor
+        def section(self):
+            return np.arange(4)
+
+        @astrodata.astro_data_descriptor
+        def nested(self):
+            return [[1, 2], {'a': [3]}]
+
+    hdul = fits.HDUList([fits.PrimaryHDU(),
+                         fits.ImageHDU(np.zeros((4, 4), dtype=np.float32), name='SCI')])
+    ad = AstroDataCacheTest.load(hdul)
+
+    ad.section()[0] = 99
+    assert np.array_equal(ad.section(), np.arange(4))
+    nested = ad.nested()
+    nested[0].append(5)
+    nested[1]['a'][0] = 0
+    assert ad.nested() == [[1, 2], {'a': [3]}]
+
+# The tag methods and descriptors are registered once, when the class is
+# created. Check that the registry matches what we'd get by inspecting the
+# class, and that it follows the tag methods and descriptors added later
+def test_tag_and_descriptor_registry():
+    import inspect
+
+    class AstroDataRegistryTest(astrodata.AstroDataFits):
+        @astrodata.astro_data_tag
+        def _tag_b(self):
+            return astrodata.TagSet(['B'])
+
+        @astrodata.astro_data_tag
+        def _tag_a(self):
+            return astrodata.TagSet(['A'])
+
+        @astrodata.astro_data_descriptor
+        def gain(self):
+            return 1.0
+
+    cls = AstroDataRegistryTest
+    def inspected_tags():
+        return tuple(m for (n, m) in inspect.getmembers(cls, lambda x: hasattr(x, 'tag_method')))
+    def inspected_descriptors():
+        return tuple(n for (n, m) in inspect.getmembers(cls, lambda x: hasattr(x, 'descriptor_method')))
+
+    assert cls._tag_methods == inspected_tags()
+    assert cls._descriptor_names == inspected_descriptors()
+    assert [m.__name__ for m in cls._tag_methods] == ['_tag_a', '_tag_b']
+    assert 'gain' in cls._descriptor_names and 'instrument' in cls._descriptor_names
+    assert cls._descriptor_names == tuple(sorted(cls._descriptor_names))
+
+    # Setting a tag method or a descriptor on the class updates the registry
+    @astrodata.astro_data_tag
+    def _tag_c(self):
+        return astrodata.TagSet(['C'])
+
+    @astrodata.astro_data_descriptor
+    def read_noise(self):
+        return 3.0
+
+    cls._tag_c = _tag_c
+    cls.read_noise = read_noise
+    assert [m.__name__ for m in cls._tag_methods] == ['_tag_a', '_tag_b', '_tag_c']
+    assert 'read_noise' in cls._descriptor_names
+    assert cls._tag_methods == inspected_tags()
+    assert cls._descriptor_names == inspected_descriptors()
+
+    # Other attributes leave it as it is
+    tag_methods = cls._tag_methods
+    cls.some_value = 1
+    assert cls._tag_methods is tag_methods
+
+# Arithmetic with calibrations can be done in place, with the same results
+# as the NDArithmeticMixin methods
+def test_arithmetic_in_place():
+    from astropy.io import fits
+    from astrodata.nddata import NDAstroData
+
+    def make_ad(seed):
+        rng = np.random.RandomState(seed)
+        ad = astrodata.create(fits.PrimaryHDU())
+        for i in range(2):
+            ad.append(rng.normal(100., 10., (20, 30)).astype(np.float32))
+            ad[-1].variance = rng.uniform(1., 5., (20, 30)).astype(np.float32)
+            ad[-1].mask = (rng.rand(20, 30) > 0.9).astype(np.uint16) << i
+        return ad
+
+    for operation in ('add', 'subtract', 'multiply', 'divide'):
+        for operand in (2.5, make_ad(1)):
+            ad = make_ad(0)
+            expected = [getattr(NDAstroData, operation)(
+                make_ad(0).nddata[i], operand if np.isscalar(operand)
+                else operand.nddata[i], handle_mask=np.bitwise_or,
+                handle_meta='first_found') for i in range(len(ad))]
+            arrays = [(ext.data, ext.mask, ext.variance) for ext in ad]
+            assert ad._arithmetic_in_place(operation, operand) is ad
+            for ext, ndd, (data, mask, var) in zip(ad, expected, arrays):
+                assert ext.data is data and ext.mask is mask
+                assert ext.variance is var
+                np.testing.assert_array_equal(ext.data, ndd.data)
+                np.testing.assert_array_equal(ext.mask, ndd.mask)
+                np.testing.assert_array_equal(ext.variance, ndd.variance)
+
+    # Results that need a different type still produce new arrays
+    ad = make_ad(0)
+    data = ad[0].data
+    ad._arithmetic_in_place('add', np.ones((20, 30)))
+    assert ad[0].data is not data and ad[0].data.dtype == np.float64
+
+    # So do the regular methods, and single slices can do it too
+    ad = make_ad(0)
+    data = ad[1].data
+    ad.subtract(2.5)
+    assert ad[1].data is not data
+    data = ad[1].data
+    ad[1]._arithmetic_in_place('multiply', 2.)
+    assert ad[1].data is data
+
+# The regular arithmetic methods don't modify arrays that something else
+# may be holding
+def test_arithmetic_keeps_references():
+    from astropy.io import fits
+
+    ad = astrodata.create(fits.PrimaryHDU())
+    ad.append(np.ones((5, 5), dtype=np.float32))
+    ad[0].variance = np.ones((5, 5), dtype=np.float32)
+    other = astrodata.create(fits.PrimaryHDU())
+    other.append(ad[0].nddata)
+    other.add(5)
+    np.testing.assert_array_equal(ad[0].data, 1.)
+    np.testing.assert_array_equal(other[0].data, 6.)
+
+    data, variance = ad[0].data, ad[0].variance
+    ad.multiply(2)
+    np.testing.assert_array_equal(data, 1.)
+    np.testing.assert_array_equal(variance, 1.)
+    np.testing.assert_array_equal(ad[0].data, 2.)
+    np.testing.assert_array_equal(ad[0].variance, 4.)
+
+# The variance is stored as such, and written to (and read from) the VAR
+# extension without any conversion
+def test_variance_storage(tmpdir):
+    from astropy.io import fits
+    from astropy.nddata import StdDevUncertainty, VarianceUncertainty
+    from astrodata.nddata import NDAstroData
+
+    rng = np.random.RandomState(0)
+    var = rng.uniform(1., 5., (20, 30)).astype(np.float32)
+    rng_var = var.copy()
+    ad = astrodata.create(fits.PrimaryHDU())
+    ad.append(rng.normal(100., 10., (20, 30)).astype(np.float32))
+    ad[0].variance = var
+    assert isinstance(ad[0].uncertainty, VarianceUncertainty)
+    stored = ad[0].variance
+    assert stored is ad[0].uncertainty.array and stored is ad[0].variance
+    ad[0].variance += 1
+    assert ad[0].variance is stored
+    assert ad[0].nddata.window[2:4, 3:5].variance.base is stored
+
+    # The arrays assigned are copied, and don't see the arithmetic
+    np.testing.assert_array_equal(stored, var + 1)
+    ad[0].variance = var
+    ad._arithmetic_in_place('multiply', 2)
+    np.testing.assert_array_equal(ad[0].variance, 4 * var)
+    assert ad[0].variance is not var
+    ad[0].nddata.variance = var
+    ad[0].append(var, name='VAR')
+    ad._arithmetic_in_place('multiply', 0.5)
+    np.testing.assert_array_equal(var, rng_var)
+    ad[0].variance = var
+
+    # Standard deviations are converted when they're set
+    ndd = NDAstroData(np.ones((3, 3)), uncertainty=StdDevUncertainty(
+        np.full((3, 3), 3.)))
+    assert isinstance(ndd.uncertainty, VarianceUncertainty)
+    np.testing.assert_array_equal(ndd.variance, 9.)
+    np.testing.assert_array_equal(ndd.add(ndd).variance, 18.)
+
+    testfile = str(tmpdir.join('variance.fits'))
+    ad.write(testfile)
+    with fits.open(testfile) as hdulist:
+        assert hdulist['VAR'].data.dtype.itemsize == 4
+        np.testing.assert_array_equal(hdulist['VAR'].data, var)
+    np.testing.assert_array_equal(astrodata.open(testfile)[0].variance, var)
+    ad[0].variance = None
+    assert ad[0].uncertainty is None
+
+# Scaled pixels are decoded from the file straight into the output arrays
+def test_lazy_scaled_read(tmpdir):
+    from astropy.io import fits
+    from astrodata.fits import FitsLazyLoadable
+
+    rng = np.random.RandomState(0)
+    raw = rng.randint(-30000, 30000, (300, 200)).astype(np.int16)
+    unsigned = fits.ImageHDU(rng.randint(0, 60000, (300, 200)).astype(np.uint16),
+                             name='SCI', ver=1)
+    scaled = fits.ImageHDU(raw, name='SCI', ver=2)
+    scaled.header['BSCALE'] = 1.7
+    scaled.header['BZERO'] = 12.3
+    testfile = str(tmpdir.join('scaled.fits'))
+    fits.HDUList([fits.PrimaryHDU(), unsigned, scaled]).writeto(testfile)
+
+    expected = {1: unsigned.data,
+                2: (1.7 * raw.astype(np.float64) + 12.3).astype(np.float32)}
+    ad = astrodata.open(testfile)
+    for ext in ad:
+        ndd = ext.nddata
+        assert isinstance(ndd._data, FitsLazyLoadable)
+        ref = expected[ext.hdr['EXTVER']]
+        section = (slice(10, 50), slice(3, 150, 2))
+        out = np.zeros((60, 100), dtype=np.float32)
+        assert ndd.read_into('data', out[5:45, :74], section=section) == ref.dtype
+        np.testing.assert_array_equal(out[5:45, :74], ref[section])
+        assert not out[:5].any() and not out[:, 74:].any()
+
+        window = ndd.window[10:50, 3:150]
+        assert window.shape == (40, 147)
+        np.testing.assert_array_equal(window.data, ref[10:50, 3:150])
+        assert window.read_into('mask', out[:40, :147]) is None
+
+        # Small chunks give the same results
+        ndd._data._scaling_chunk = 1000
+        data = ndd._data.data
+        assert data.dtype == ref.dtype and data.dtype.isnative
+        np.testing.assert_array_equal(data, ref)
+        np.testing.assert_array_equal(ext.data, ref)
+
+# Windows of tile-compressed images are read without decompressing it all
+def test_lazy_compressed_window(tmpdir):
+    from astropy.io import fits
+
+    rng = np.random.RandomState(0)
+    raw = rng.randint(0, 300, (200, 120)).astype(np.int16)
+    # Integer pixels, as floating point ones are compressed lossily
+    plain = fits.CompImageHDU(raw, name='SCI')
+    scaled = fits.CompImageHDU(raw, name='SCI')
+    scaled.scale('int16', bscale=2., bzero=10.)
+    plain.header['EXTVER'] = 1
+    scaled.header['EXTVER'] = 2
+    testfile = str(tmpdir.join('compressed.fits.fz'))
+    fits.HDUList([fits.PrimaryHDU(), plain, scaled]).writeto(testfile)
+
+    ad = astrodata.open(testfile)
+    for ext in ad:
+        hdu = ext.nddata._data._obj
+        ref = fits.getdata(testfile, 'SCI', ext.hdr['EXTVER'])
+        window = ext.nddata.window[20:60, 5:105]
+        np.testing.assert_array_equal(window.data, ref[20:60, 5:105])
+        out = np.empty((40, 100), dtype=np.float32)
+        ext.nddata.read_into('data', out, section=(slice(150, 190),
+                                                   slice(10, 110)))
+        np.testing.assert_array_equal(out, ref[150:190, 10:110])
+        assert not hdu._data_loaded
+        np.testing.assert_array_equal(ext.data, ref)
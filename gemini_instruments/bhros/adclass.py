@@ -3,6 +3,7 @@ from ..gemini import AstroDataGemini
 from .. import gmu
 
 class AstroDataBhros(AstroDataGemini):
+    _phu_sufficient = True
 
     __keyword_dict = dict(array_section = 'CCDSEC',
                           central_wavelength = 'WAVELENG',
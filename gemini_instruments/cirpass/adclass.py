@@ -17,6 +17,8 @@ from ..gemini import AstroDataGemini
 
 # ------------------------------------------------------------------------------
 class AstroDataCirpass(AstroDataGemini):
+    _phu_sufficient = True
+
     __keyword_dict = dict(
         ra = 'TEL_RA',
         dec = 'TEC_DEC',
@@ -11,6 +11,7 @@ from ..common import section_to_tuple, build_group_id
 from .. import gmu
 
 class AstroDataF2(AstroDataGemini):
+    _phu_sufficient = True
 
     __keyword_dict = dict(camera = 'LYOT',
                           central_wavelength = 'GRWLEN',
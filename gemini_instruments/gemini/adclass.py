@@ -111,6 +111,8 @@ gemini_keyword_names = dict(
 
 # ------------------------------------------------------------------------------
 class AstroDataGemini(AstroDataFits):
+    _phu_sufficient = True
+
     __keyword_dict = gemini_keyword_names
 
     @staticmethod
@@ -10,6 +10,7 @@ from ..common import Section
 from ..gemini import AstroDataGemini
 
 class AstroDataGmos(AstroDataGemini):
+    _phu_sufficient = True
 
     __keyword_dict = dict(array_name = 'AMPNAME',
                           array_section = 'CCDSEC',
@@ -12,6 +12,7 @@ from .lookup import detector_properties, nominal_zeropoints, config_dict, read_m
 from .. import gmu
 
 class AstroDataGnirs(AstroDataGemini):
+    _phu_sufficient = True
 
     __keyword_dict = dict(central_wavelength = 'GRATWAVE',
                           )
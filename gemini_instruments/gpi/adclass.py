@@ -6,6 +6,7 @@ from ..gemini import AstroDataGemini
 from .. import gmu
 
 class AstroDataGpi(AstroDataGemini):
+    _phu_sufficient = True
 
     __keyword_dict = dict(array_section = 'DATASEC',
                           detector_section = 'DATASEC',
@@ -3,6 +3,7 @@ from ..gemini import AstroDataGemini
 from .. import gmu
 
 class AstroDataGraces(AstroDataGemini):
+    _phu_sufficient = True
 
     __keyword_dict = dict(detector = 'DETECTOR',
                           )
@@ -7,6 +7,8 @@ from ..common import build_group_id
 from . import lookup
 
 class AstroDataGsaoi(AstroDataGemini):
+    _phu_sufficient = True
+
     __keyword_dict = dict(array_section='CCDSEC',
                           camera='DETECTOR',
                           central_wavelength='WAVELENG',
@@ -17,6 +17,8 @@ from ..gemini import AstroDataGemini
 
 # ------------------------------------------------------------------------------
 class AstroDataHokupaaQUIRC(AstroDataGemini):
+    _phu_sufficient = True
+
     __keyword_dict = dict(
         airmass = 'AMEND',
         wavelength_band = 'FILTER',
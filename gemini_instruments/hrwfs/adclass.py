@@ -17,6 +17,8 @@ from ..gemini import AstroDataGemini
 
 # ------------------------------------------------------------------------------
 class AstroDataHrwfs(AstroDataGemini):
+    _phu_sufficient = True
+
     __keyword_dict = dict(
         target_ra = 'CRVAL1',
         target_dec = 'CRVAL2',
@@ -2,6 +2,7 @@ from astrodata import astro_data_tag, astro_data_descriptor, returns_list, TagSe
 from ..gemini import AstroDataGemini
 
 class AstroDataMichelle(AstroDataGemini):
+    _phu_sufficient = True
 
     __keyword_dict = dict(central_wavelength = 'GRATPOS',
                           coadds = 'NUMEXPOS',
@@ -3,6 +3,8 @@ from ..gemini import AstroDataGemini
 from .. import gmu
 
 class AstroDataNici(AstroDataGemini):
+    _phu_sufficient = True
+
     @staticmethod
     def _matches_data(source):
         return source[0].header.get('INSTRUME', '').upper() == 'NICI'
@@ -9,6 +9,7 @@ from .lookup import constants_by_bias, config_dict, lnrs_mode_map
 from .. import gmu
 
 class AstroDataNifs(AstroDataGemini):
+    _phu_sufficient = True
 
     __keyword_dict = dict(array_section = 'DATASEC',
                           camera = 'INSTRUME',
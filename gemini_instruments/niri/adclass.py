@@ -7,6 +7,7 @@ from .. import gmu
 from ..common import build_ir_section, build_group_id
 
 class AstroDataNiri(AstroDataGemini):
+    _phu_sufficient = True
 
     # NIRI has no specific keyword overrides
 
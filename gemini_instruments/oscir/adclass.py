@@ -6,6 +6,7 @@ from ..gemini import AstroDataGemini
 from .. import gmu
 
 class AstroDataOscir(AstroDataGemini):
+    _phu_sufficient = True
 
     @staticmethod
     def _matches_data(source):
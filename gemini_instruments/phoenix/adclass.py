@@ -21,6 +21,7 @@ from .. import gmu
 
 # ------------------------------------------------------------------------------
 class AstroDataPhoenix(AstroDataGemini):
+    _phu_sufficient = True
 
     __keyword_dict = dict(focal_plane_mask = 'SLIT_POS')
 
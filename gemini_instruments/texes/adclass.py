@@ -21,6 +21,8 @@ from ..gemini import AstroDataGemini
 
 # ------------------------------------------------------------------------------
 class AstroDataTexes(AstroDataGemini):
+    _phu_sufficient = True
+
     __keyword_dict = dict(
         ra = 'RA',
         dec = 'DEC',
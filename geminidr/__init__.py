@@ -17,13 +17,15 @@ E.g.,
 # ------------------------------------------------------------------------------
 import os
 import pickle
+import sqlite3
+import threading
 import warnings
 from copy import deepcopy
 from inspect import stack, isclass
 from multiprocessing import Process, Queue
 from subprocess import check_output, STDOUT, CalledProcessError
 
-from queue import Empty
+from queue import Empty, LifoQueue
 import atexit
 
 from gempy.library import config
@@ -52,7 +54,7 @@ caches = {
     'calibrations' : CALS
     }
 
-calindfile = os.path.join('.', caches['reducecache'], "calindex.pkl")
+calindfile = os.path.join('.', caches['reducecache'], "calindex.db")
 stkindfile = os.path.join('.', caches['reducecache'], "stkindex.pkl")
 
 def set_caches():
@@ -75,11 +77,20 @@ def save_cache(object, cachefile):
 
 # ------------------------- END caches------------------------------------------
 class Calibrations(object):
+    """
+    Mapping of (ad, caltype) to processed calibration file(s), indexed by
+    ad.calibration_key(). The associations are kept in an SQLite database,
+    so each one is written to disk as soon as it is made, and several
+    reduce processes working in the same directory can share it. An old
+    pickled index (calindex.pkl) is imported when the database is created.
+    """
     def __init__(self, calindfile, user_cals={}, *args, **kwargs):
         self._calindfile = calindfile
-        self._dict = {}
-        self._dict.update(load_cache(self._calindfile))
         self._usercals = user_cals or {}                 # Handle user_cals=None
+        self._conn = None
+        self._pid = None
+        self._lock = threading.RLock()
+        self._connect()
 
     def __getitem__(self, key):
         return self._get_cal(*key)
@@ -91,26 +102,86 @@ class Calibrations(object):
     def __delitem__(self, key):
         # Cope with malformed keys
         try:
-            self._dict.pop((key[0].calibration_key(), key[1]), None)
+            key = (key[0].calibration_key(), key[1])
         except (TypeError, IndexError):
+            return
+        self._execute("DELETE FROM calibrations WHERE calkey=? AND caltype=?",
+                      (self._dbkey(key[0]), key[1]))
+
+    def __getstate__(self):
+        # The connection and lock can't be copied or pickled
+        state = self.__dict__.copy()
+        state.update({'_conn': None, '_pid': None, '_lock': None})
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _dbkey(calkey):
+        return sqlite3.Binary(pickle.dumps(calkey, protocol=2))
+
+    def _connect(self):
+        # Connections can't be shared with a forked process, so make a new
+        # one if we find ourselves in a different process
+        if self._conn is not None and self._pid == os.getpid():
+            return self._conn
+        create = not os.path.exists(self._calindfile)
+        # Wait for other processes' writes to finish rather than fail
+        conn = sqlite3.connect(self._calindfile, timeout=60,
+                               check_same_thread=False)
+        try:
+            # Readers don't block the writer (or vice versa) in WAL mode
+            conn.execute("PRAGMA journal_mode=WAL")
+        except sqlite3.OperationalError:
             pass
+        with conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS calibrations "
+                         "(calkey BLOB, caltype TEXT, calfile BLOB, "
+                         "PRIMARY KEY (calkey, caltype))")
+        self._conn, self._pid = conn, os.getpid()
+        if create:
+            legacy = os.path.splitext(self._calindfile)[0] + ".pkl"
+            old_index = load_cache(legacy)
+            if old_index:
+                self._execute_many(
+                    "INSERT OR REPLACE INTO calibrations VALUES (?,?,?)",
+                    [(self._dbkey(k[0]), k[1], sqlite3.Binary(pickle.dumps(v, protocol=2)))
+                     for k, v in old_index.items()])
+        return conn
+
+    def _execute(self, sql, args):
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                return conn.execute(sql, args).fetchall()
+
+    def _execute_many(self, sql, args):
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany(sql, args)
 
     def _add_cal(self, key, val):
         # Munge the key from (ad, caltype) to (ad.calibration_key, caltype)
         key = (key[0].calibration_key(), key[1])
-        self._dict.update({key: val})
-        self.cache_to_disk()
+        self._execute("INSERT OR REPLACE INTO calibrations VALUES (?,?,?)",
+                      (self._dbkey(key[0]), key[1],
+                       sqlite3.Binary(pickle.dumps(val, protocol=2))))
         return
 
     def _get_cal(self, ad, caltype):
         key = (ad.calibration_key(), caltype)
         if key in self._usercals:
             return self._usercals[key]
-        calfile = self._dict.get(key)
-        return calfile
+        rows = self._execute("SELECT calfile FROM calibrations "
+                             "WHERE calkey=? AND caltype=?",
+                             (self._dbkey(key[0]), key[1]))
+        return pickle.loads(bytes(rows[0][0])) if rows else None
 
     def cache_to_disk(self):
-        save_cache(self._dict, self._calindfile)
+        # Every change is written immediately, so there's nothing to do
         return
 # ------------------------------------------------------------------------------
 def cmdloop(inQueue, outQueue):
@@ -127,6 +198,86 @@ def cleanup(process):
     # Ensure the child process is terminated with the parent
     process.terminate()
 
+class CommandHost(object):
+    """
+    A set of small processes that run shell commands (e.g., SExtractor) on
+    behalf of the primitives. Spawning a command makes a copy of its parent
+    process in RAM, so it's better done from a process with a small memory
+    footprint than from the reduction itself.
+
+    Each worker runs one command at a time, so up to num_workers commands
+    (issued from different threads) can run concurrently. Workers are
+    started by start(), or when the first command is run.
+    """
+    def __init__(self, num_workers=1):
+        self.num_workers = num_workers
+        self._workers = []
+        self._idle = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            # Workers can't be shared with a forked process
+            if self._workers and self._pid == os.getpid():
+                return
+            self._workers = []
+            self._idle = LifoQueue()
+            self._pid = os.getpid()
+            for i in range(self.num_workers):
+                in_queue, out_queue = Queue(), Queue()
+                process = Process(target=cmdloop, args=(in_queue, out_queue))
+                process.start()
+                atexit.register(cleanup, process)
+                worker = (process, in_queue, out_queue)
+                self._workers.append(worker)
+                self._idle.put(worker)
+
+    def run(self, cmd):
+        """
+        Run a command (a list, as for subprocess.check_output) in one of
+        the workers, waiting for one to become free if necessary. Returns
+        the command's output, or the CalledProcessError if it failed.
+        """
+        self.start()
+        worker = self._idle.get()
+        try:
+            process, in_queue, out_queue = worker
+            in_queue.put(cmd)
+            return out_queue.get()
+        finally:
+            self._idle.put(worker)
+
+    def terminate(self):
+        with self._lock:
+            for process, _, _ in self._workers:
+                process.terminate()
+            self._workers = []
+
+# A CommandHost used by all PrimitivesBASE instances, if requested
+_shared_cmd_host = None
+
+def use_shared_command_host(num_workers=1):
+    """
+    Make all PrimitivesBASE instances created from now on share a single
+    CommandHost with num_workers processes, instead of each starting its
+    own process. This saves a process spawn per primitives instance when
+    reductions are run repeatedly from one program. The workers are started
+    when first needed and live until the program exits. Calling this again
+    with a different num_workers replaces the shared host.
+
+    Returns
+    -------
+    CommandHost
+        the shared host
+    """
+    global _shared_cmd_host
+    if _shared_cmd_host is None or _shared_cmd_host.num_workers != num_workers:
+        if _shared_cmd_host is not None:
+            _shared_cmd_host.terminate()
+        _shared_cmd_host = CommandHost(num_workers=num_workers)
+    return _shared_cmd_host
+
 @parameter_override
 class PrimitivesBASE(object):
     """
@@ -169,23 +320,35 @@ class PrimitivesBASE(object):
         self.calibrations     = Calibrations(calindfile, user_cals=ucals)
         self.stacks           = load_cache(stkindfile)
 
-        # This lambda will return the name of the current caller.
-        self.myself           = lambda: stack()[1][3]
+        # Names of the primitives currently running (innermost last), kept
+        # up to date by the parameter_override decorator. self.myself()
+        # returns the last one, which saves walking the stack.
+        self._primitive_names = []
+        self.myself           = self._current_primitive
 
         warnings.simplefilter('ignore', category=VerifyWarning)
 
         # Create a parallel process to which we can send shell commands.
         # Spawning a shell command makes a copy of its parent process in RAM
         # so we need this process to have a small memory footprint.
-        self._inQueue = Queue()
-        self._outQueue = Queue()
-        self._cmd_host_process = Process(target=cmdloop, args=(self._inQueue,
-                                                               self._outQueue))
-        self._cmd_host_process.start()
-        atexit.register(cleanup, self._cmd_host_process)
+        # (Unless one host is being shared by all instances.)
+        if _shared_cmd_host is None:
+            self._cmd_host = CommandHost()
+            self._cmd_host.start()
+        else:
+            self._cmd_host = _shared_cmd_host
+
+    def _current_primitive(self):
+        # Return the name of the running primitive or, if called from
+        # outside one, the name of the calling function
+        try:
+            return self._primitive_names[-1]
+        except IndexError:
+            return stack()[1][3]
 
     def _kill_subprocess(self):
-        self._cmd_host_process.terminate()
+        if self._cmd_host is not _shared_cmd_host:
+            self._cmd_host.terminate()
 
     @property
     def upload(self):
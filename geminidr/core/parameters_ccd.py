@@ -25,6 +25,8 @@ class subtractOverscanConfig(config.Config):
                                int, None, min=0, optional=True)
     order = config.RangeField("Order of fitting function", int, None, min=0,
                               optional=True)
+    num_threads = config.RangeField("Number of threads for fitting extensions",
+                                    int, 1, min=1)
 
     def validate(self):
         config.Config.validate(self)
@@ -13,3 +13,4 @@ class resampleToCommonFrameConfig(config.Config):
                                                "spline5": "qunitic spline"},
                                       default="nearest")
     trim_data = config.Field("Trim to field of view of reference image?", bool, False)
+    pad_data = config.Field("Pad images to the full output frame?", bool, True)
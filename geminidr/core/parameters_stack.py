@@ -32,7 +32,11 @@ class core_stacking_config(config.Config):
                                    allowed = {"mean": "arithmetic mean",
                                               "wtmean": "variance-weighted mean",
                                               "median": "median",
-                                              "lmedian": "low-median"},
+                                              "lmedian": "low-median",
+                                              "fastmean": "arithmetic mean (faster version)",
+                                              "fastwtmean": "variance-weighted mean (faster version)",
+                                              "fastmedian": "median (faster version)",
+                                              "fastlmedian": "low-median (faster version)"},
                                    default="mean", optional=False)
     reject_method = config.ChoiceField("Pixel rejection method", str,
                                        allowed={"none": "no rejection",
@@ -47,6 +51,7 @@ class core_stacking_config(config.Config):
     nlow = config.RangeField("Number of low pixels to reject", int, 0, min=0)
     nhigh = config.RangeField("Number of high pixels to reject", int, 0, min=0)
     memory = config.RangeField("Memory available for stacking (GB)", float, None, min=0.1, optional=True)
+    num_workers = config.RangeField("Number of threads used for stacking", int, 1, min=1)
 
 class stackFramesConfig(core_stacking_config):
     separate_ext = config.Field("Handle extensions separately?", bool, True)
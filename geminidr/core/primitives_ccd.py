@@ -4,6 +4,8 @@
 #                                                              primitives_ccd.py
 # ------------------------------------------------------------------------------
 import numpy as np
+from numpy.lib.stride_tricks import as_strided
+from multiprocessing.pool import ThreadPool
 
 from astropy.modeling import models, fitting
 from scipy.interpolate import UnivariateSpline, LSQUnivariateSpline
@@ -86,7 +88,8 @@ class CCD(PrimitivesBASE):
 
             log.fullinfo('Subtracting this bias from {}:\n{}'.
                          format(ad.filename, bias.filename))
-            ad.subtract(bias)
+            # The primitive owns its inputs, so their arrays can be reused
+            ad._arithmetic_in_place('subtract', bias)
 
             # Record bias used, timestamp, and update filename
             ad.phu.set('BIASIM', bias.filename, self.keyword_comments['BIASIM'])
@@ -121,18 +124,20 @@ class CCD(PrimitivesBASE):
             function to fit ("polynomial" | "spline" | "none")
         order: int
             order of fit or spline/None
+        num_threads: int
+            number of threads for fitting the extensions of each input
         """
         log = self.log
         log.debug(gt.log_message("primitive", self.myself(), "starting"))
         timestamp_key = self.timestamp_keys[self.myself()]
 
         sfx = params["suffix"]
-        niterate = params["niterate"]
-        lo_rej = params["low_reject"]
-        hi_rej = params["high_reject"]
-        order = params["order"]
-        func = (params["function"] or 'none').lower()
         nbiascontam = params["nbiascontam"]
+        fit_params = {'func': (params["function"] or 'none').lower(),
+                      'order': params["order"], 'niterate': params["niterate"],
+                      'lo_rej': params["low_reject"],
+                      'hi_rej': params["high_reject"]}
+        num_threads = params["num_threads"]
 
         for ad in adinputs:
             if ad.phu.get(timestamp_key):
@@ -143,7 +148,8 @@ class CCD(PrimitivesBASE):
 
             osec_list = ad.overscan_section()
             dsec_list = ad.data_section()
-            for i, (ext, osec, dsec) in enumerate(zip(ad, osec_list, dsec_list)):
+            sections, rows, weights = [], [], []
+            for ext, osec, dsec in zip(ad, osec_list, dsec_list):
                 x1, x2, y1, y2 = osec.x1, osec.x2, osec.y1, osec.y2
                 if x1 > dsec.x1:  # Bias on right
                     x1 += nbiascontam
@@ -151,63 +157,27 @@ class CCD(PrimitivesBASE):
                 else:  # Bias on left
                     x1 += 1
                     x2 -= nbiascontam
-
-                row = np.arange(y1, y2)
-                data = np.mean(ext.data[y1:y2, x1:x2], axis=1)
+                sections.append((x1, x2, y1, y2))
+                rows.append(np.mean(ext.data[y1:y2, x1:x2], axis=1))
                 # Weights are used to determine number of spline pieces
                 # should be the estimate of the mean
                 wt = np.sqrt(x2 - x1) / ext.read_noise()
                 if ext.is_in_adu():
                     wt *= ext.gain()
+                weights.append(wt)
+
+            # All the extensions (amplifiers) are fitted together
+            fits = _fit_overscans(rows, weights, sections,
+                                  [ext.data.shape[0] for ext in ad],
+                                  num_threads=num_threads, **fit_params)
 
-                medboxsize = 2  # really 2n+1 = 5
-                for iter in range(niterate+1):
-                    # The UnivariateSpline will make reduced-chi^2=1 so it will
-                    # fit bad rows. Need to mask these before starting, so use a
-                    # running median. Probably a good starting point for all fits.
-                    if iter == 0 or func == 'none':
-                        medarray = np.full((medboxsize * 2 + 1, y2 - y1), np.nan)
-                        for i in range(-medboxsize, medboxsize + 1):
-                            mx1 = max(i, 0)
-                            mx2 = min(y2 - y1, y2 - y1 + i)
-                            medarray[medboxsize + i, mx1:mx2] = data[:mx2 - mx1]
-                        runmed = np.ma.median(np.ma.masked_where(np.isnan(medarray),
-                                                                 medarray), axis=0)
-                        residuals = data - runmed
-                        sigma = np.sqrt(x2 - x1) / wt  # read noise
-
-                    mask = np.logical_or(residuals > hi_rej * sigma
-                                        if hi_rej is not None else False,
-                                        residuals < -lo_rej * sigma
-                                        if lo_rej is not None else False)
-
-                    # Don't clip any pixels if iter==0
-                    if func == 'none' and iter < niterate:
-                        # Replace bad data with running median
-                        data = np.where(mask, runmed, data)
-                    elif func != 'none':
-                        if func == 'spline':
-                            if order:
-                                # Equally-spaced knots (like IRAF)
-                                knots = np.linspace(row[0], row[-1], order+1)[1:-1]
-                                bias = LSQUnivariateSpline(row[~mask], data[~mask], knots)
-                            else:
-                                bias = UnivariateSpline(row[~mask], data[~mask],
-                                                        w=[wt]*np.sum(~mask))
-                        else:
-                            bias_init = models.Chebyshev1D(degree=order,
-                                                           c0=np.median(data[~mask]))
-                            fit_f = fitting.LinearLSQFitter()
-                            bias = fit_f(bias_init, row[~mask], data[~mask])
-
-                        residuals = data - bias(row)
-                        sigma = np.std(residuals[~mask])
-
-                # using "-=" won't change from int to float
-                if func != 'none':
-                    data = bias(np.arange(0, ext.data.shape[0]))
-                ext.data = ext.data - np.tile(data,
-                                        (ext.data.shape[1],1)).T.astype(np.float32)
+            for ext, (x1, x2, y1, y2), (data, sigma) in zip(ad, sections, fits):
+                bias = data.astype(np.float32)[:, np.newaxis]
+                if ext.data.dtype.kind == 'f':
+                    ext.data -= bias
+                else:
+                    # using "-=" won't change from int to float
+                    ext.data = ext.data - bias
 
                 ext.hdr.set('OVERSEC', '[{}:{},{}:{}]'.format(x1+1,x2,y1+1,y2),
                             self.keyword_comments['OVERSEC'])
@@ -250,3 +220,125 @@ class CCD(PrimitivesBASE):
             gt.mark_history(ad, primname=self.myself(), keyword=timestamp_key)
             ad.update_filename(suffix=suffix, strip=True)
         return adinputs
+
+# =================================== prive ====================================
+def _fit_overscans(rows, weights, sections, nrows, func, order, niterate,
+                   lo_rej, hi_rej, num_threads=1):
+    """
+    Fit the overscan levels of a set of amplifiers. The running medians
+    used to reject bad rows are calculated for all the amplifiers together,
+    and the functions can be fitted in parallel.
+
+    Parameters
+    ----------
+    rows: list of ndarrays
+        mean of each overscan row, for each amplifier
+    weights: list of floats
+        weight of each overscan row (sqrt(number of columns)/read noise)
+    sections: list of 4-tuples
+        overscan sections (x1, x2, y1, y2) of the amplifiers
+    nrows: list of ints
+        number of rows of each amplifier's data
+    func: str
+        function to fit ("poly" | "spline" | "none")
+    order: int/None
+        order of fit or spline
+    niterate: int
+        number of rejection iterations
+    lo_rej, hi_rej: float/None
+        rejection limits (standard deviations)
+    num_threads: int
+        number of threads for fitting
+
+    Returns
+    -------
+    list of 2-tuples: the overscan level of each row and its rms for each
+        amplifier
+    """
+    medboxsize = 2  # really 2n+1 = 5
+    # Initial rejection is with respect to the read noise
+    sigmas = [np.sqrt(x2 - x1) / wt for wt, (x1, x2, _, _) in
+              zip(weights, sections)]
+
+    # The UnivariateSpline will make reduced-chi^2=1 so it will fit bad
+    # rows. Need to mask these before starting, so use a running median.
+    # Probably a good starting point for all fits.
+    runmeds = _running_medians(rows, medboxsize)
+    if func == 'none':
+        for iter in range(niterate):
+            # Replace bad data with running median
+            rows = [np.where(_reject(data - runmed, sigma, lo_rej, hi_rej),
+                             runmed, data) for data, runmed, sigma
+                    in zip(rows, runmeds, sigmas)]
+            runmeds = _running_medians(rows, medboxsize)
+        return list(zip(rows, sigmas))
+
+    def fit_amp(args):
+        data, runmed, wt, sigma, (_, _, y1, y2), ny = args
+        row = np.arange(y1, y2)
+        residuals = data - runmed
+        for iter in range(niterate+1):
+            mask = _reject(residuals, sigma, lo_rej, hi_rej)
+            if func == 'spline':
+                if order:
+                    # Equally-spaced knots (like IRAF)
+                    knots = np.linspace(row[0], row[-1], order+1)[1:-1]
+                    bias = LSQUnivariateSpline(row[~mask], data[~mask], knots)
+                else:
+                    bias = UnivariateSpline(row[~mask], data[~mask],
+                                            w=[wt]*np.sum(~mask))
+            else:
+                bias_init = models.Chebyshev1D(degree=order,
+                                               c0=np.median(data[~mask]))
+                fit_f = fitting.LinearLSQFitter()
+                bias = fit_f(bias_init, row[~mask], data[~mask])
+
+            residuals = data - bias(row)
+            sigma = np.std(residuals[~mask])
+        return bias(np.arange(0, ny)), sigma
+
+    amps = list(zip(rows, runmeds, weights, sigmas, sections, nrows))
+    if num_threads > 1 and len(amps) > 1:
+        pool = ThreadPool(min(num_threads, len(amps)))
+        try:
+            return pool.map(fit_amp, amps)
+        finally:
+            pool.terminate()
+            pool.join()
+    return [fit_amp(amp) for amp in amps]
+
+
+def _reject(residuals, sigma, lo_rej, hi_rej):
+    """Flag residuals beyond the rejection limits"""
+    return np.logical_or(residuals > hi_rej * sigma
+                         if hi_rej is not None else False,
+                         residuals < -lo_rej * sigma
+                         if lo_rej is not None else False)
+
+
+def _running_medians(rows, medboxsize):
+    """
+    Running median of each of a list of 1D arrays, in a box of 2n+1 pixels
+    centred on each pixel (truncated at the ends), ignoring NaNs. Arrays of
+    the same length are processed together, as a strided view of boxes
+    """
+    runmeds = [None] * len(rows)
+    by_length = {}
+    for i, data in enumerate(rows):
+        by_length.setdefault(len(data), []).append(i)
+    for length, indices in by_length.items():
+        padded = np.full((len(indices), length + 2 * medboxsize), np.nan)
+        padded[:, medboxsize:medboxsize+length] = [rows[i] for i in indices]
+        boxes = as_strided(padded, shape=(len(indices), length,
+                                          2 * medboxsize + 1),
+                           strides=padded.strides + padded.strides[-1:])
+        medians = np.median(boxes, axis=-1)
+        # Boxes at the ends, or with NaNs in the data, need a masked median
+        redo = np.isnan(medians)
+        if redo.any():
+            medians = np.ma.masked_array(medians)
+            medians[redo] = np.ma.median(np.ma.masked_where(
+                np.isnan(boxes[redo]), boxes[redo]), axis=-1)
+        for i, runmed in zip(indices, medians):
+            runmeds[i] = runmed
+    return runmeds
@@ -14,6 +14,7 @@ import astrodata
 import gemini_instruments
 
 from gempy.gemini import gemini_tools as gt
+from gempy.library.nddops import IncrementalStacker
 from geminidr.gemini.lookups import DQ_definitions as DQ
 
 from geminidr import PrimitivesBASE
@@ -212,10 +213,10 @@ class Preprocess(PrimitivesBASE):
                         "science AstroData object and one sky AstroData "
                         "object are required for associateSky")
         else:
-            # Create a dict with the observation times to aid in association
-            # Allows us to select suitable skies and propagate their datetimes
-            sky_times = dict(zip(ad_skies,
-                                 [ad.ut_datetime() for ad in ad_skies]))
+            # Index the skies by configuration, time and offset, unless
+            # they are all going to be used
+            if not params["use_all"]:
+                sky_index = gt.SkyAssociationIndex(ad_skies)
 
             for ad in adinputs:
                 # If use_all is True, use all of the sky AstroData objects for
@@ -225,36 +226,14 @@ class Preprocess(PrimitivesBASE):
                                  "objects with {}" .format(ad.filename))
                     sky_list = ad_skies
                 else:
-                    sci_time = ad.ut_datetime()
-                    xoffset = ad.telescope_x_offset()
-                    yoffset = ad.telescope_y_offset()
-
-                    # First, select only skies with matching configurations
-                    # and within the specified time and with sufficiently
-                    # large separation. Keep dict format
-                    sky_dict = {k: v for k, v in sky_times.items() if
-                                gt.matching_inst_config(ad1=ad, ad2=k,
-                                                        check_exposure=True)
-                                and ((k.telescope_x_offset() - xoffset)**2 +
-                                     (k.telescope_y_offset() - yoffset)**2
-                                     > min_distsq)}
-
-                    # Sort sky list by time difference and determine how many
-                    # skies will be matched by the default conditions
-                    sky_list = sorted(sky_dict, key=lambda x:
-                                      abs(sky_dict[x]-sci_time))[:max_skies]
-                    num_matching_skies = len([k for k in sky_dict
-                                              if abs(sky_dict[k]-sci_time)
-                                                 <= seconds])
-
-                    # Now create a sky list of the appropriate length
-                    num_skies = min(max_skies or len(sky_list),
-                                    max(min_skies or 0, num_matching_skies))
-                    sky_list = sky_list[:num_skies]
-
-                    # Sort sky list chronologically for presentation purposes
-                    sky_list = sorted(sky_list,
-                                      key=lambda sky: sky.ut_datetime())
+                    # Select the skies with matching configurations and
+                    # sufficiently large separations that are closest in
+                    # time, as many as are within the time limit (subject
+                    # to min_skies and max_skies), in chronological order
+                    sky_list = sky_index.associate(ad, seconds,
+                                                   min_distsq=min_distsq,
+                                                   min_skies=min_skies,
+                                                   max_skies=max_skies)
 
                 if sky_list:
                     sky_table = Table(names=('SKYNAME',),
@@ -414,7 +393,8 @@ class Preprocess(PrimitivesBASE):
             log.fullinfo("Subtracting the dark ({}) from the input "
                          "AstroData object {}".
                          format(dark.filename, ad.filename))
-            ad.subtract(dark)
+            # The primitive owns its inputs, so their arrays can be reused
+            ad._arithmetic_in_place('subtract', dark)
 
             # Record dark used, timestamp, and update filename
             ad.phu.set('DARKIM', dark.filename, self.keyword_comments["DARKIM"])
@@ -530,7 +510,8 @@ class Preprocess(PrimitivesBASE):
             # Do the division
             log.fullinfo("Dividing the input AstroData object {} by this "
                          "flat:\n{}".format(ad.filename, flat.filename))
-            ad.divide(flat)
+            # The primitive owns its inputs, so their arrays can be reused
+            ad._arithmetic_in_place('divide', flat)
 
             # Update the header and filename
             ad.phu.set("FLATIM", flat.filename, self.keyword_comments["FLATIM"])
@@ -1043,10 +1024,21 @@ class Preprocess(PrimitivesBASE):
         # means we've tried but failed and this can be passed to subtractSky)
         # Fill initial list with None where the SKYTABLE produced None
         stacked_skies = [None if tbl is None else 0 for tbl in skytables]
+        # Consecutive science frames usually share most of their skies, so
+        # if the combining method allows it, one stack is kept and updated
+        # with the skies that change
+        incremental = IncrementalStacker.supports(stack_params["operation"],
+                                                  stack_params["reject_method"])
+        sky_stackers = []
         for i, (ad, skytable) in enumerate(zip(adinputs, skytables)):
             if stacked_skies[i] == 0:
-                stacked_sky = self.stackSkyFrames([sky_dict[sky] for sky in
-                                                  skytable], **stack_params)
+                if incremental and len(skytable) > 1:
+                    stacked_sky = self._stack_sky_window(sky_stackers,
+                                        [sky_dict[sky] for sky in skytable],
+                                        **stack_params)
+                else:
+                    stacked_sky = self.stackSkyFrames([sky_dict[sky] for sky in
+                                                      skytable], **stack_params)
                 #print ad.filename, memusage(proc)
                 if len(stacked_sky) == 1:
                     stacked_sky = stacked_sky[0]
@@ -5,9 +5,9 @@
 # ------------------------------------------------------------------------------
 import numpy as np
 from astropy.wcs import WCS
-from scipy.ndimage import affine_transform
 
 from gempy.library import astrotools as at
+from gempy.library import transform
 from gempy.gemini import gemini_tools as gt
 from gempy.utils import logutils
 
@@ -80,11 +80,17 @@ class Resample(PrimitivesBASE):
                                    spline4 | spline5]
         trim_data: bool
             trim image to size of reference image?
+        pad_data: bool
+            pad every image to the full output frame? If not, each output
+            image only covers its own footprint in the output frame, and its
+            position is recorded in the FRAMESEC keyword. stackFrames puts
+            such images together without padding them in memory
         """
         log = self.log
         log.debug(gt.log_message("primitive", self.myself(), "starting"))
         interpolator = params["interpolator"]
         trim_data = params["trim_data"]
+        pad_data = params["pad_data"]
         sfx = params["suffix"]
 
         if len(adinputs) < 2:
@@ -121,11 +127,15 @@ class Resample(PrimitivesBASE):
                           self.keyword_comments["CRPIX2"])
         padding = tuple((int(-cen),out-int(ref-cen)) for cen, out, ref in
                         zip(refoff, out_shape, ref_shape))
-        _pad_image(ref_image, padding)
+        if pad_data:
+            _pad_image(ref_image, padding)
 
         for key in area_keys:
             ref_image[0].hdr.set(*key)
         out_wcs = WCS(ref_image[0].hdr)
+        if not pad_data:
+            _set_frame_section(ref_image, [before for before, _ in padding],
+                               self.keyword_comments)
         ref_image.update_filename(suffix=sfx, strip=True)
         # -------------------- END establish reference frame -----------------------
 
@@ -146,21 +156,33 @@ class Resample(PrimitivesBASE):
             area_keys = _build_area_keys(data_corners)
 
             if interpolator:
-                kwargs = {'matrix': matrix, 'offset': offset,
-                          'order': interpolators[interpolator],
-                          'output_shape': out_shape}
-                new_var = None if ad[0].variance is None else \
-                    affine_transform(ad[0].variance, cval=0.0, **kwargs)
-                new_mask = _transform_mask(ad[0].mask if ad[0].mask is not None
-                        else np.zeros_like(ad[0].data, dtype=DQ.datatype), **kwargs)
-                if hasattr(ad[0], 'OBJMASK'):
-                    ad[0].OBJMASK = _transform_mask(ad[0].OBJMASK, **kwargs)
-                ad[0].reset(affine_transform(ad[0].data, cval=0.0, **kwargs),
-                            new_mask, new_var)
+                if pad_data:
+                    origin, shape = (0, 0), out_shape
+                else:
+                    origin, shape = _footprint(data_corners, out_shape)
+                # The same coordinates and weights are used for all planes
+                plan = transform.TransformPlan(ad[0].data.shape, shape,
+                                               order=interpolators[interpolator],
+                                               matrix=matrix, offset=offset,
+                                               origin=origin)
+                mask = (ad[0].mask if ad[0].mask is not None else
+                        np.zeros_like(ad[0].data, dtype=DQ.datatype))
+                objmask = getattr(ad[0], 'OBJMASK', None)
+                (new_data, new_var), (new_mask, new_objmask) = plan.apply(
+                    [ad[0].data, ad[0].variance], [mask, objmask],
+                    cval=0.0, mask_cval=DQ.no_data)
+                if objmask is not None:
+                    ad[0].OBJMASK = new_objmask
+                ad[0].reset(new_data, new_mask, new_var)
             else:
                 padding = tuple((int(-s), out-int(img-s)) for s, out, img in
                                 zip(shift, out_shape, ad[0].data.shape))
-                _pad_image(ad, padding)
+                if pad_data:
+                    _pad_image(ad, padding)
+                else:
+                    origin = [before for before, _ in padding]
+            if not pad_data:
+                _set_frame_section(ad, origin, self.keyword_comments)
 
             if abs(1.0 - matrix_det) > 1e-6:
                     log.fullinfo("Multiplying by {} to conserve flux".format(matrix_det))
@@ -335,37 +357,57 @@ def _composite_from_ref_wcs(ad, out_wcs, keyword_comments):
                          comment=keyword_comments["CRPIX2"])
     return shift  # ad ?
 
-def _pad_image(ad, padding):
-    """Pads the image with zeroes, except DQ, which is padded with 16s"""
-    ad.operate(np.pad, padding, 'constant', constant_values=0)
-    # We want the mask padding to be DQ.no_data, so have to fix
-    # that up by hand...
-    if ad[0].mask is None:
-        ad[0].mask = np.zeros_like(ad[0].data, dtype=DQ.datatype)
-    ad[0].mask[:padding[0][0]] = DQ.no_data
-    if padding[0][1] > 0:
-        ad[0].mask[-padding[0][1]:] = DQ.no_data
-    ad[0].mask[:,:padding[1][0]] = DQ.no_data
-    if padding[1][1] > 0:
-        ad[0].mask[:,-padding[1][1]:] = DQ.no_data
-    if hasattr(ad[0], 'OBJMASK'):
-        ad[0].OBJMASK = np.pad(ad[0].OBJMASK, padding, 'constant',
-                             constant_values=0)
+def _footprint(corners, out_shape):
+    """
+    Returns the origin and shape of the smallest section of the output
+    frame that contains the (1-indexed x,y) corners of an image, and thus
+    every output pixel that has data from that image
+    """
+    origin, shape = [], []
+    for axis, length in zip((1, 0), out_shape):
+        values = [corner[axis] - 1 for corner in corners]
+        start = min(max(int(np.floor(min(values))), 0), length - 1)
+        end = max(min(int(np.ceil(max(values))) + 1, length), start + 1)
+        origin.append(start)
+        shape.append(end - start)
+    return tuple(origin), tuple(shape)
+
+def _set_frame_section(ad, origin, keyword_comments):
+    """
+    Records the section of the output frame covered by an image that has not
+    been padded, and moves the WCS reference pixel from the output frame to
+    the image's own pixels
+    """
+    for ax, start in zip((1, 2), reversed(origin)):
+        key = 'CRPIX{}'.format(ax)
+        ad.hdr.set(key, ad[0].hdr[key] - start, keyword_comments[key])
+    (ny, nx), (y1, x1) = ad[0].data.shape, origin
+    ad.hdr.set('FRAMESEC', '[{}:{},{}:{}]'.format(x1 + 1, x1 + nx, y1 + 1,
+                                                   y1 + ny),
+               keyword_comments['FRAMESEC'])
 
-def _transform_mask(mask, **kwargs):
+def _pad_image(ad, padding):
     """
-    Transform the DQ plane, bit by bit. Since np.unpackbits() only works
-    on uint8 data, we have to do this by hand
+    Pads the image with zeroes, except DQ, which is padded with 16s. Each
+    plane is copied straight into its place in a new, larger array
     """
-    trans_mask = np.zeros(kwargs['output_shape'], dtype=np.uint16)
-    for j in range(0, 16):
-        bit = 2**j
-        # Only transform bits that have a pixel set. But we always want
-        # to do one transformation so we can pad the data with DQ.no_data
-        if bit==DQ.no_data or np.sum(mask & bit) > 0:
-            temp_mask = affine_transform((mask & 2**j).astype(np.float32),
-                                         cval=DQ.no_data if bit==DQ.no_data
-                                         else 0, **kwargs)
-            trans_mask += np.where(np.abs(temp_mask>0.01*bit), bit,
-                                          0).astype(np.uint16)
-    return trans_mask
+    shape = tuple(length + before + after for length, (before, after) in
+                  zip(ad[0].data.shape, padding))
+    region = tuple(slice(before, before + length) for length, (before, _) in
+                   zip(ad[0].data.shape, padding))
+
+    def pad(arr, fill):
+        new_arr = np.full(shape, fill, dtype=arr.dtype)
+        new_arr[region] = arr
+        return new_arr
+
+    # We want the mask padding to be DQ.no_data
+    if ad[0].mask is None:
+        mask = np.full(shape, DQ.no_data, dtype=DQ.datatype)
+        mask[region] = 0
+    else:
+        mask = pad(ad[0].mask, DQ.no_data)
+    ad[0].reset(pad(ad[0].data, 0), mask, None if ad[0].variance is None
+                else pad(ad[0].variance, 0))
+    if hasattr(ad[0], 'OBJMASK'):
+        ad[0].OBJMASK = pad(ad[0].OBJMASK, 0)
@@ -5,14 +5,19 @@
 # ------------------------------------------------------------------------------
 import astrodata
 from astrodata.fits import windowedOp
+from astrodata.nddata import NDAstroData, NDPlacedAstroData
 
 import numpy as np
 from astropy import table
 from functools import partial
+from collections import OrderedDict
 from copy import deepcopy
 
 from gempy.gemini import gemini_tools as gt
-from gempy.library.nddops import NDStacker
+from gempy.library import astrotools as at
+from gempy.library.nddops import NDStacker, IncrementalStacker
+
+from geminidr.gemini.lookups import DQ_definitions as DQ
 
 from geminidr import PrimitivesBASE
 from . import parameters_stack
@@ -35,6 +40,10 @@ class Stack(PrimitivesBASE):
         """
         This primitive calls a set of primitives to perform the steps
         needed for alignment of frames to a reference image and stacking.
+        With pad_data=False, the aligned frames are not padded to the full
+        output frame, and stackFrames puts each one in place a band at a
+        time, so memory use does not grow with the size of the output frame
+        times the number of inputs.
         """
         log = self.log
         log.debug(gt.log_message("primitive", self.myself(), "starting"))
@@ -82,14 +91,19 @@ class Stack(PrimitivesBASE):
             type of pixel rejection (passed to gemcombine)
         zero: bool
             apply zero-level offset to match background levels?
+        memory: float/None
+            memory available for stacking (GB)
+        num_workers: int
+            number of threads stacking horizontal bands of the images
+            concurrently (the memory is shared among them)
         """
         log = self.log
         log.debug(gt.log_message("primitive", self.myself(), "starting"))
-        timestamp_key = self.timestamp_keys["stackFrames"]
         sfx = params["suffix"]
         memory = params["memory"]
         if memory is not None:
             memory = int(memory * 1000000000)
+        num_workers = params["num_workers"]
 
         zero = params["zero"]
         scale = params["scale"]
@@ -98,9 +112,7 @@ class Stack(PrimitivesBASE):
         statsec = params["statsec"]
         reject_method = params["reject_method"]
         if statsec:
-            statsec = tuple([slice(int(start)-1, int(end))
-                             for x in reversed(statsec.strip('[]').split(','))
-                             for start, end in [x.split(':')]])
+            statsec = _parse_statsec(statsec)
 
         if len(adinputs) <= 1:
             log.stdinfo("No stacking will be performed, since at least two "
@@ -114,23 +126,17 @@ class Stack(PrimitivesBASE):
 
         if len(set(len(ad) for ad in adinputs)) > 1:
             raise IOError("Not all inputs have the same number of extensions")
-        if len(set([ext.nddata.shape for ad in adinputs for ext in ad])) > 1:
+        # Images aligned without padding them to the full frame only cover
+        # their FRAMESEC section of it, and are placed there as they are
+        # stacked, one band at a time
+        placed = all('FRAMESEC' in ext.hdr for ad in adinputs for ext in ad)
+        if (not placed and
+                len(set([ext.nddata.shape for ad in adinputs for ext in ad])) > 1):
             raise IOError("Not all inputs images have the same shape")
 
         # Determine the average gain from the input AstroData objects and
         # add in quadrature the read noise
-        gains = [ad.gain() for ad in adinputs]
-        read_noises = [ad.read_noise() for ad in adinputs]
-
-        assert all(gain is not None for gain in gains), "Gain problem"
-        assert all(rn is not None for rn in read_noises), "RN problem"
-
-        # Compute gain and read noise of final stacked images
-        nexts = len(gains[0])
-        gain_list = [np.mean([gain[i] for gain in gains])
-                     for i in range(nexts)]
-        read_noise_list = [np.sqrt(np.sum([rn[i]*rn[i] for rn in read_noises]))
-                                     for i in range(nexts)]
+        gain_list, read_noise_list = _stacked_gain_and_read_noise(adinputs)
 
         num_img = len(adinputs)
         num_ext = len(adinputs[0])
@@ -141,7 +147,7 @@ class Stack(PrimitivesBASE):
         # whether it's necessary to flush pixel data to disk first
         # Also determine kernel size from offered memory and bytes per pixel
         bytes_per_ext = []
-        for ext in adinputs[0]:
+        for index, ext in enumerate(adinputs[0]):
             bytes = 0
             # Count _data twice to handle temporary arrays
             for attr in ('_data', '_data', '_uncertainty'):
@@ -156,11 +162,20 @@ class Stack(PrimitivesBASE):
                     except AttributeError:  # For non-lazy VAR
                         bytes += item._array.dtype.itemsize
             bytes += 2  #  mask always created
-            bytes_per_ext.append(bytes * np.multiply.reduce(ext.nddata.shape))
+            shape = (_frame_shape([ad[index] for ad in adinputs]) if placed
+                     else ext.nddata.shape)
+            bytes_per_ext.append(bytes * np.multiply.reduce(shape))
 
         if memory is not None and (num_img * max(bytes_per_ext) > memory):
             adinputs = self.flushPixels(adinputs)
 
+        if placed:
+            inputs = [_placed_nddata([ad[index] for ad in adinputs])
+                      for index in range(num_ext)]
+        else:
+            inputs = [[ad[index].nddata for ad in adinputs]
+                      for index in range(num_ext)]
+
         # Compute the scale and offset values by accessing the memmapped data
         # so we can pass those to the stacking function
         # TODO: Should probably be done better to consider only the overlap
@@ -169,10 +184,16 @@ class Stack(PrimitivesBASE):
             levels = np.empty((num_img, num_ext), dtype=np.float32)
             for i, ad in enumerate(adinputs):
                 for index in range(num_ext):
-                    nddata = (ad[index].nddata.window[:] if statsec is None
-                              else ad[i][index].nddata.window[statsec])
+                    if placed:
+                        # Only the image's own pixels (in the statsec), not
+                        # the empty parts of the frame around them
+                        nddata = inputs[index][i].target_window(statsec)
+                    else:
+                        nddata = (inputs[index][i].window[:] if statsec is None
+                                  else inputs[index][i].window[statsec])
                     #levels[i, index] = np.median(nddata.data)
-                    levels[i, index] = gt.measure_bg_from_image(nddata, value_only=True)
+                    levels[i, index] = (np.nan if nddata is None else
+                        gt.measure_bg_from_image(nddata, value_only=True))
             if scale and zero:
                 log.warning("Both scale and zero are set. Setting scale=False.")
                 scale = False
@@ -235,65 +256,38 @@ class Stack(PrimitivesBASE):
                 for ad, value in zip(adinputs, numbers):
                     log.stdinfo("{:40s}{:10.3f}".format(ad.filename, value))
 
-            shape = adinputs[0][index].nddata.shape
+            shape = inputs[index][0].shape
             if memory is None:
-                kernel = shape
+                oversubscription = 1
             else:
                 # Chop the image horizontally into equal-sized chunks to process
                 # This uses the minimum number of steps and uses minimum memory
-                # per step.
-                oversubscription = (bytes_per_ext[index] * num_img) // memory + 1
-                kernel = ((shape[0] + oversubscription - 1) // oversubscription,) + shape[1:]
+                # per step. Every worker has a band in memory at the same time
+                oversubscription = (bytes_per_ext[index] * num_img * num_workers) // memory + 1
+            # Make sure there's at least one band for each worker
+            oversubscription = max(oversubscription, min(num_workers, shape[0]))
+            kernel = ((shape[0] + oversubscription - 1) // oversubscription,) + shape[1:]
             with_uncertainty = True  # Since all stacking methods return variance
-            with_mask = apply_dq and not any(ad[index].nddata.window[:].mask is None
-                                             for ad in adinputs)
+            # Decided from the inputs' planes, without reading them
+            with_mask = apply_dq and not any(
+                nddata.plane_dtype('mask') is None for nddata in inputs[index])
             result = windowedOp(partial(stack_function, scale=sfactors, zero=zfactors),
-                                [ad[index].nddata for ad in adinputs],
+                                inputs[index],
                                 kernel=kernel, dtype=np.float32,
-                                with_uncertainty=with_uncertainty, with_mask=with_mask)
+                                with_uncertainty=with_uncertainty, with_mask=with_mask,
+                                num_workers=num_workers)
+            if placed:
+                # Put the WCS of the first image back into the full frame
+                # (its meta is shared with the result, so don't modify it)
+                hdr = result.meta['header'].copy()
+                result.meta = dict(result.meta, header=hdr)
+                for ax, start in zip((1, 2), reversed(inputs[index][0].origin)):
+                    hdr['CRPIX{}'.format(ax)] += start
+                del hdr['FRAMESEC']
             ad_out.append(result)
             log.stdinfo("")
 
-        # Propagate REFCAT as the union of all input REFCATs
-        refcats = [ad.REFCAT for ad in adinputs if hasattr(ad, 'REFCAT')]
-        if refcats:
-            out_refcat = table.unique(table.vstack(refcats,
-                                metadata_conflicts='silent'), keys='Cat_Id')
-            out_refcat['Cat_Id'] = list(range(1, len(out_refcat)+1))
-            ad_out.REFCAT = out_refcat
-
-        # Set AIRMASS to be the mean of the input values
-        try:
-            airmass_kw = ad_out._keyword_for('airmass')
-            mean_airmass = np.mean([ad.airmass() for ad in adinputs])
-        except:  # generic implementation failure (probably non-Gemini)
-            pass
-        else:
-            ad_out.phu.set(airmass_kw, mean_airmass, "Mean airmass for the exposure")
-
-        # Set GAIN to the average of input gains. Set the RDNOISE to the
-        # sum in quadrature of the input read noises.
-        for ext, gain, rn in zip(ad_out, gain_list, read_noise_list):
-            ext.hdr.set('GAIN', gain, self.keyword_comments['GAIN'])
-            ext.hdr.set('RDNOISE', rn, self.keyword_comments['RDNOISE'])
-        # Stick the first extension's values in the PHU
-        ad_out.phu.set('GAIN', gain_list[0], self.keyword_comments['GAIN'])
-        ad_out.phu.set('RDNOISE', read_noise_list[0], self.keyword_comments['RDNOISE'])
-
-        # Add suffix to datalabel to distinguish from the reference frame
-        ad_out.phu.set('DATALAB', "{}{}".format(ad_out.data_label(), sfx),
-                   self.keyword_comments['DATALAB'])
-
-        # Add other keywords to the PHU about the stacking inputs
-        ad_out.orig_filename = ad_out.phu.get('ORIGNAME')
-        ad_out.phu.set('NCOMBINE', len(adinputs), self.keyword_comments['NCOMBINE'])
-        for i, ad in enumerate(adinputs, start=1):
-            ad_out.phu.set('IMCMB{:03d}'.format(i), ad.phu.get('ORIGNAME', ad.filename))
-
-        # Timestamp and update filename and prepare to return single output
-        gt.mark_history(ad_out, primname=self.myself(), keyword=timestamp_key)
-        ad_out.update_filename(suffix=sfx, strip=True)
-
+        self._finish_stack(ad_out, adinputs, sfx, gain_list, read_noise_list)
         return [ad_out]
 
     def stackSkyFrames(self, adinputs=None, **params):
@@ -351,3 +345,191 @@ class Stack(PrimitivesBASE):
         #                ext += ref - this
         adinputs = self.stackFrames(adinputs, **stack_params)
         return adinputs
+
+    def _stack_sky_window(self, stackers, adinputs, **params):
+        """
+        Stack sky frames as stackSkyFrames() does (with their object masks
+        already dilated) by updating the IncrementalStackers (one per
+        extension) used for the previous set of skies: the skies that are no
+        longer wanted are removed and the new ones are added. If keeping the
+        skies would take more than the memory allowed, they are stacked by
+        stackSkyFrames() instead.
+
+        Parameters
+        ----------
+        stackers: list
+            IncrementalStackers from the previous call (empty for the first)
+        adinputs: list
+            sky frames to stack
+        params: dict
+            parameters of stackSkyFrames()
+
+        Returns
+        -------
+        list: the stacked sky frame
+        """
+        log = self.log
+        scale, zero = params["scale"], params["zero"]
+        statsec = (_parse_statsec(params["statsec"]) if params["statsec"]
+                   else (slice(None),))
+        if not stackers:
+            stackers.extend(IncrementalStacker(combine=params["operation"],
+                                               reject=params["reject_method"],
+                                               nlow=params["nlow"],
+                                               nhigh=params["nhigh"],
+                                               use_mask=params["apply_dq"],
+                                               scale=scale, zero=zero,
+                                               log=log)
+                            for ext in adinputs[0])
+        if params.get("memory") is not None:
+            needed = sum(stacker.memory_needed(ext.nddata.shape, len(adinputs))
+                         for stacker, ext in zip(stackers, adinputs[0]))
+            if needed > params["memory"] * 1000000000:
+                log.stdinfo("Keeping {} sky frames would need {:.2f} GB. "
+                            "Stacking them from scratch.".format(
+                                len(adinputs), needed / 1000000000.))
+                del stackers[:]
+                return self.stackSkyFrames(adinputs, **params)
+        if any(len(ad) != len(stackers) for ad in adinputs):
+            raise IOError("Not all inputs have the same number of extensions")
+
+        filenames = [ad.filename for ad in adinputs]
+        old_skies = [filename for filename in stackers[0].frames
+                     if filename not in filenames]
+        for stacker in stackers:
+            for filename in old_skies:
+                stacker.remove(filename)
+        new_skies = [ad for ad in adinputs
+                     if ad.filename not in stackers[0].frames]
+        for ad in new_skies:
+            if not "PREPARED" in ad.tags:
+                raise IOError("{} must be prepared" .format(ad.filename))
+            masks = []
+            for ext in ad:
+                mask = ext.mask
+                if params["mask_objects"]:
+                    if hasattr(ext, 'OBJMASK'):
+                        mask = (ext.OBJMASK if mask is None
+                                else mask | ext.OBJMASK)
+                    else:
+                        log.warning('No object mask present for {}:{}; '
+                                    'cannot apply object mask'.format(
+                                        ad.filename, ext.hdr['EXTVER']))
+                masks.append(mask)
+            # Background levels measured as by stackFrames()
+            levels = np.ones((len(ad),), dtype=np.float32)
+            if scale or zero:
+                for i, (ext, mask) in enumerate(zip(ad, masks)):
+                    nddata = NDAstroData(ext.data[statsec], mask=(None if
+                                         mask is None else mask[statsec]))
+                    levels[i] = gt.measure_bg_from_image(nddata,
+                                                         value_only=True)
+                if not params["separate_ext"]:
+                    levels[:] = np.mean(levels)
+            for stacker, ext, mask, level in zip(stackers, ad, masks, levels):
+                stacker.add(ad.filename, ext.data, mask, ext.variance,
+                            level=level)
+        log.stdinfo("Updated sky stack: {} frames removed and {} added"
+                    .format(len(old_skies), len(new_skies)))
+
+        gain_list, read_noise_list = _stacked_gain_and_read_noise(adinputs)
+        ad_out = astrodata.create(adinputs[0].phu)
+        for stacker, ext in zip(stackers, adinputs[0]):
+            result = stacker.result()
+            result.meta['header'] = ext.hdr.copy()
+            result.meta['other'] = OrderedDict()
+            result.meta['other_header'] = {}
+            ad_out.append(result)
+        self._finish_stack(ad_out, adinputs, params["suffix"], gain_list,
+                           read_noise_list)
+        return [ad_out]
+
+    def _finish_stack(self, ad_out, adinputs, suffix, gain_list,
+                      read_noise_list):
+        """
+        Set the headers of a stack of the adinputs, as stackFrames() does.
+        """
+        # Propagate REFCAT as the union of all input REFCATs
+        refcats = [ad.REFCAT for ad in adinputs if hasattr(ad, 'REFCAT')]
+        if refcats:
+            out_refcat = table.unique(table.vstack(refcats,
+                                metadata_conflicts='silent'), keys='Cat_Id')
+            out_refcat['Cat_Id'] = list(range(1, len(out_refcat)+1))
+            ad_out.REFCAT = out_refcat
+
+        # Set AIRMASS to be the mean of the input values
+        try:
+            airmass_kw = ad_out._keyword_for('airmass')
+            mean_airmass = np.mean([ad.airmass() for ad in adinputs])
+        except:  # generic implementation failure (probably non-Gemini)
+            pass
+        else:
+            ad_out.phu.set(airmass_kw, mean_airmass, "Mean airmass for the exposure")
+
+        # Set GAIN to the average of input gains. Set the RDNOISE to the
+        # sum in quadrature of the input read noises.
+        for ext, gain, rn in zip(ad_out, gain_list, read_noise_list):
+            ext.hdr.set('GAIN', gain, self.keyword_comments['GAIN'])
+            ext.hdr.set('RDNOISE', rn, self.keyword_comments['RDNOISE'])
+        # Stick the first extension's values in the PHU
+        ad_out.phu.set('GAIN', gain_list[0], self.keyword_comments['GAIN'])
+        ad_out.phu.set('RDNOISE', read_noise_list[0], self.keyword_comments['RDNOISE'])
+
+        # Add suffix to datalabel to distinguish from the reference frame
+        ad_out.phu.set('DATALAB', "{}{}".format(ad_out.data_label(), suffix),
+                   self.keyword_comments['DATALAB'])
+
+        # Add other keywords to the PHU about the stacking inputs
+        ad_out.orig_filename = ad_out.phu.get('ORIGNAME')
+        ad_out.phu.set('NCOMBINE', len(adinputs), self.keyword_comments['NCOMBINE'])
+        for i, ad in enumerate(adinputs, start=1):
+            ad_out.phu.set('IMCMB{:03d}'.format(i), ad.phu.get('ORIGNAME', ad.filename))
+
+        # Timestamp and update filename
+        gt.mark_history(ad_out, primname="stackFrames",
+                        keyword=self.timestamp_keys["stackFrames"])
+        ad_out.update_filename(suffix=suffix, strip=True)
+
+# =================================== prive ====================================
+def _parse_statsec(statsec):
+    # Convert a "[x1:x2,y1:y2]" section to a tuple of slices
+    return tuple([slice(int(start)-1, int(end))
+                  for x in reversed(statsec.strip('[]').split(','))
+                  for start, end in [x.split(':')]])
+
+def _stacked_gain_and_read_noise(adinputs):
+    # The mean gain and the read noises added in quadrature, per extension
+    gains = [ad.gain() for ad in adinputs]
+    read_noises = [ad.read_noise() for ad in adinputs]
+
+    assert all(gain is not None for gain in gains), "Gain problem"
+    assert all(rn is not None for rn in read_noises), "RN problem"
+
+    nexts = len(gains[0])
+    gain_list = [np.mean([gain[i] for gain in gains])
+                 for i in range(nexts)]
+    read_noise_list = [np.sqrt(np.sum([rn[i]*rn[i] for rn in read_noises]))
+                       for i in range(nexts)]
+    return gain_list, read_noise_list
+
+def _frame_sections(exts):
+    # The FRAMESEC sections of some extensions, as (x1, x2, y1, y2) slices
+    return [at.section_str_to_tuple(ext.hdr['FRAMESEC']) for ext in exts]
+
+def _frame_shape(exts):
+    """
+    Shape of the frame covered by the FRAMESEC sections of some extensions,
+    from pixel (1,1) to the furthest extent of any of them
+    """
+    sections = _frame_sections(exts)
+    return (max(sec.y2 for sec in sections), max(sec.x2 for sec in sections))
+
+def _placed_nddata(exts):
+    """
+    Returns the NDData of some extensions placed at their FRAMESEC sections
+    of a common frame, with the pixels not covered flagged as DQ.no_data
+    """
+    shape = _frame_shape(exts)
+    return [NDPlacedAstroData(ext.nddata, (sec.y1, sec.x1), shape,
+                              mask_fill=DQ.no_data)
+            for ext, sec in zip(exts, _frame_sections(exts))]
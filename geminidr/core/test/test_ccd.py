@@ -0,0 +1,59 @@
+# pytest suite
+"""
+Tests for the overscan fitting in primitives_ccd.
+
+This is a suite of tests to be run with pytest. The overscan rows are made
+up, so no test data is needed.
+
+To run:
+    1) From the ??? (location): pytest -v --capture=no
+"""
+import numpy as np
+import pytest
+
+from geminidr.core.primitives_ccd import _fit_overscans, _running_medians
+
+READ_NOISE = 1.
+SECTION = (0, 16, 0, 200)   # x1, x2, y1, y2
+
+
+def overscan_rows(bad_rows=(), level=1000., seed=0):
+    rng = np.random.RandomState(seed)
+    data = level + rng.normal(0, 0.3, SECTION[3] - SECTION[2])
+    for row in bad_rows:
+        data[row] += 500.
+    return data
+
+
+def test_running_median_rejects_bad_rows():
+    data = overscan_rows(bad_rows=[50, 120, 121])
+    runmed, = _running_medians([data], 2)
+    # Each box is centred on its row, so isolated bad rows don't show
+    assert np.all(np.abs(runmed - 1000.) < 2.)
+    # The boxes are truncated at the ends
+    assert runmed[0] == np.median(data[:3])
+    assert runmed[-1] == np.median(data[-3:])
+
+
+@pytest.mark.parametrize("func,order", [("poly", 0), ("spline", 1)])
+def test_fit_overscans_bad_rows(func, order):
+    rows = [overscan_rows(bad_rows=[50, 120, 121], seed=seed)
+            for seed in range(2)]
+    weight = np.sqrt(SECTION[1] - SECTION[0]) / READ_NOISE
+    # No iterations: the running median alone has to reject the bad rows
+    fits = _fit_overscans(rows, [weight] * 2, [SECTION] * 2, [200] * 2,
+                          func=func, order=order, niterate=0, lo_rej=3.,
+                          hi_rej=3.)
+    for bias, sigma in fits:
+        assert np.all(np.abs(bias - 1000.) < 0.5)
+        assert sigma < 1.
+
+
+def test_fit_overscans_none_replaces_bad_rows():
+    data = overscan_rows(bad_rows=[50])
+    weight = np.sqrt(SECTION[1] - SECTION[0]) / READ_NOISE
+    (bias, sigma), = _fit_overscans([data], [weight], [SECTION], [200],
+                                    func='none', order=None, niterate=1,
+                                    lo_rej=3., hi_rej=3.)
+    assert abs(bias[50] - 1000.) < 2.
+    assert np.array_equal(np.delete(bias, 50), np.delete(data, 50))
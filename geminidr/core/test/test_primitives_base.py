@@ -0,0 +1,154 @@
+# pytest suite
+"""
+Tests for the PrimitivesBASE and Calibrations classes.
+
+This is a suite of tests to be run with pytest.
+
+To run:
+    1) From the ??? (location): pytest -v --capture=no
+"""
+import inspect
+import pickle
+import time
+from multiprocessing import Process
+from multiprocessing.pool import ThreadPool
+
+import geminidr
+from geminidr import PrimitivesBASE, Calibrations, CommandHost
+from gempy.library import config
+from recipe_system.utils.decorators import parameter_override
+
+
+class dummyConfig(config.Config):
+    suffix = config.Field("Filename suffix", str, "_dummy", optional=True)
+
+
+@parameter_override
+class PrimitivesDummy(PrimitivesBASE):
+    tagset = set()
+
+    def __init__(self, adinputs, **kwargs):
+        super(PrimitivesDummy, self).__init__(adinputs, **kwargs)
+        self.params.update({'outer': dummyConfig(), 'inner': dummyConfig()})
+        self.names = []
+
+    def outer(self, adinputs=None, **params):
+        self.names.append(self.myself())
+        self.inner()
+        self.names.append(self.myself())
+        return adinputs
+
+    def inner(self, adinputs=None, **params):
+        self.names.append(self.myself())
+        return adinputs
+
+
+def test_myself_does_not_walk_stack(monkeypatch):
+    calls = []
+    def counting_stack(*args, **kwargs):
+        calls.append(1)
+        return inspect.stack(*args, **kwargs)[1:]  # hide this frame
+    monkeypatch.setattr(geminidr, 'stack', counting_stack)
+
+    p = PrimitivesDummy([])
+    try:
+        for i in range(10):
+            p.outer()
+    finally:
+        p._kill_subprocess()
+    assert p.names == ['outer', 'inner', 'outer'] * 10
+    # Each of these 30 calls used to need an inspect.stack()
+    assert len(calls) == 0
+    assert p._primitive_names == []
+
+    # Outside a primitive, it still returns the caller's name
+    assert p.myself() == 'test_myself_does_not_walk_stack'
+    assert len(calls) == 1
+
+
+class FakeAD(object):
+    def __init__(self, key):
+        self.key = key
+
+    def calibration_key(self):
+        return self.key
+
+
+def store_cals(calindfile, proc, num):
+    cals = Calibrations(calindfile)
+    for i in range(num):
+        cals[FakeAD('N{}_{}'.format(proc, i)), 'processed_bias'] = 'bias{}.fits'.format(i)
+
+
+def test_calibrations_index(tmpdir):
+    calindfile = str(tmpdir.join('calindex.db'))
+    cals = Calibrations(calindfile, user_cals={('N1', 'processed_flat'): 'user.fits'})
+    ad = FakeAD('N1')
+    assert cals[ad, 'processed_bias'] is None
+    cals[ad, 'processed_bias'] = 'bias.fits'
+    cals[ad, 'processed_dark'] = ['dark1.fits', 'dark2.fits']
+    cals[ad, 'processed_flat'] = 'flat.fits'
+    assert cals[ad, 'processed_flat'] == 'user.fits'
+
+    # Stored immediately, and visible to another instance
+    cals2 = Calibrations(calindfile)
+    assert cals2[ad, 'processed_bias'] == 'bias.fits'
+    assert cals2[ad, 'processed_dark'] == ['dark1.fits', 'dark2.fits']
+    del cals2[ad, 'processed_bias']
+    del cals2[None]  # malformed keys are ignored
+    assert cals[ad, 'processed_bias'] is None
+
+
+def test_calibrations_concurrent_writers(tmpdir):
+    calindfile = str(tmpdir.join('calindex.db'))
+    Calibrations(calindfile)
+    procs = [Process(target=store_cals, args=(calindfile, p, 50))
+             for p in range(4)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    assert all(p.exitcode == 0 for p in procs)
+    cals = Calibrations(calindfile)
+    for p in range(4):
+        for i in range(50):
+            assert (cals[FakeAD('N{}_{}'.format(p, i)), 'processed_bias'] ==
+                    'bias{}.fits'.format(i))
+
+
+def test_calibrations_import_pickle(tmpdir):
+    with open(str(tmpdir.join('calindex.pkl')), 'wb') as f:
+        pickle.dump({('N1', 'processed_bias'): 'bias.fits'}, f, protocol=2)
+    cals = Calibrations(str(tmpdir.join('calindex.db')))
+    assert cals[FakeAD('N1'), 'processed_bias'] == 'bias.fits'
+
+
+def test_command_host_concurrent():
+    cmd_host = CommandHost(num_workers=3)
+    try:
+        assert cmd_host.run(['echo', 'hello']).strip() == b'hello'
+        pool = ThreadPool(3)
+        start = time.time()
+        results = pool.map(cmd_host.run, [['sleep', '1']] * 3)
+        pool.close()
+        assert time.time() - start < 2.5
+        assert results == [b''] * 3
+        assert isinstance(cmd_host.run(['false']), Exception)
+    finally:
+        cmd_host.terminate()
+
+
+def test_shared_command_host(monkeypatch):
+    monkeypatch.setattr(geminidr, '_shared_cmd_host', None)
+    shared = geminidr.use_shared_command_host(num_workers=2)
+    try:
+        p1 = PrimitivesDummy([])
+        p2 = PrimitivesDummy([])
+        assert p1._cmd_host is shared and p2._cmd_host is shared
+        # Nothing started until needed
+        assert shared._workers == []
+        p1._kill_subprocess()
+        assert p2._cmd_host.run(['echo', 'hello']).strip() == b'hello'
+        assert len(shared._workers) == 2
+    finally:
+        shared.terminate()
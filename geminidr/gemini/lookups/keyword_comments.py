@@ -28,6 +28,7 @@ keyword_comments = {
     "EXPTIME": "Exposure time [seconds]",
     "FILTER": "Combined filter name",
     "FLATIM": "Flat image used",
+    "FRAMESEC": "Section of the aligned frame covered by data",
     "FRINGEIM": "Fringe image used",
     "GAIN": "Gain [electrons/ADU]",
     "GAINSET": "Gain setting (low / high)",
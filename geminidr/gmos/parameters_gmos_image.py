@@ -17,7 +17,11 @@ class stackFlatsConfig(config.Config):
                                    allowed = {"mean": "arithmetic mean",
                                               "wtmean": "variance-weighted mean",
                                               "median": "median",
-                                              "lmedian": "low-median"},
+                                              "lmedian": "low-median",
+                                              "fastmean": "arithmetic mean (faster version)",
+                                              "fastwtmean": "variance-weighted mean (faster version)",
+                                              "fastmedian": "median (faster version)",
+                                              "fastlmedian": "low-median (faster version)"},
                                    default="mean", optional=False)
     reject_method = config.ChoiceField("Pixel rejection method", str,
                                        allowed={"none": "no rejection",
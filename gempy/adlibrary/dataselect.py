@@ -1,6 +1,8 @@
 import re
 from copy import deepcopy
 from datetime import datetime
+from multiprocessing import Pool
+from types import CodeType
 
 import astrodata
 import gemini_instruments
@@ -58,21 +60,83 @@ def expr_parser(expression, strict=False):
 
     return codified_expression
 
+def compile_expression(expression):
+    """
+    Compiles the output of ``expr_parser`` into a code object, so that it
+    is parsed only once, however many files it's evaluated for. Only the
+    descriptors used in the expression are called when it's evaluated.
+    """
+    if isinstance(expression, CodeType):
+        return expression
+    return compile(expression, '<dataselect expression>', 'eval')
+
 def evalexpression(ad, expression):
-    if type(eval(expression)) is not type(True):
-        raise(IOError, 'Expression does not return a boolean value.')
-    return eval(expression)
+    result = eval(compile_expression(expression))
+    if type(result) is not type(True):
+        raise IOError('Expression does not return a boolean value.')
+    return result
+
+def _matches(ad, tags, xtags, expression):
+    adtags = ad.tags
+    return (set(tags).issubset(adtags) and
+            not len(set(xtags).intersection(adtags)) and
+            evalexpression(ad, expression))
+
+# Selection criteria of the processes in the pool used by select_data
+_worker_criteria = None
+
+def _init_worker(tags, xtags, expression, catalog_path):
+    global _worker_criteria
+    catalog = None
+    if catalog_path is not None:
+        from .metadata_catalog import MetadataCatalog
+        # Every process writes to the catalog, so nobody can hold the lock
+        catalog = MetadataCatalog(catalog_path, commit_every=1)
+    _worker_criteria = (tags, xtags, compile_expression(expression), catalog)
 
-def select_data(inputs, tags=[], xtags=[], expression='True'):
+def _select_one(input):
+    tags, xtags, code, catalog = _worker_criteria
+    ad = astrodata.open(input) if catalog is None else catalog.entry(input)
+    return _matches(ad, tags, xtags, code)
+
+def select_data(inputs, tags=[], xtags=[], expression='True', catalog=None,
+                num_processes=1):
+    """
+    Returns the inputs that have all the ``tags``, none of the ``xtags``,
+    and for which ``expression`` (see ``expr_parser``) is true.
+
+    If a ``MetadataCatalog`` is provided, the tags and descriptors are
+    taken from it, and only new or modified files are opened.
+
+    With ``num_processes`` > 1, the files are opened and checked by a pool
+    of processes (each with its own connection to the catalog, if there is
+    one). The selected files are returned in the same order.
+    """
+    inputs = list(inputs)
+    code = compile_expression(expression)
+    if num_processes > 1 and len(inputs) > 1:
+        if isinstance(expression, CodeType):
+            raise ValueError("The expression must be a string to use a "
+                             "pool of processes")
+        if catalog is not None:
+            # Make what this process has done visible to the pool
+            catalog.commit()
+        pool = Pool(min(num_processes, len(inputs)), initializer=_init_worker,
+                    initargs=(tags, xtags, expression,
+                              None if catalog is None else catalog.path))
+        try:
+            chunksize = max(len(inputs) // (num_processes * 8), 1)
+            selected = list(pool.imap(_select_one, inputs, chunksize))
+        finally:
+            pool.terminate()
+            pool.join()
+        return [input for input, keep in zip(inputs, selected) if keep]
 
     selected_data = []
     for input in inputs:
-        ad = astrodata.open(input)
-        adtags = ad.tags
-        if set(tags).issubset(adtags) and \
-               not len(set(xtags).intersection(adtags)) and \
-               evalexpression(ad, expression):
-           selected_data.append(input)
+        ad = astrodata.open(input) if catalog is None else catalog.entry(input)
+        if _matches(ad, tags, xtags, code):
+            selected_data.append(input)
 
     return selected_data
 
@@ -0,0 +1,340 @@
+"""
+An on-disk catalog of the metadata of FITS files: the PHU, the AstroData
+class, the tags, and the values of the most common descriptors.
+
+The entries are keyed by path, and are valid as long as the size and the
+modification time of the file don't change. Tools that go over the same
+directories of raw data again and again (eg. dataselect, typewalk) can then
+answer their queries without opening the files that they have already seen.
+
+    >>> with MetadataCatalog() as catalog:
+    ...     entry = catalog.entry('N20180101S0001.fits')
+    ...     entry.tags, entry.exposure_time()
+
+A ``CatalogEntry`` behaves like the AstroData object for tags, PHU and
+descriptor calls. Descriptor calls that are not in the catalog yet, and any
+other attribute, are resolved by opening the file (just once); the new
+descriptor values are stored for the next time.
+"""
+import os
+import sys
+import inspect
+import sqlite3
+import warnings
+from copy import copy
+from functools import partial
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from astropy.io import fits
+
+import astrodata
+import gemini_instruments
+
+DEFAULT_CATALOG = '~/.geminidr/metadata.db'
+
+# Descriptor calls (name, kwargs) that are stored for every file. Others are
+# stored the first time that they are requested
+COMMON_DESCRIPTORS = (
+    ('instrument', {}), ('object', {}), ('telescope', {}),
+    ('observation_type', {}), ('observation_class', {}),
+    ('observation_id', {}), ('program_id', {}), ('data_label', {}),
+    ('exposure_time', {}), ('coadds', {}), ('airmass', {}),
+    ('filter_name', {}), ('filter_name', {'pretty': True}),
+    ('disperser', {}), ('disperser', {'pretty': True}),
+    ('central_wavelength', {}), ('camera', {}), ('read_mode', {}),
+    ('detector_x_bin', {}), ('detector_y_bin', {}),
+    ('ut_date', {}), ('ut_time', {}), ('ut_datetime', {}), ('local_time', {}),
+    ('ra', {}), ('dec', {}), ('qa_state', {}),
+)
+
+# Changes in the layout of the tables, or in what is stored, need a new
+# version, so that old catalogs are rebuilt
+CATALOG_VERSION = 1
+
+# Number of modified entries after which the changes are committed
+COMMIT_EVERY = 200
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)",
+    "CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, "
+    "mtime REAL, adclass TEXT, tags TEXT, phu TEXT)",
+    "CREATE TABLE IF NOT EXISTS descriptors (path TEXT, name TEXT, "
+    "args TEXT, value BLOB, PRIMARY KEY (path, name, args))",
+)
+
+
+def _source_files(classes):
+    # Descriptors also depend on the modules that the classes use (lookup
+    # tables, common functions...), so take every module in the packages
+    # that provide the registered classes
+    files = set()
+    for package in set(cls.__module__.split('.')[0] for cls in classes):
+        try:
+            source = inspect.getsourcefile(sys.modules[package])
+        except (KeyError, TypeError):
+            continue
+        if os.path.basename(source) != '__init__.py':
+            files.add(source)
+            continue
+        for root, dirs, names in os.walk(os.path.dirname(source)):
+            files.update(os.path.join(root, name) for name in names
+                         if name.endswith('.py'))
+    return sorted(files)
+
+
+def _fingerprint():
+    # Identifies the code that produced the entries. Editing or upgrading
+    # any of it invalidates the whole catalog, as the tags and descriptors
+    # may have changed
+    classes = astrodata.factory._registry
+    parts = ['v{}'.format(CATALOG_VERSION), astrodata.__version__]
+    parts.extend(sorted('{}.{}'.format(cls.__module__, cls.__name__)
+                        for cls in classes))
+    for source in _source_files(classes):
+        try:
+            mtime = os.path.getmtime(source)
+        except OSError:
+            mtime = None
+        parts.append('{}:{!r}'.format(source, mtime))
+    return '\n'.join(parts)
+
+
+def _arguments_key(args, kwargs):
+    return repr((tuple(args), sorted(kwargs.items())))
+
+
+class CatalogEntry(object):
+    """
+    The catalogued metadata of a file. It offers the ``tags``, ``phu`` and
+    ``descriptors`` of the AstroData object, and its descriptors can be
+    called as usual. Anything else is taken from the AstroData object,
+    which is opened on first use.
+    """
+    def __init__(self, catalog, path, adclass, tags, phu, values):
+        self._catalog = catalog
+        self._adclass = adclass
+        self._tags = frozenset(tags)
+        self._phu = phu
+        self._values = values
+        self._ad = None
+        self.path = path
+
+    def __repr__(self):
+        return '<{} {} for {!r}>'.format(self.__class__.__name__,
+                                         self._adclass.__name__, self.path)
+
+    @property
+    def tags(self):
+        return set(self._tags)
+
+    @property
+    def phu(self):
+        if not isinstance(self._phu, fits.Header):
+            self._phu = fits.Header.fromstring(self._phu)
+        return self._phu
+
+    @property
+    def descriptors(self):
+        return self._adclass._descriptor_names
+
+    def load(self):
+        """Returns the AstroData object for the file, opening it if needed"""
+        if self._ad is None:
+            self._ad = astrodata.open(self.path)
+        return self._ad
+
+    def _descriptor(self, name, *args, **kwargs):
+        key = (name, _arguments_key(args, kwargs))
+        try:
+            value = self._values[key]
+        except KeyError:
+            value = getattr(self.load(), name)(*args, **kwargs)
+            self._values[key] = value
+            self._catalog._store_descriptor(self.path, key, value)
+        # Don't let the caller modify the stored value
+        return copy(value) if isinstance(value, (list, dict)) else value
+
+    def __getattr__(self, attribute):
+        if attribute.startswith('_'):
+            raise AttributeError(attribute)
+        if attribute in self._adclass._descriptor_names:
+            return partial(self._descriptor, attribute)
+        return getattr(self.load(), attribute)
+
+
+class MetadataCatalog(object):
+    """
+    SQLite catalog of file metadata, refreshed incrementally: a file is only
+    opened when it is not in the catalog, or its size or modification time
+    have changed since it was catalogued.
+
+    Parameters
+    ----------
+    path : str
+        The SQLite database. It is created if it doesn't exist, and rebuilt
+        if it was made by different AstroData classes.
+    commit_every : int
+        Number of modifications after which they are committed. Writing
+        locks the database, so processes sharing it should commit often.
+    """
+    def __init__(self, path=DEFAULT_CATALOG, commit_every=COMMIT_EVERY):
+        self.path = os.path.expanduser(path)
+        self.commit_every = commit_every
+        dirname = os.path.dirname(self.path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        self._classes = dict((cls.__name__, cls)
+                             for cls in astrodata.factory._registry)
+        self._pending = 0
+        self._conn = sqlite3.connect(self.path, timeout=60)
+        self._conn.text_factory = str
+        self._init_tables()
+
+    def _init_tables(self):
+        cursor = self._conn.cursor()
+        for statement in _SCHEMA:
+            cursor.execute(statement)
+        fingerprint = _fingerprint()
+        row = cursor.execute("SELECT value FROM meta WHERE key = 'fingerprint'"
+                             ).fetchone()
+        if row is None or row[0] != fingerprint:
+            cursor.execute("DELETE FROM descriptors")
+            cursor.execute("DELETE FROM files")
+            cursor.execute("INSERT OR REPLACE INTO meta VALUES "
+                           "('fingerprint', ?)", (fingerprint,))
+        self._conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def commit(self):
+        self._conn.commit()
+        self._pending = 0
+
+    def close(self):
+        """Commits any pending changes and closes the database"""
+        if self._conn is not None:
+            self.commit()
+            self._conn.close()
+            self._conn = None
+
+    def _modified(self):
+        self._pending += 1
+        if self._pending >= self.commit_every:
+            self.commit()
+
+    def _store_descriptors(self, path, values):
+        rows = []
+        for (name, args), value in values.items():
+            try:
+                blob = pickle.dumps(value, 2)
+            except Exception:
+                # Not everything can be stored. It will be recomputed next time
+                continue
+            rows.append((path, name, args, sqlite3.Binary(blob)))
+        self._conn.executemany("INSERT OR REPLACE INTO descriptors VALUES "
+                               "(?, ?, ?, ?)", rows)
+
+    def _store_descriptor(self, path, key, value):
+        self._store_descriptors(path, {key: value})
+        self._modified()
+
+    def _lookup(self, path, size, mtime):
+        row = self._conn.execute("SELECT adclass, tags, phu FROM files WHERE "
+                                 "path = ? AND size = ? AND mtime = ?",
+                                 (path, size, mtime)).fetchone()
+        if row is None or row[0] not in self._classes:
+            return None
+        values = {}
+        for name, args, blob in self._conn.execute(
+                "SELECT name, args, value FROM descriptors WHERE path = ?",
+                (path,)):
+            try:
+                values[(name, args)] = pickle.loads(bytes(blob))
+            except Exception:
+                pass
+        return CatalogEntry(self, path, self._classes[row[0]],
+                            row[1].split(), row[2], values)
+
+    def _catalogue(self, path, size, mtime):
+        ad = astrodata.open(path)
+        adclass = ad.__class__
+        values = {}
+        for name, kwargs in COMMON_DESCRIPTORS:
+            if name in adclass._descriptor_names:
+                try:
+                    values[(name, _arguments_key((), kwargs))] = getattr(
+                        ad, name)(**kwargs)
+                except Exception:
+                    # Raised again if someone asks for it
+                    pass
+        entry = CatalogEntry(self, path, adclass, ad.tags, ad.phu, values)
+        entry._ad = ad
+        self._conn.execute("DELETE FROM descriptors WHERE path = ?", (path,))
+        self._conn.execute("INSERT OR REPLACE INTO files VALUES "
+                           "(?, ?, ?, ?, ?, ?)",
+                           (path, size, mtime, adclass.__name__,
+                            ' '.join(sorted(entry._tags)),
+                            ad.phu.tostring()))
+        self._store_descriptors(path, values)
+        self._modified()
+        return entry
+
+    def entry(self, path):
+        """
+        Returns the ``CatalogEntry`` for a file, opening it and updating the
+        catalog only if it's new or has changed.
+
+        Raises whatever ``os.stat`` or ``astrodata.open`` raise for a file
+        that is missing or can't be opened (which is not catalogued).
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        entry = self._lookup(path, stat.st_size, stat.st_mtime)
+        if entry is None:
+            entry = self._catalogue(path, stat.st_size, stat.st_mtime)
+        return entry
+
+    def refresh(self, paths):
+        """
+        Brings the catalog up to date for a list of files, and returns the
+        paths that could not be catalogued.
+        """
+        failed = []
+        for path in paths:
+            try:
+                self.entry(path)
+            except Exception:
+                failed.append(path)
+        self.commit()
+        return failed
+
+    def prune(self):
+        """Removes the entries for files that don't exist any more"""
+        missing = [(path,) for (path,) in
+                   self._conn.execute("SELECT path FROM files")
+                   if not os.path.exists(path)]
+        self._conn.executemany("DELETE FROM descriptors WHERE path = ?",
+                               missing)
+        self._conn.executemany("DELETE FROM files WHERE path = ?", missing)
+        self.commit()
+        return len(missing)
+
+
+def open_catalog(path=DEFAULT_CATALOG):
+    """
+    Returns the MetadataCatalog at `path`, or None (with a warning) if it
+    can't be opened or created, so that the callers can go on without it.
+    """
+    try:
+        return MetadataCatalog(path)
+    except (EnvironmentError, sqlite3.Error) as err:
+        warnings.warn("Not using the metadata catalog {}: {}".format(path, err))
+        return None
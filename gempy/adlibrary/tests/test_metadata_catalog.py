@@ -0,0 +1,167 @@
+# pytest suite
+"""
+Tests for the metadata catalog, and its use by dataselect.
+
+This is a suite of tests to be run with pytest. The files are created on
+the fly, so no test data is needed.
+
+To run:
+    1) py.test -v   (must in gemini_python or have it in PYTHONPATH)
+"""
+import os
+from datetime import date
+
+import numpy as np
+import pytest
+
+from astropy.io import fits
+
+import astrodata
+import gemini_instruments
+
+from gempy.adlibrary import dataselect, metadata_catalog
+from gempy.adlibrary.metadata_catalog import MetadataCatalog, open_catalog
+
+
+def make_file(filename, exptime=30., obstype='OBJECT'):
+    phu = fits.PrimaryHDU()
+    phu.header.update({'INSTRUME': 'GMOS-N', 'TELESCOP': 'Gemini-North',
+                       'OBSTYPE': obstype, 'OBSCLASS': 'science',
+                       'OBSMODE': 'IMAGE', 'EXPTIME': exptime,
+                       'DATE-OBS': '2018-01-01', 'TIME-OBS': '10:00:00',
+                       'OBJECT': 'M31', 'FILTER1': 'r_G0303',
+                       'FILTER2': 'open2-8', 'GRATING': 'MIRROR'})
+    sci = fits.ImageHDU(np.zeros((4, 4), dtype=np.float32), name='SCI', ver=1)
+    fits.HDUList([phu, sci]).writeto(filename, overwrite=True)
+
+
+@pytest.fixture
+def night(tmpdir, monkeypatch):
+    paths = [str(tmpdir.join('N20180101S{:04d}.fits'.format(i)))
+             for i in range(1, 5)]
+    for i, path in enumerate(paths):
+        make_file(path, exptime=30. if i % 2 else 60.,
+                  obstype='BIAS' if i == 3 else 'OBJECT')
+
+    opened = []
+    def counting_open(source):
+        opened.append(source)
+        return real_open(source)
+    real_open = astrodata.open
+    monkeypatch.setattr(astrodata, 'open', counting_open)
+    return paths, str(tmpdir.join('catalog', 'metadata.db')), opened
+
+
+@pytest.mark.parametrize("tags,xtags,expression", [
+    ([], [], 'exposure_time==30'),
+    (['GMOS'], ['BIAS'], 'filter_name=="r"'),
+    (['BIAS'], [], 'True'),
+    ([], [], 'ut_date>"2017-12-31" and observation_class=="science"'),
+])
+def test_dataselect_with_catalog(night, tags, xtags, expression):
+    paths, catalog_path, opened = night
+    expression = dataselect.expr_parser(expression)
+    expected = dataselect.select_data(paths, tags, xtags, expression)
+    assert expected and len(opened) == len(paths)
+
+    for run in range(2):
+        del opened[:]
+        with MetadataCatalog(catalog_path) as catalog:
+            assert dataselect.select_data(paths, tags, xtags, expression,
+                                          catalog=catalog) == expected
+        # Only the first run opens the files
+        assert len(opened) == (len(paths) if run == 0 else 0)
+
+
+def test_catalog_refresh(night):
+    paths, catalog_path, opened = night
+    with MetadataCatalog(catalog_path) as catalog:
+        assert catalog.refresh(paths) == []
+    del opened[:]
+
+    # Files are opened again only if they have changed
+    stat = os.stat(paths[1])
+    make_file(paths[1], exptime=45.)
+    os.utime(paths[1], (stat.st_atime, stat.st_mtime + 10))
+    with MetadataCatalog(catalog_path) as catalog:
+        entries = [catalog.entry(path) for path in paths]
+        assert opened == [paths[1]]
+        assert [entry.exposure_time() for entry in entries] == [60., 45., 60., 30.]
+        assert entries[0].ut_date() == date(2018, 1, 1)
+        assert entries[3].tags == astrodata.open(paths[3]).tags
+        assert entries[0].phu['OBJECT'] == 'M31'
+        del opened[:]
+
+        # Calls that aren't in the catalog are added to it
+        assert entries[0].filter_name(stripID=True) == 'r&open2-8'
+        assert opened == [paths[0]]
+    with MetadataCatalog(catalog_path) as catalog:
+        assert catalog.entry(paths[0]).filter_name(stripID=True) == 'r&open2-8'
+        assert opened == [paths[0]]
+
+        # Files that can't be opened are reported, and not catalogued
+        bad_path = paths[0].replace('S0001', 'S9999')
+        with open(bad_path, 'w') as bad_file:
+            bad_file.write('Not a FITS file')
+        assert catalog.refresh(paths + [bad_path]) == [bad_path]
+        with pytest.raises(Exception):
+            catalog.entry(bad_path)
+
+        os.remove(paths[0])
+        assert catalog.prune() == 1
+
+
+def test_catalog_invalidated_by_lookups(night, monkeypatch):
+    paths, catalog_path, opened = night
+    with MetadataCatalog(catalog_path) as catalog:
+        catalog.refresh(paths)
+    del opened[:]
+
+    # Editing a lookup table may change the descriptors
+    real_getmtime = os.path.getmtime
+    def getmtime(path):
+        mtime = real_getmtime(path)
+        if path.endswith(os.path.join('gmos', 'lookup.py')):
+            mtime += 10
+        return mtime
+    monkeypatch.setattr(metadata_catalog.os.path, 'getmtime', getmtime)
+    with MetadataCatalog(catalog_path) as catalog:
+        catalog.refresh(paths)
+    assert opened == paths
+
+
+def test_open_catalog(night):
+    paths, catalog_path, opened = night
+    catalog = open_catalog(catalog_path)
+    assert isinstance(catalog, MetadataCatalog)
+    catalog.close()
+
+    # Users that can't create the catalog go on without one
+    with pytest.warns(UserWarning):
+        assert open_catalog(os.path.join(paths[0], 'metadata.db')) is None
+
+
+def test_dataselect_processes(night):
+    paths, catalog_path, opened = night
+    paths = paths * 3
+    expression = dataselect.expr_parser('exposure_time==60 or '
+                                        'observation_type=="BIAS"')
+    expected = dataselect.select_data(paths, [], [], expression)
+    assert expected == [path for i, path in enumerate(paths) if i % 4 != 1]
+    assert dataselect.select_data(paths, [], [], expression,
+                                  num_processes=3) == expected
+
+    # The pool commits what it puts in the catalog
+    with MetadataCatalog(catalog_path) as catalog:
+        assert dataselect.select_data(paths, ['GMOS'], [], expression,
+                                      catalog=catalog,
+                                      num_processes=3) == expected
+    del opened[:]
+    with MetadataCatalog(catalog_path) as catalog:
+        assert dataselect.select_data(paths, ['GMOS'], [], expression,
+                                      catalog=catalog) == expected
+    assert opened == []
+
+    with pytest.raises(IOError):
+        dataselect.select_data(paths, expression='ad.exposure_time()',
+                               num_processes=2)
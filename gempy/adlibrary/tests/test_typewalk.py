@@ -0,0 +1,127 @@
+# pytest suite
+"""
+Tests for typewalk, and its classification of files from their PHU.
+
+This is a suite of tests to be run with pytest. The files are created on
+the fly, so no test data is needed.
+
+To run:
+    1) py.test -v   (must in gemini_python or have it in PYTHONPATH)
+"""
+import os
+import runpy
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from astropy.io import fits
+
+import astrodata
+import gemini_instruments
+
+from gemini_instruments.gmos import AstroDataGmos
+
+TYPEWALK = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir,
+                        'scripts', 'typewalk.py')
+
+
+def make_gmos(filename, obstype='OBJECT'):
+    phu = fits.PrimaryHDU()
+    phu.header.update({'INSTRUME': 'GMOS-N', 'OBSERVAT': 'Gemini-North',
+                       'TELESCOP': 'Gemini-North', 'OBSTYPE': obstype,
+                       'OBSCLASS': 'science', 'GRATING': 'MIRROR'})
+    sci = fits.ImageHDU(np.zeros((4, 4), dtype=np.float32), name='SCI', ver=1)
+    fits.HDUList([phu, sci]).writeto(filename, overwrite=True)
+
+
+def make_igrins(filename):
+    # The instrument and the observation type are only in the extension
+    phu = fits.PrimaryHDU()
+    phu.header.update({'OBSERVAT': 'Gemini-South', 'TELESCOP': 'Gemini-South'})
+    sci = fits.ImageHDU(np.zeros((4, 4), dtype=np.float32), name='SCI', ver=1)
+    sci.header.update({'INSTRUME': 'IGRINS', 'OBJTYPE': 'DARK'})
+    fits.HDUList([phu, sci]).writeto(filename, overwrite=True)
+
+
+@pytest.fixture(scope='module')
+def typewalk():
+    return runpy.run_path(TYPEWALK)
+
+
+def test_phu_sufficient_is_not_inherited():
+    class AstroDataGmosDerived(AstroDataGmos):
+        pass
+
+    assert astrodata.factory.isPhuSufficient(AstroDataGmos)
+    assert not astrodata.factory.isPhuSufficient(AstroDataGmosDerived)
+
+
+def test_header_only_tags(typewalk, tmpdir, monkeypatch):
+    file_tags, phu_tags = typewalk['file_tags'], typewalk['phu_tags']
+    gmos, igrins = str(tmpdir.join('gmos.fits')), str(tmpdir.join('igrins.fits'))
+    make_gmos(gmos, obstype='BIAS')
+    make_igrins(igrins)
+
+    for path in (gmos, igrins):
+        expected = sorted(astrodata.open(path).tags)
+        assert sorted(file_tags(path)[0]) == expected
+        assert sorted(file_tags(path, header_only=True)[0]) == expected
+    assert 'DARK' in file_tags(igrins, header_only=True)[0]
+
+    # GMOS is classified without opening the file, IGRINS needs it
+    opened = []
+    def counting_open(source):
+        opened.append(source)
+        return real_open(source)
+    real_open = astrodata.open
+    monkeypatch.setattr(astrodata, 'open', counting_open)
+    file_tags(gmos, header_only=True)
+    file_tags(igrins, header_only=True)
+    assert opened == [igrins]
+    assert phu_tags(igrins) is None
+
+    bad = str(tmpdir.join('bad.fits'))
+    with open(bad, 'w') as bad_file:
+        bad_file.write('Not a FITS file')
+    assert file_tags(bad, header_only=True) == (
+        None, "AstroData failed to open file: {}".format(bad))
+
+
+def run_typewalk(directory, *args):
+    # The catalog is opt-in: nothing is written to the (fake) home directory
+    env = dict(os.environ, HOME=directory,
+               PYTHONPATH=os.pathsep.join(sys.path))
+    output = subprocess.check_output(
+        [sys.executable, TYPEWALK, '-d', directory] + list(args),
+        env=env, universal_newlines=True)
+    assert not os.path.exists(os.path.join(directory, '.geminidr'))
+    return output
+
+
+def test_typewalk_processes(tmpdir):
+    for i in range(6):
+        make_gmos(str(tmpdir.join('N{:04d}.fits'.format(i))),
+                  obstype='BIAS' if i % 2 else 'OBJECT')
+    tmpdir.mkdir('sub')
+    make_igrins(str(tmpdir.join('sub', 'S0001.fits')))
+    with open(str(tmpdir.join('sub', 'bad.fits')), 'w') as bad_file:
+        bad_file.write('Not a FITS file')
+
+    directory = str(tmpdir)
+    serial = run_typewalk(directory, '--tags', 'BIAS', 'DARK', '--or',
+                          '-o', str(tmpdir.join('serial.lis')))
+    parallel = run_typewalk(directory, '--tags', 'BIAS', 'DARK', '--or',
+                            '-o', str(tmpdir.join('parallel.lis')),
+                            '-j', '3', '--header-only')
+    assert parallel == serial
+    assert serial.count('directory:') == 2
+    assert 'S0001.fits' in serial and 'AstroData failed' in serial
+
+    # The output files only differ in the time they were written
+    listings = [[line for line in open(str(tmpdir.join(name)))
+                 if not line.startswith('# Written')]
+                for name in ('serial.lis', 'parallel.lis')]
+    assert listings[0] == listings[1]
+    assert len([line for line in listings[0] if not line.startswith('#')]) == 4
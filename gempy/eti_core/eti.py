@@ -24,11 +24,9 @@ class ExternalTaskInterface(object):
         self.param_objs = []
         self.file_objs = []
         if primitives_class is not None:
-            self.inQueue = primitives_class._inQueue
-            self.outQueue = primitives_class._outQueue
+            self.cmd_host = primitives_class._cmd_host
         else:
-            self.inQueue = None
-            self.outQueue = None
+            self.cmd_host = None
 
     def run(self):
         log.debug("ExternalTaskInterface.run()")
@@ -147,9 +147,8 @@ class SExtractorETI(ETI):
         return [fil.recover() for fil in self.file_objs]
 
     def _execute(self, command):
-        if self.inQueue is not None:
-            self.inQueue.put(command)
-            result = self.outQueue.get()
+        if self.cmd_host is not None:
+            result = self.cmd_host.run(command)
             if isinstance(result, Exception):
                 raise result
         else:
@@ -18,6 +18,7 @@ import itertools
 import numpy as np
 
 from copy import deepcopy
+from collections import OrderedDict
 from datetime import datetime
 from importlib import import_module
 
@@ -29,6 +30,7 @@ from astropy.modeling import models, fitting
 from astropy.table import vstack, Table, Column
 
 from scipy.special import erf
+from scipy.spatial import cKDTree
 
 from ..library import astrotools as at
 from ..utils import logutils
@@ -376,6 +378,15 @@ def check_inputs_match(adinput1=None, adinput2=None, check_filter=True,
     return
 
 
+# Descriptors that must be equal for two frames to have the same
+# instrument configuration
+INST_CONFIG_DESCRIPTORS = ['data_section', 'detector_roi_setting', 'read_mode',
+                           'well_depth_setting', 'gain_setting',
+                           'detector_x_bin', 'detector_y_bin', 'coadds',
+                           'camera', 'filter_name', 'focal_plane_mask',
+                           'lyot_stop', 'decker', 'pupil_mask', 'disperser']
+
+
 def matching_inst_config(ad1=None, ad2=None, check_exposure=False):
     """
     Compare two AstroData instances and report whether their instrument
@@ -413,12 +424,7 @@ def matching_inst_config(ad1=None, ad2=None, check_exposure=False):
                 break
 
     # Check all these descriptors for equality
-    things_to_check = ['data_section', 'detector_roi_setting', 'read_mode',
-                       'well_depth_setting', 'gain_setting', 'detector_x_bin',
-                       'detector_y_bin', 'coadds', 'camera', 'filter_name',
-                       'focal_plane_mask', 'lyot_stop', 'decker',
-                       'pupil_mask', 'disperser']
-    for descriptor in things_to_check:
+    for descriptor in INST_CONFIG_DESCRIPTORS:
         if getattr(ad1, descriptor)() != getattr(ad2, descriptor)():
             result = False
             log.debug('  Descriptor failure for {}'.format(descriptor))
@@ -446,6 +452,184 @@ def matching_inst_config(ad1=None, ad2=None, check_exposure=False):
     
     return result
 
+
+class SkyAssociationIndex(object):
+    """
+    An index of sky frames which selects the skies to associate with each
+    science frame. It gives the same results as checking every sky against
+    each science frame with matching_inst_config() and comparing their
+    telescope offsets, but only evaluates the descriptors once per frame.
+
+    Skies are grouped by the descriptors that have to be identical, and then
+    by their central wavelengths and exposure times, which only have to
+    match within a tolerance. The skies that match a science frame are kept
+    sorted by time, with a KD-tree of their offsets to find the ones that
+    are too close to the science frame to be used.
+    """
+    def __init__(self, ad_skies):
+        """
+        Parameters
+        ----------
+        ad_skies: list of AD
+            sky frames which can be associated with science frames
+        """
+        # Duplicated skies only count once
+        self.skies = list(OrderedDict.fromkeys(ad_skies))
+        self._epoch = None
+        frames = [self._frame_info(ad) for ad in self.skies]
+        self._times = np.array([f[2] for f in frames], dtype=np.int64)
+        self._offsets = np.array([f[3] for f in frames],
+                                 dtype=np.float64).reshape(-1, 2)
+        self._groups = {}
+        for i, (key, tolerance_key, _, _) in enumerate(frames):
+            group = self._groups.setdefault(key, OrderedDict())
+            group.setdefault(tolerance_key, []).append(i)
+        self._subsets = {}
+
+    def associate(self, ad, seconds, min_distsq=0, min_skies=None,
+                  max_skies=None):
+        """
+        Select the skies for a science frame. These are the skies with the
+        same instrument configuration and offset by more than the minimum
+        distance from it that are closest in time. All the skies within the
+        time limit are used, but at least min_skies and at most max_skies.
+        Skies equally close in time are taken in the order they were given.
+
+        Parameters
+        ----------
+        ad: AD
+            science frame
+        seconds: datetime.timedelta
+            time limit for associating skies
+        min_distsq: float
+            square of the minimum separation (in arcseconds) of the skies
+        min_skies: int/None
+            minimum number of skies to associate
+        max_skies: int/None
+            maximum number of skies to associate
+
+        Returns
+        -------
+        list of AD: the associated skies, in chronological order
+        """
+        key, tolerance_key, time, (xoffset, yoffset) = self._frame_info(ad)
+        subset = self._subset(key, tolerance_key)
+        if subset is None:
+            return []
+        indices, times, tree = subset
+        num_skies = len(indices)
+        limit = _microseconds(seconds)
+
+        # The tree is searched with a slightly larger radius so the same
+        # comparison as matching the frames one by one decides on the edge
+        excluded = np.zeros(num_skies, dtype=bool)
+        radius = (np.sqrt(min_distsq) * (1 + 1e-9) +
+                  1e-9 * (1 + abs(xoffset) + abs(yoffset)))
+        near = np.array(tree.query_ball_point((xoffset, yoffset), radius),
+                        dtype=int)
+        if near.size:
+            offsets = self._offsets[indices[near]]
+            excluded[near] = ((offsets[:, 0] - xoffset)**2 +
+                              (offsets[:, 1] - yoffset)**2 <= min_distsq)
+        num_excluded = excluded.sum()
+
+        start = np.searchsorted(times, time - limit, side='left')
+        end = np.searchsorted(times, time + limit, side='right')
+        num_matching = end - start - excluded[start:end].sum()
+        num_wanted = num_skies - num_excluded
+        if max_skies is not None:
+            num_wanted = min(num_wanted, max_skies)
+        num_wanted = min(num_wanted, max(min_skies or 0, num_matching))
+        if num_wanted <= 0:
+            return []
+
+        # The closest skies in time are within this many places on either
+        # side, but there may be others equally close further away
+        centre = np.searchsorted(times, time)
+        width = num_wanted + num_excluded
+        start, end = max(centre - width, 0), min(centre + width, num_skies)
+        good = ~excluded[start:end]
+        furthest = np.sort(np.abs(times[start:end][good] - time))[num_wanted-1]
+        while start > 0 and time - times[start-1] <= furthest:
+            start -= 1
+        while end < num_skies and times[end] - time <= furthest:
+            end += 1
+        places = np.arange(start, end)[~excluded[start:end]]
+        order = np.lexsort((indices[places], np.abs(times[places] - time)))
+        # Skies are sorted by time (and input order for equal times)
+        places = np.sort(places[order[:num_wanted]])
+        return [self.skies[i] for i in indices[places]]
+
+    def _frame_info(self, ad):
+        """Evaluate all the descriptors needed for associating a frame"""
+        key = (len(ad), tuple(ndd.shape for ndd in ad.nddata),
+               tuple(_hashable(getattr(ad, descriptor)())
+                     for descriptor in INST_CONFIG_DESCRIPTORS))
+        tolerance_key = (_hashable(ad.central_wavelength()),
+                         _hashable(ad.exposure_time()))
+        ut_datetime = ad.ut_datetime()
+        if self._epoch is None:
+            self._epoch = ut_datetime
+        return (key, tolerance_key, _microseconds(ut_datetime - self._epoch),
+                (ad.telescope_x_offset(), ad.telescope_y_offset()))
+
+    def _subset(self, key, tolerance_key):
+        """
+        Return the indices of the skies whose configuration matches, sorted
+        by time, with their times and a KD-tree of their offsets
+        """
+        group = self._groups.get(key)
+        if group is None:
+            return None
+        matches = tuple(i for i, sky_key in enumerate(group)
+                        if _matching_tolerances(tolerance_key, sky_key))
+        if not matches:
+            return None
+        try:
+            return self._subsets[key, matches]
+        except KeyError:
+            pass
+        members = list(group.values())
+        indices = np.array(sorted(itertools.chain(*[members[i]
+                                                    for i in matches])))
+        indices = indices[np.lexsort((indices, self._times[indices]))]
+        subset = (indices, self._times[indices],
+                  cKDTree(self._offsets[indices]))
+        self._subsets[key, matches] = subset
+        return subset
+
+
+def _hashable(value):
+    """Convert the lists returned by descriptors into tuples"""
+    if isinstance(value, list):
+        return tuple(_hashable(v) for v in value)
+    return value
+
+
+def _matching_tolerances(tolerance_key1, tolerance_key2):
+    """
+    Compare central wavelengths and exposure times with the tolerances
+    used by matching_inst_config()
+    """
+    (cenwave1, exptime1), (cenwave2, exptime2) = tolerance_key1, tolerance_key2
+    try:
+        if not abs(cenwave1 - cenwave2) < 0.001:
+            return False
+    except TypeError:
+        if cenwave1 != cenwave2:
+            return False
+    try:
+        return not abs(exptime1 - exptime2) > 0.01
+    except TypeError:
+        log = logutils.get_logger(__name__)
+        log.error('Non-numeric type from exposure_time() descriptor')
+        return True
+
+
+def _microseconds(delta):
+    """Express a timedelta as an integer number of microseconds"""
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
 @handle_single_adinput
 def clip_auxiliary_data(adinput=None, aux=None, aux_type=None, 
                         return_dtype=None):
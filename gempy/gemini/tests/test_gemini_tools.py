@@ -14,7 +14,7 @@ import os
 import numpy as np
 import astrodata
 import gemini_instruments
-from datetime import datetime
+from datetime import datetime, timedelta
 from gempy.gemini import gemini_tools as gt
 from geminidr.gemini.lookups.keyword_comments import keyword_comments
 
@@ -195,3 +195,65 @@ class TestGeminiTools:
 
     def test_write_database(self):
         pass
+
+
+class FakeSkyAD(object):
+    """Just the descriptors needed for associating skies"""
+    def __init__(self, name, ut_datetime, xoffset, yoffset, filter_name='J',
+                 exposure_time=10., shape=(20, 20)):
+        self.filename = name
+        self.nddata = [np.empty(shape)]
+        self._values = {'ut_datetime': ut_datetime, 'filter_name': filter_name,
+                        'exposure_time': exposure_time,
+                        'telescope_x_offset': xoffset,
+                        'telescope_y_offset': yoffset,
+                        'central_wavelength': 1.25,
+                        'data_section': [[0, shape[1], 0, shape[0]]]}
+
+    def __len__(self):
+        return len(self.nddata)
+
+    def __getattr__(self, descriptor):
+        return lambda: self._values.get(descriptor)
+
+
+def associate_skies_one_by_one(ad, ad_skies, seconds, min_distsq, min_skies,
+                               max_skies):
+    # How associateSky used to compare every sky with each science frame
+    sky_dict = {k: k.ut_datetime() for k in ad_skies
+                if gt.matching_inst_config(ad1=ad, ad2=k, check_exposure=True)
+                and ((k.telescope_x_offset() - ad.telescope_x_offset())**2 +
+                     (k.telescope_y_offset() - ad.telescope_y_offset())**2
+                     > min_distsq)}
+    sky_list = sorted(sky_dict, key=lambda x: (abs(sky_dict[x] - ad.ut_datetime()),
+                                               ad_skies.index(x)))[:max_skies]
+    num_matching_skies = len([k for k in sky_dict
+                              if abs(sky_dict[k] - ad.ut_datetime()) <= seconds])
+    num_skies = min(max_skies or len(sky_list),
+                    max(min_skies or 0, num_matching_skies))
+    return sorted(sky_list[:num_skies], key=lambda sky: sky.ut_datetime())
+
+
+def test_sky_association_index():
+    rng = np.random.RandomState(0)
+    start = datetime(2017, 1, 1)
+    ad_skies = []
+    for i in range(150):
+        # Repeated times and offsets (a 3x3 dither) to exercise ties
+        ad_skies.append(FakeSkyAD(
+            'sky{}'.format(i), start + timedelta(seconds=15 * (i // 2)),
+            5. * (i % 3), 5. * (i // 3 % 3), filter_name=rng.choice(['J', 'H']),
+            exposure_time=rng.choice([10., 10.005, 30.]),
+            shape=(20, 20) if i % 10 else (20, 30)))
+    sky_index = gt.SkyAssociationIndex(ad_skies)
+    for ad in ad_skies[::7] + [FakeSkyAD('sci', start, 50., 0.)]:
+        for time, distance, min_skies, max_skies in ((60, 3, 3, None),
+                                                     (60, 0, None, 4),
+                                                     (0, 5, 5, 20),
+                                                     (600, 7.5, 0, 0)):
+            seconds = timedelta(seconds=time)
+            assert (sky_index.associate(ad, seconds, distance**2, min_skies,
+                                        max_skies) ==
+                    associate_skies_one_by_one(ad, ad_skies, seconds,
+                                               distance**2, min_skies,
+                                               max_skies))
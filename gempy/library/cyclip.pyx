@@ -2,20 +2,30 @@
 # you may need to run this command again under the new
 # environment.
 # cythonize -a -i cyclip.pyx
+# (setup.py also compiles it with OpenMP, which lets iterclip() use
+# several threads; without it, the code runs single-threaded)
 
 # Specify that this source is nominally based on Python 3 syntax (though the
 # code below is actually 2-vs-3 agnostic), to avoid a warning with v0.29+:
 # cython: language_level=3
 
 import numpy as np
-from libc.math cimport sqrt
+from libc.math cimport sqrt, INFINITY
+from libc.stdlib cimport malloc, free
+from libc.stdint cimport int32_t, int64_t, uint32_t, INT64_MIN
 cimport cython
+from cython.parallel cimport parallel, prange, threadid
+
+# Pixels are clipped in blocks of this many, copied into pixel-major order
+# so that all the values for one pixel are contiguous
+cdef enum:
+    BLOCK_SIZE = 64
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
 cdef float median(float data[], unsigned short mask[], int has_mask,
-                  int data_size):
-    cdef float tmp[10000]
+                  int data_size, float tmp[]) noexcept nogil:
+    # tmp is a scratch array at least data_size long
     cdef float x, y, med=0.
     cdef int i, j, k, l, m, ncycles, cycle, nused=0
 
@@ -65,7 +75,8 @@ cdef float median(float data[], unsigned short mask[], int has_mask,
 @cython.wraparound(False)
 @cython.cdivision(True)
 cdef void mask_stats(float data[], unsigned short mask[], int has_mask,
-                int data_size, int return_median, double result[2]):
+                     int data_size, int return_median, double result[2],
+                     float tmp[]) noexcept nogil:
     cdef double mean, sum = 0., sumsq = 0., sumall = 0., sumsqall=0.
     cdef int i, nused = 0
     for i in range(data_size):
@@ -81,12 +92,12 @@ cdef void mask_stats(float data[], unsigned short mask[], int has_mask,
         nused = data_size
     mean = sum / float(nused)
     if return_median:
-        result[0] = <double>median(data, mask, has_mask, data_size)
+        result[0] = <double>median(data, mask, has_mask, data_size, tmp)
     else:
         result[0] = mean
     result[1] = sumsq / nused - mean*mean
 
-cdef long num_good(unsigned short mask[], long data_size):
+cdef long num_good(unsigned short mask[], long data_size) noexcept nogil:
     cdef long i, ngood = 0
     for i in range(data_size):
         if mask[i] == 0:
@@ -95,52 +106,236 @@ cdef long num_good(unsigned short mask[], long data_size):
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
-def iterclip(float [:] data, unsigned short [:] mask, float [:] variance,
-             int has_var, int num_img, long data_size, double lsigma, double hsigma,
-             int max_iters, int mclip, int sigclip):
-
-    cdef long i, n, ngood, new_ngood
-    cdef int iter, return_median
+cdef void clip_pixel(float data[], unsigned short mask[], float variance[],
+                     int use_var, int num_img, double lsigma, double hsigma,
+                     int max_iters, int mclip, float tmp[]) noexcept nogil:
+    # Iteratively clip the num_img values of a single pixel, updating mask.
+    # If use_var is set, the limits come from the variance of each value
+    # rather than the scatter of the values.
+    cdef long n, ngood, new_ngood
+    cdef int iter = 0, return_median = 1
     cdef double result[2]
-    cdef double avg, var, std
+    cdef double avg, std
     cdef float low_limit, high_limit
-    cdef float tmpdata[10000]
-    cdef unsigned short tmpmask[10000]
+
+    ngood = num_good(mask, num_img)
+    while iter < max_iters:
+        mask_stats(data, mask, 1, num_img, return_median, result, tmp)
+        avg = result[0]
+        if not use_var:
+            std = sqrt(result[1])
+            low_limit = avg - lsigma * std
+            high_limit = avg + hsigma * std
+            for n in range(num_img):
+                if data[n] < low_limit or data[n] > high_limit:
+                    mask[n] |= 1
+        else:
+            for n in range(num_img):
+                std = sqrt(variance[n])
+                if data[n] < avg-lsigma*std or data[n] > avg+hsigma*std:
+                    mask[n] |= 1
+
+        new_ngood = num_good(mask, num_img)
+        if new_ngood == ngood:
+            break
+        if not mclip:
+            return_median = 0
+        ngood = new_ngood
+        iter += 1
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+def iterclip(float [:] data, unsigned short [:] mask, float [:] variance,
+             int has_var, int num_img, long data_size, double lsigma, double hsigma,
+             int max_iters, int mclip, int sigclip, int num_threads=1):
+    """
+    Iterative sigma-clipping (sigclip=True) or variance-clipping of a stack
+    of num_img images, each flattened to data_size pixels and concatenated.
+    The mask is updated in place (and returned, with data and variance).
+    The GIL is released, and the pixels are divided between num_threads
+    threads if the module has been compiled with OpenMP support.
+    """
+    cdef long block, start, npix, p, n, thread
+    cdef long nblocks = (data_size + BLOCK_SIZE - 1) // BLOCK_SIZE
+    cdef int use_var = has_var and not sigclip
+    cdef long buf_size = BLOCK_SIZE * num_img
+    cdef float *bdata
+    cdef unsigned short *bmask
+    cdef float *bvar
+    cdef float *btmp
 
     if max_iters == 0:
         max_iters = 100
+    if num_threads < 1:
+        num_threads = 1
 
-    for i in range(data_size):
-        iter = 0
-        return_median = 1
-        for n in range(num_img):
-            tmpdata[n] = data[n*data_size+i]
-            tmpmask[n] = mask[n*data_size+i]
-        ngood = num_good(tmpmask, num_img)
-        while iter < max_iters:
-            mask_stats(tmpdata, tmpmask, 1, num_img, return_median, result)
-            avg = result[0]
-            if has_var == 0 or sigclip:
-                std = sqrt(result[1])
-                low_limit = avg - lsigma * std
-                high_limit = avg + hsigma * std
-                for n in range(num_img):
-                    if tmpdata[n] < low_limit or tmpdata[n] > high_limit:
-                        tmpmask[n] |= 1
-            else:
-                for n in range(num_img):
-                    std = sqrt(variance[n*data_size+i])
-                    if tmpdata[n] < avg-lsigma*std or tmpdata[n] > avg+hsigma*std:
-                        tmpmask[n] |= 1
+    # Scratch space for each thread, sized to the number of images
+    cdef float [:, ::1] tmpdata = np.empty((num_threads, buf_size), dtype=np.float32)
+    cdef unsigned short [:, ::1] tmpmask = np.empty((num_threads, buf_size),
+                                                    dtype=np.uint16)
+    cdef float [:, ::1] tmpvar = np.empty((num_threads, buf_size if use_var else 1),
+                                          dtype=np.float32)
+    cdef float [:, ::1] tmpwork = np.empty((num_threads, num_img), dtype=np.float32)
 
-            new_ngood = num_good(tmpmask, num_img)
-            if new_ngood == ngood:
-                break
-            if not mclip:
-                return_median = 0
-            ngood = new_ngood
-            iter += 1
-        for n in range(num_img):
-            mask[n*data_size+i] = tmpmask[n]
+    with nogil, parallel(num_threads=num_threads):
+        thread = threadid()
+        bdata = &tmpdata[thread, 0]
+        bmask = &tmpmask[thread, 0]
+        bvar = &tmpvar[thread, 0]
+        btmp = &tmpwork[thread, 0]
+        for block in prange(nblocks, schedule='static'):
+            start = block * BLOCK_SIZE
+            npix = min(BLOCK_SIZE, data_size - start)
+            for n in range(num_img):
+                for p in range(npix):
+                    bdata[p*num_img+n] = data[n*data_size+start+p]
+                    bmask[p*num_img+n] = mask[n*data_size+start+p]
+                    if use_var:
+                        bvar[p*num_img+n] = variance[n*data_size+start+p]
+            for p in range(npix):
+                clip_pixel(&bdata[p*num_img], &bmask[p*num_img],
+                           &bvar[p*num_img if use_var else 0], use_var,
+                           num_img, lsigma, hsigma, max_iters, mclip, btmp)
+            for n in range(num_img):
+                for p in range(npix):
+                    mask[n*data_size+start+p] = bmask[p*num_img+n]
 
     return np.asarray(data), np.asarray(mask), np.asarray(variance)
+
+cdef inline int64_t _sort_key(float x, long n) noexcept nogil:
+    # An integer that orders stack values as np.argsort() would (with NaNs
+    # last), made unique by breaking ties with the image number n
+    cdef int32_t bits
+    if x != x:
+        bits = 0x7fc00000
+    elif x == 0:  # -0 and +0 are equal
+        bits = 0
+    else:
+        bits = (<int32_t *>&x)[0]
+        if bits < 0:
+            bits ^= 0x7fffffff
+    return ((<int64_t>bits) << 32) + n
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef int64_t _key_at_rank(int64_t keys[], int64_t tmp[], long n,
+                          long k) noexcept nogil:
+    # Return the key with rank k. Small stacks count the keys below each
+    # one (which is branch-free and faster than partitioning), larger ones
+    # use the same selection algorithm as median()
+    cdef long i, j, l = 0, m = n - 1, rank
+    cdef int64_t x, y
+    if n <= 32:
+        for i in range(n):
+            x = keys[i]
+            rank = 0
+            for j in range(n):
+                rank += keys[j] < x
+            if rank == k:
+                return x
+
+    for i in range(n):
+        tmp[i] = keys[i]
+    while l < m:
+        x = tmp[k]
+        i = l
+        j = m
+        while True:
+            while tmp[i] < x:
+                i += 1
+            while x < tmp[j]:
+                j -= 1
+            if i <= j:
+                y = tmp[i]
+                tmp[i] = tmp[j]
+                tmp[j] = y
+                i += 1
+                j -= 1
+            if i > j:
+                break
+        if j < k:
+            l = i
+        if k < i:
+            m = j
+    return tmp[k]
+
+cdef inline int64_t _key_below(int64_t keys[], long n,
+                               int64_t key) noexcept nogil:
+    # Return the key immediately preceding "key" in the sorted order
+    cdef long i
+    cdef int64_t below = INT64_MIN
+    for i in range(n):
+        if keys[i] < key and keys[i] > below:
+            below = keys[i]
+    return below
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+def cymedian(float [::1] data, unsigned short [::1] mask, float [::1] variance,
+             int has_var, int num_img, long data_size, unsigned short bad,
+             int low):
+    """
+    Median (or low median) of a stack with a mask, matching
+    NDStacker.median() and NDStacker.lmedian(). Pixels with any of the bits
+    in "bad" set are ignored unless all inputs are bad. Returns the combined
+    data, mask and variance (the last is None if has_var is false).
+    """
+    cdef long i, n, ngood, i1, i2
+    cdef int64_t key
+    cdef float s
+    cdef float [:] out_data = np.empty((data_size,), dtype=np.float32)
+    cdef unsigned short [:] out_mask = np.empty((data_size,), dtype=np.uint16)
+    cdef float [:] out_var = np.empty((data_size if has_var else 1,),
+                                      dtype=np.float32)
+    cdef int64_t *keys = <int64_t *>malloc(num_img * sizeof(int64_t))
+    cdef int64_t *tmp = <int64_t *>malloc(num_img * sizeof(int64_t))
+    if keys == NULL or tmp == NULL:
+        free(keys)
+        free(tmp)
+        raise MemoryError()
+
+    with nogil:
+        for i in range(data_size):
+            ngood = 0
+            for n in range(num_img):
+                if mask[n*data_size+i] & bad:
+                    keys[n] = _sort_key(INFINITY, n)
+                else:
+                    keys[n] = _sort_key(data[n*data_size+i], n)
+                    ngood += 1
+            # Ranks follow Python's negative indexing when ngood=0
+            if low:
+                key = _key_at_rank(keys, tmp, num_img,
+                                   (ngood - 1) // 2 if ngood else num_img - 1)
+                i1 = i2 = <uint32_t>key
+            elif ngood % 2:
+                key = _key_at_rank(keys, tmp, num_img, ngood // 2)
+                i1 = i2 = <uint32_t>key
+            elif ngood:
+                key = _key_at_rank(keys, tmp, num_img, ngood // 2)
+                i2 = <uint32_t>key
+                i1 = <uint32_t>_key_below(keys, num_img, key)
+            else:
+                i1 = <uint32_t>_key_at_rank(keys, tmp, num_img, num_img - 1)
+                i2 = <uint32_t>_key_at_rank(keys, tmp, num_img, 0)
+            if low:
+                out_data[i] = data[i1*data_size+i]
+                out_mask[i] = mask[i1*data_size+i]
+                if has_var:
+                    out_var[i] = variance[i1*data_size+i]
+                continue
+            # Sum in single precision first, as numpy's mean() does
+            s = data[i1*data_size+i] + data[i2*data_size+i]
+            out_data[i] = s / 2
+            out_mask[i] = mask[i1*data_size+i] | mask[i2*data_size+i]
+            if has_var:
+                s = variance[i1*data_size+i] + variance[i2*data_size+i]
+                out_var[i] = s / 2
+
+    free(keys)
+    free(tmp)
+    return (np.asarray(out_data), np.asarray(out_mask),
+            np.asarray(out_var) if has_var else None)
@@ -1,6 +1,7 @@
 from __future__ import print_function
 
 import numpy as np
+import threading
 from functools import wraps
 from astrodata import NDAstroData
 from geminidr.gemini.lookups import DQ_definitions as DQ
@@ -60,6 +61,49 @@ def auto_adapt_to_methods(decorator):
         return _MethodDecoratorAdaptor(decorator, func)
     return adapt
 
+class ScratchBuffers(object):
+    """
+    Arrays that can be reused from one call to the next, to avoid allocating
+    new (and large) ones every time. Each thread gets its own set of arrays,
+    so that they can be used by concurrent stacking windows.
+
+    A request for a smaller array than the one already held returns a view
+    of (part of) the existing one. A larger one replaces it.
+    """
+    def __init__(self):
+        self._local = threading.local()
+
+    def get(self, name, shape, dtype):
+        buffers = self._local.__dict__
+        size = int(np.multiply.reduce(shape))
+        buf = buffers.get(name)
+        if buf is None or buf.dtype != dtype or buf.size < size:
+            buffers[name] = None  # release the old one first
+            buf = buffers[name] = np.empty(size, dtype=dtype)
+        return buf[:size].reshape(shape)
+
+def _is_float32(array):
+    # Regardless of the byte order (also takes a dtype)
+    dtype = np.dtype(getattr(array, 'dtype', array))
+    return dtype.kind == 'f' and dtype.itemsize == 4
+
+def _shape(ndd):
+    # The shape of an NDData-like object, without reading its pixels if
+    # it knows it
+    shape = getattr(ndd, 'shape', None)
+    return tuple(shape) if shape is not None else ndd.data.shape
+
+def _read_plane(ndd, plane, out):
+    # Writes a plane of an NDData-like object into out, straight from the
+    # file if possible. Returns False if the object doesn't have that plane
+    if hasattr(ndd, 'read_into'):
+        return ndd.read_into(plane, out) is not None
+    arr = getattr(ndd, plane)
+    if arr is None:
+        return False
+    out[...] = arr
+    return True
+
 @auto_adapt_to_methods
 def unpack_nddata(fn):
     # This decorator wraps a function that takes a sequence of NDAstroData
@@ -68,6 +112,15 @@ def unpack_nddata(fn):
     # It also applies a set of scale factors and/or offsets, if supplied,
     # to the raw data before stacking and passing them on.
     # The returned arrays are then stuffed back into an NDAstroData object.
+    # If the wrapped function is a method of an object with ScratchBuffers,
+    # the stacked arrays are built on them instead of being allocated.
+    buffers = getattr(getattr(fn, '__self__', None), '_buffers', None)
+
+    def new_array(name, shape, dtype):
+        if buffers is None:
+            return np.empty(shape, dtype=dtype)
+        return buffers.get(name, shape, dtype)
+
     @wraps(fn)
     def wrapper(sequence, scale=None, zero=None, *args, **kwargs):
         nddata_list = list(sequence)
@@ -79,23 +132,64 @@ def unpack_nddata(fn):
         # and preserving that datatype will cause problems with Cython
         # stacking if the compiler is little-endian.
         dtype = np.float32
-        data = np.empty((len(nddata_list),)+nddata_list[0].data.shape, dtype=dtype)
+        shape = (len(nddata_list),) + _shape(nddata_list[0])
+        data = new_array('data', shape, dtype)
         for i, (ndd, s, z) in enumerate(zip(nddata_list, scale, zero)):
-            data[i] = ndd.data * s + z
-        if any(ndd.mask is None for ndd in nddata_list):
-            mask = None
-        else:
-            mask = np.empty_like(data, dtype=DQ.datatype)
-            for i, ndd in enumerate(nddata_list):
-                mask[i] = ndd.mask
-        if any(ndd.variance is None for ndd in nddata_list):
-            variance = None
-        else:
-            variance = np.empty_like(data)
-            for i, (ndd, s, z) in enumerate(zip(nddata_list, scale, zero)):
-                variance[i] = ndd.variance * s*s
+            # In-place operations give the same results as "ndd.data * s + z"
+            # only if the input is already 32-bit float (or isn't scaled or
+            # offset). If it isn't, the pixels are scaled in the input's
+            # precision
+            if (hasattr(ndd, 'read_into') and
+                    (_is_float32(ndd.plane_dtype('data')) or
+                     (s == 1 and z == 0))):
+                ndd.read_into('data', data[i])
+                if s != 1:
+                    data[i] *= s
+                if z != 0:
+                    data[i] += z
+                continue
+            arr = ndd.data
+            if _is_float32(arr):
+                np.multiply(arr, s, out=data[i])
+                data[i] += z
+            else:
+                data[i] = arr * s + z
+        mask = new_array('mask', shape, DQ.datatype)
+        for i, ndd in enumerate(nddata_list):
+            if not _read_plane(ndd, 'mask', mask[i]):
+                mask = None
+                break
+        variance = new_array('variance', shape, dtype)
+        for i, (ndd, s, z) in enumerate(zip(nddata_list, scale, zero)):
+            if hasattr(ndd, 'read_into'):
+                var_dtype = ndd.plane_dtype('variance')
+                if var_dtype is None:
+                    variance = None
+                    break
+                if _is_float32(var_dtype) or s == 1:
+                    ndd.read_into('variance', variance[i])
+                    if s != 1:
+                        variance[i] *= s
+                        variance[i] *= s
+                    continue
+            arr = ndd.variance
+            if arr is None:
+                variance = None
+                break
+            if _is_float32(arr):
+                np.multiply(arr, s, out=variance[i])
+                variance[i] *= s
+            else:
+                variance[i] = arr * s*s
         out_data, out_mask, out_var = fn(data=data, mask=mask,
                                     variance=variance, *args, **kwargs)
+        if buffers is not None:
+            # The buffers will be overwritten by the next call. Make sure
+            # that we don't return views of them
+            out_data, out_mask, out_var = [
+                arr.copy() if arr is not None and any(np.may_share_memory(arr, buf)
+                    for buf in (data, mask, variance) if buf is not None) else arr
+                for arr in (out_data, out_mask, out_var)]
 
         # Can't instantiate NDAstroData with variance
         ret_value = NDAstroData(out_data, mask=out_mask)
@@ -122,8 +216,12 @@ def rejector(fn):
 class NDStacker(object):
     # Base class from which all stacking functions should subclass.
     # Put helper functions here so they can be inherited.
-    def __init__(self, combine='mean', reject='none', log=None, **kwargs):
+    # With reuse_buffers=True, the (N, ny, nx) arrays built for every window
+    # are allocated once (per thread) and reused for the following windows.
+    def __init__(self, combine='mean', reject='none', log=None,
+                 reuse_buffers=True, **kwargs):
         self._log = log
+        self._buffers = ScratchBuffers() if reuse_buffers else None
         try:
             combiner = getattr(self, combine)
             assert getattr(combiner, 'is_combiner')
@@ -324,6 +422,121 @@ class NDStacker(object):
             out_var = take_along_axis(variance, index, axis=0)
         return out_data, out_mask, out_var
 
+    # The following combiners give the same results as their namesakes above
+    # but avoid numpy.ma and full sorts of the stack, which are slow and need
+    # several temporary copies of the (N, ny, nx) arrays. The only exception
+    # is where a median falls on several identical values, when the mask and
+    # variance are taken from the one in the earliest image (np.argsort()
+    # does not guarantee which one the slower versions pick).
+    @staticmethod
+    def _fast_calculate_variance(data, mask, out_data):
+        # As calculate_variance(), using a single scratch array
+        ngood = data.shape[0] if mask is None else NDStacker._num_good(mask)
+        resid = np.subtract(data, out_data)
+        np.square(resid, out=resid)
+        if mask is not None:
+            np.putmask(resid, mask, 0)
+        denominator = ngood*(ngood-1)
+        # numpy.ma's domain handling puts 1 where there are fewer than two
+        # good pixels, so do the same
+        return np.divide(resid.sum(axis=0).astype(data.dtype), denominator,
+                         out=np.ones(data.shape[1:], dtype=data.dtype),
+                         where=(denominator!=0))
+
+    @staticmethod
+    def _masked_mean(arr, mask, ngood, scratch=None):
+        # Equivalent to np.ma.masked_array(arr, mask=mask).mean(axis=0).data
+        if mask is None:
+            return arr.mean(axis=0)
+        if scratch is None:
+            scratch = np.empty_like(arr)
+        np.copyto(scratch, arr)
+        np.putmask(scratch, mask, 0)
+        # Pixels with no good inputs are masked by np.ma, with data=0
+        return np.divide(scratch.sum(axis=0) * 1., ngood,
+                         out=np.zeros(arr.shape[1:]), where=(ngood!=0))
+
+    @staticmethod
+    @combiner
+    def fastmean(data, mask=None, variance=None):
+        # Regular arithmetic mean
+        mask, out_mask = NDStacker._process_mask(mask)
+        ngood = data.shape[0] if mask is None else NDStacker._num_good(mask)
+        scratch = None if mask is None else np.empty_like(data)
+        out_data = NDStacker._masked_mean(data, mask, ngood,
+                                          scratch).astype(data.dtype)
+        if variance is None:  # IRAF gemcombine calculation
+            out_var = NDStacker._fast_calculate_variance(data, mask, out_data)
+        else:
+            if scratch is not None and scratch.dtype != variance.dtype:
+                scratch = None
+            out_var = NDStacker._masked_mean(variance, mask, ngood,
+                                             scratch).astype(data.dtype) / ngood
+        return out_data, out_mask, out_var
+
+    @staticmethod
+    @combiner
+    def fastwtmean(data, mask=None, variance=None):
+        # Inverse-variance weighted mean
+        if variance is None:
+            return NDStacker.fastmean(data, mask, variance)
+        mask, out_mask = NDStacker._process_mask(mask)
+        scratch = np.divide(data, variance)
+        if mask is not None:
+            np.putmask(scratch, mask, 0)
+        numerator = scratch.sum(axis=0)
+        scratch = np.divide(1.0, variance, out=(scratch if scratch.dtype ==
+                                                variance.dtype else None))
+        if mask is not None:
+            np.putmask(scratch, mask, 0)
+        denominator = scratch.sum(axis=0)
+        out_data = (numerator / denominator).astype(data.dtype)
+        out_var = 1.0 / denominator.astype(data.dtype)
+        return out_data, out_mask, out_var
+
+    @staticmethod
+    def _fast_median(data, mask, variance, low):
+        if not (data.dtype == np.float32 and mask.dtype == DQ.datatype and
+                (variance is None or variance.dtype == np.float32)):
+            return None
+        shape = data.shape
+        data_size = int(np.multiply.reduce(shape[1:]))
+        out_data, out_mask, out_var = cyclip.cymedian(
+            np.ascontiguousarray(data).ravel(), np.ascontiguousarray(mask).ravel(),
+            (np.empty((1,), dtype=np.float32) if variance is None else
+             np.ascontiguousarray(variance).ravel()),
+            has_var=variance is not None, num_img=shape[0],
+            data_size=data_size, bad=BAD, low=int(low))
+        return (out_data.reshape(shape[1:]), out_mask.reshape(shape[1:]),
+                None if out_var is None else out_var.reshape(shape[1:]))
+
+    @staticmethod
+    @combiner
+    def fastmedian(data, mask=None, variance=None):
+        # Median
+        result = (None if mask is None else
+                  NDStacker._fast_median(data, mask, variance, low=False))
+        if result is None:
+            # Already efficient without a mask (np.argpartition)
+            return NDStacker.median(data, mask, variance)
+        out_data, out_mask, out_var = result
+        if variance is None:  # IRAF gemcombine calculation
+            out_var = NDStacker._fast_calculate_variance(data, mask, out_data)
+        return out_data, out_mask, out_var
+
+    @staticmethod
+    @combiner
+    def fastlmedian(data, mask=None, variance=None):
+        # Low median: i.e., if even number, take lower of 2 middle items
+        result = (None if mask is None else
+                  NDStacker._fast_median(data, mask, variance, low=True))
+        if result is None:
+            return NDStacker.lmedian(data, mask, variance)
+        out_data, out_mask, out_var = result
+        if variance is None:  # IRAF gemcombine calculation
+            out_var = NDStacker._fast_calculate_variance(data, mask, out_data)
+        return out_data, out_mask, out_var
+
     #------------------------ REJECTOR METHODS ----------------------------
     @staticmethod
     @rejector
@@ -369,23 +582,26 @@ class NDStacker(object):
     @staticmethod
     @rejector
     def sigclip(data, mask=None, variance=None, mclip=True, lsigma=3.0,
-                hsigma=3.0, max_iters=None):
+                hsigma=3.0, max_iters=None, num_threads=1):
         return NDStacker._cyclip(data, mask=mask, variance=variance,
                                   mclip=mclip, lsigma=lsigma, hsigma=hsigma,
-                                  max_iters=max_iters, sigclip=True)
+                                  max_iters=max_iters, sigclip=True,
+                                  num_threads=num_threads)
 
     @staticmethod
     @rejector
     def varclip(data, mask=None, variance=None, mclip=True, lsigma=3.0,
-                hsigma=3.0, max_iters=None):
+                hsigma=3.0, max_iters=None, num_threads=1):
         return NDStacker._cyclip(data, mask=mask, variance=variance,
                                   mclip=mclip, lsigma=lsigma, hsigma=hsigma,
-                                  max_iters=max_iters, sigclip=False)
+                                  max_iters=max_iters, sigclip=False,
+                                  num_threads=num_threads)
 
     @staticmethod
     def _cyclip(data, mask=None, variance=None, mclip=True, lsigma=3.0,
-                 hsigma=3.0, max_iters=None, sigclip=False):
-        # Prepares data for Cython iterative-clippingroutine
+                 hsigma=3.0, max_iters=None, sigclip=False, num_threads=1):
+        # Prepares data for Cython iterative-clipping routine, which releases
+        # the GIL and can split the pixels between num_threads threads
         if mask is None:
             mask = np.zeros_like(data, dtype=DQ.datatype)
         if variance is None:
@@ -401,7 +617,8 @@ class NDStacker(object):
         data, mask, variance = cyclip.iterclip(data.ravel(), mask.ravel(), variance.ravel(),
                                                has_var=has_var, num_img=num_img, data_size=data_size,
                                                mclip=int(mclip), lsigma=lsigma, hsigma=hsigma,
-                                               max_iters=max_iters, sigclip=int(sigclip))
+                                               max_iters=max_iters, sigclip=int(sigclip),
+                                               num_threads=num_threads)
         return data.reshape(shape), mask.reshape(shape), (None if not has_var else variance.reshape(shape))
 
     @staticmethod
@@ -444,3 +661,430 @@ class NDStacker(object):
         else:
             mask |= clipped_data.mask
         return data, mask, variance
+
+
+class IncrementalStacker(object):
+    """
+    Combines a set of images that changes a few frames at a time (such as
+    the sky frames of each science frame in a dither sequence) without
+    restacking the frames that stay. Frames are added and removed by key
+    and result() combines the current set as NDStacker would, with the
+    frames in the order of their keys, and optionally scaled or offset to
+    the background level of the first one (as stackFrames does).
+
+    Running sums over the good pixels of each frame serve the mean and
+    wtmean combiners, and the rank of each input pixel in the sorted stack
+    serves the medians and minmax rejection, so adding or removing a frame
+    doesn't involve the others beyond a comparison with its pixels. Frames
+    are kept normalized by their levels, so they don't need updating when
+    the first frame changes. Pixels that can't be combined from these (with no good
+    inputs, or with non-finite values) are stacked by NDStacker from a copy
+    of their inputs, as is the whole image if any frame has no variance.
+
+    Means agree with NDStacker's to float32 precision since the sums are
+    kept in double precision, and recomputed from the frames once as many
+    frames as are being combined have been removed, so that rounding errors
+    don't build up along a long sequence. Medians are identical, except
+    that scaled or offset values within rounding errors of each other may
+    be sorted in a different order.
+    """
+    combiners = ('mean', 'wtmean', 'median', 'lmedian')
+    rejectors = ('none', 'minmax')
+
+    def __init__(self, combine='mean', reject='none', nlow=0, nhigh=0,
+                 use_mask=True, scale=False, zero=False, log=None):
+        """
+        Parameters
+        ----------
+        combine: str
+            combining method (the "fast" versions are the same here)
+        reject: str
+            rejection method ("none" or "minmax")
+        nlow/nhigh: int
+            number of low/high pixels to reject with "minmax"
+        use_mask: bool
+            use the masks of the frames? (if not, none is output either)
+        scale: bool
+            scale the frames to the level of the first one?
+        zero: bool
+            offset the frames to the level of the first one? (if not scaled)
+        log: logger/None
+            passed to the NDStacker used for the remaining pixels
+        """
+        if combine.startswith('fast'):
+            combine = combine[4:]
+        if not self.supports(combine, reject):
+            raise ValueError("Cannot combine incrementally with combine={} "
+                             "and reject={}".format(combine, reject))
+        self.combine = combine
+        self.reject = reject
+        self.nlow, self.nhigh = nlow, nhigh
+        self.use_mask = use_mask
+        self.scale = scale
+        self.zero = zero and not scale
+        self._stacker = NDStacker(combine=combine, reject=reject, log=log,
+                                  reuse_buffers=False, nlow=nlow, nhigh=nhigh)
+        self._use_sums = combine in ('mean', 'wtmean')
+        self._use_sorted = not self._use_sums or reject == 'minmax'
+        self._slots = {}
+        self._free = []
+        self._novar = set()
+        self._shape = None
+        self._removed = 0   # frames removed since the sums were computed
+
+    @classmethod
+    def supports(cls, combine, reject):
+        """Can this combination of methods be used incrementally?"""
+        if combine.startswith('fast'):
+            combine = combine[4:]
+        return combine in cls.combiners and reject in cls.rejectors
+
+    @property
+    def frames(self):
+        """Keys of the frames currently being combined, in stacking order"""
+        return sorted(self._slots)
+
+    def memory_needed(self, shape, num_frames):
+        """
+        Estimate the memory used to combine frames of a given shape
+
+        Parameters
+        ----------
+        shape: tuple
+            shape of the frames
+        num_frames: int
+            number of frames combined at the same time
+
+        Returns
+        -------
+        int: number of bytes
+        """
+        # Room for frames is made by doubling, starting with 4
+        num_slots = 4
+        while num_slots < num_frames:
+            num_slots *= 2
+        per_slot = (np.dtype(np.float32).itemsize * 2 +
+                    np.dtype(DQ.datatype).itemsize)
+        if self._use_sorted:
+            per_slot += (np.dtype(np.float32).itemsize +
+                         np.dtype(np.int16).itemsize)
+        # Counts of good, clean, unusable and flagged pixels, and the sums
+        per_pixel = np.dtype(int).itemsize * 5
+        if self._use_sums:
+            per_pixel += np.dtype(np.float64).itemsize * 2
+        return (num_slots * per_slot + per_pixel) * int(np.prod(shape))
+
+    def add(self, key, data, mask=None, variance=None, level=None):
+        """
+        Add a frame to the set being combined. Its arrays are copied.
+
+        Parameters
+        ----------
+        key: str
+            identifier of the frame
+        data: ndarray
+            pixel data
+        mask: ndarray/None
+            DQ of the frame
+        variance: ndarray/None
+            variance of the frame
+        level: float/None
+            background level of the frame (needed to scale or offset it)
+        """
+        if key in self._slots:
+            raise ValueError("{} is already being combined".format(key))
+        if (self.scale or self.zero) and level is None:
+            raise ValueError("A level is needed to scale or offset "
+                             "{}".format(key))
+        data = np.asarray(data)
+        if self._shape is None:
+            self._allocate(data.shape, 4)
+        elif data.shape != self._shape:
+            raise ValueError("Frame has shape {} but the stack is {}"
+                             .format(data.shape, self._shape))
+        if not self._free:
+            self._allocate(self._shape, 2 * self._data.shape[0])
+        slot = self._free.pop()
+        # As NDStacker, which coerces all data to 32-bit floats
+        self._data[slot] = data
+        self._mask[slot] = (mask if self.use_mask and mask is not None
+                            else 0)
+        if variance is None:
+            self._variance[slot] = 0
+            self._novar.add(key)
+        else:
+            self._variance[slot] = variance
+        self._levels[slot] = 0 if level is None else level
+        self._slots[key] = slot
+        self._update(slot, add=True)
+
+    def remove(self, key):
+        """Remove the frame with this key from the set being combined"""
+        self._update(self._slots[key], add=False)
+        slot = self._slots.pop(key)
+        self._novar.discard(key)
+        self._free.append(slot)
+        self._removed += 1
+
+    def result(self):
+        """
+        Combine the current set of frames.
+
+        Returns
+        -------
+        NDAstroData: the combined data, mask, and variance
+        """
+        num_img = len(self._slots)
+        if num_img == 0:
+            raise ValueError("There are no frames to combine")
+        ngood = self._ngood
+        if self.reject == 'minmax':
+            if self.nlow + self.nhigh >= num_img:
+                raise ValueError("Only {} images but nlow={} and nhigh={}"
+                                 .format(num_img, self.nlow, self.nhigh))
+            # IRAF imcombine maths, as NDStacker.minmax()
+            nclean = self._nclean
+            nlo = (nclean * float(self.nlow) / num_img + 0.001).astype(int)
+            nhi = nclean - (nclean * float(self.nhigh) / num_img +
+                            0.001).astype(int) - 1
+            last = np.minimum(nhi, ngood - 1)
+        else:
+            nlo = np.zeros(self._shape, dtype=int)
+            last = ngood - 1
+        nkept = last - nlo + 1
+        fallback = (nkept < 1) | (self._nunusable > 0)
+        if self._novar:
+            fallback[:] = True
+        nkept = np.maximum(nkept, 1)
+
+        # The scale factors and offsets of the frames, calculated in single
+        # precision like stackFrames() does
+        ref_level = self._levels[self._slots[self.frames[0]]]
+        factors = np.ones_like(self._levels)
+        offsets = np.zeros_like(self._levels)
+        if self.scale:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                factors = ref_level / self._levels
+            in_use = factors[list(self._slots.values())]
+            if np.any(in_use < 0) or not np.all(np.isfinite(in_use)):
+                self._stacker._logmsg("Some scale factors are negative, "
+                                      "infinite, or undefined. Not scaling.",
+                                      level='warning')
+                factors = np.ones_like(self._levels)
+                fallback[:] = True
+        elif self.zero:
+            offsets = ref_level - self._levels
+
+        if self._use_sums:
+            if self._removed >= num_img:
+                self._resum()
+            sums = [s.copy() for s in self._sums]
+            if self.reject == 'minmax':
+                self._subtract_terms(sums, nlo, last, ngood)
+            # Pixels left to NDStacker may produce warnings here
+            with np.errstate(divide='ignore', invalid='ignore'):
+                if self.combine == 'mean':
+                    out_data = sums[0] / nkept
+                    out_var = sums[1] / (nkept * nkept)
+                else:
+                    out_data = sums[0] / sums[1]
+                    out_var = 1.0 / sums[1]
+            if self.scale:
+                out_data *= ref_level
+                out_var *= float(ref_level) ** 2
+            elif self.zero:
+                out_data += ref_level
+            out_mask = np.zeros(self._shape, dtype=DQ.datatype)
+            for bit, count in self._nflags.items():
+                out_mask[count > 0] |= bit
+        else:
+            first = np.clip(nlo + (nkept - 1) // 2, 0, num_img - 1)
+            out_data, out_mask, out_var = self._scaled_values(
+                self._slot_at(first), factors, offsets)
+            if self.combine == 'median':
+                # The mean of the middle two (as float32, like NDStacker)
+                second = np.clip(nlo + nkept // 2, 0, num_img - 1)
+                data2, mask2, var2 = self._scaled_values(
+                    self._slot_at(second), factors, offsets)
+                out_data = (out_data + data2) / 2
+                out_mask |= mask2
+                out_var = (out_var + var2) / 2
+
+        if fallback.any():
+            self._stack_pixels(np.nonzero(fallback), factors, offsets,
+                               out_data, out_mask, out_var)
+
+        ret_value = NDAstroData(out_data.astype(np.float32),
+                                mask=out_mask if self.use_mask else None)
+        ret_value.variance = out_var.astype(np.float32)
+        return ret_value
+
+    def _allocate(self, shape, num_slots):
+        # Make room for num_slots frames, keeping the existing ones
+        self._shape = tuple(shape)
+        arrays = {'_data': np.float32, '_mask': DQ.datatype,
+                  '_variance': np.float32}
+        if self._use_sorted:
+            arrays.update({'_keys': np.float32, '_rank': np.int16})
+        old_slots = 0
+        for name, dtype in arrays.items():
+            new = np.zeros((num_slots,) + self._shape, dtype=dtype)
+            old = getattr(self, name, None)
+            if old is not None:
+                old_slots = old.shape[0]
+                new[:old_slots] = old
+            setattr(self, name, new)
+        levels = np.zeros((num_slots,), dtype=np.float32)
+        if old_slots == 0:
+            self._ngood = np.zeros(self._shape, dtype=int)
+            self._nclean = np.zeros(self._shape, dtype=int)
+            self._nunusable = np.zeros(self._shape, dtype=int)
+            self._nflags = {bit: np.zeros(self._shape, dtype=int)
+                            for bit in (DQ.non_linear, DQ.saturated)}
+            self._sums = [np.zeros(self._shape) for i in range(2)
+                          if self._use_sums]
+        else:
+            levels[:old_slots] = self._levels
+        self._levels = levels
+        self._free.extend(range(num_slots - 1, old_slots - 1, -1))
+
+    def _normalized(self, data, variance, level):
+        # The frame's data and variance, in units of its level
+        data, variance = data.astype(np.float64), variance.astype(np.float64)
+        if self.scale:
+            level = np.float64(level)
+            return data / level, variance / (level * level)
+        elif self.zero:
+            return data - level, variance
+        return data, variance
+
+    def _terms(self, data, variance, level):
+        # The normalized quantities summed by the combiner
+        data, variance = self._normalized(data, variance, level)
+        if self.combine == 'mean':
+            return [data, variance]
+        return [data / variance, 1.0 / variance]
+
+    def _update(self, slot, add):
+        # Add a frame's pixels to the running sums and sorted buffer, or
+        # remove them
+        op = np.add if add else np.subtract
+        mask = self._mask[slot]
+        good = (mask & BAD) == 0
+        normalized, usable = self._usable(slot)
+        op(self._ngood, good, out=self._ngood)
+        op(self._nclean, mask == 0, out=self._nclean)
+        op(self._nunusable, good & ~usable, out=self._nunusable)
+        for bit, count in self._nflags.items():
+            op(count, (mask & bit) > 0, out=count)
+        self._sum_terms(slot, op, good & usable)
+        if not self._use_sorted:
+            return
+
+        # Rather than moving the pixels around in a sorted buffer, each frame
+        # has the rank of each of its pixels in the sorted stack, so only
+        # the ranks of the pixels above it change
+        others = [other for other in self._slots.values() if other != slot]
+        rank = self._rank[slot]
+        if add:
+            # Bad pixels go to the top, and new pixels above equal ones
+            key = self._keys[slot]
+            key[:] = np.where(good & usable, normalized, np.inf)
+            rank[:] = 0
+            for other in others:
+                above = self._keys[other] > key
+                rank += ~above
+                self._rank[other] += above
+        else:
+            for other in others:
+                self._rank[other] -= self._rank[other] > rank
+
+    def _usable(self, slot):
+        # A frame's normalized data, and which of its pixels can be combined
+        variance = self._variance[slot]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            normalized, _ = self._normalized(self._data[slot], variance,
+                                             self._levels[slot])
+            usable = np.isfinite(normalized) & np.isfinite(variance)
+        if self.combine == 'wtmean':
+            usable &= variance != 0
+        return normalized, usable
+
+    def _sum_terms(self, slot, op, included):
+        # Add a frame's terms to the running sums, or subtract them
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for total, term in zip(self._sums, self._terms(
+                    self._data[slot], self._variance[slot],
+                    self._levels[slot])):
+                op(total, np.where(included, term, 0), out=total)
+
+    def _resum(self):
+        # Compute the sums again from the frames being combined, without
+        # the rounding errors of all the additions and subtractions
+        for total in self._sums:
+            total[:] = 0
+        for slot in self._slots.values():
+            good = (self._mask[slot] & BAD) == 0
+            self._sum_terms(slot, np.add, good & self._usable(slot)[1])
+        self._removed = 0
+
+    def _slot_at(self, pos):
+        # Frame providing each pixel's pos-th lowest value
+        slots = np.zeros(self._shape, dtype=np.intp)
+        for slot in self._slots.values():
+            slots += (self._rank[slot] == pos) * slot
+        return slots
+
+    @staticmethod
+    def _take(arrays, slots):
+        return np.take_along_axis(arrays, slots[np.newaxis], axis=0)[0]
+
+    def _scaled_values(self, slots, factors, offsets):
+        # The data, mask, and variance of each pixel from the given frames,
+        # scaled and offset exactly as NDStacker does
+        data = self._take(self._data, slots) * factors[slots]
+        data += offsets[slots]
+        variance = self._take(self._variance, slots) * factors[slots]
+        variance *= factors[slots]
+        return data, self._take(self._mask, slots), variance
+
+    def _subtract_terms(self, sums, nlo, last, ngood):
+        # Remove the pixels rejected by minmax from the sums
+        for slot in self._slots.values():
+            rank = self._rank[slot]
+            rejected = (rank < nlo) | ((rank > last) & (rank < ngood))
+            with np.errstate(divide='ignore', invalid='ignore'):
+                terms = self._terms(self._data[slot], self._variance[slot],
+                                    self._levels[slot])
+                for total, term in zip(sums, terms):
+                    total -= np.where(rejected, term, 0)
+
+    def _stack_pixels(self, pixels, factors, offsets, out_data, out_mask,
+                      out_var):
+        # Stack some pixels with NDStacker, from copies of their inputs
+        slots = np.array([self._slots[key] for key in self.frames])
+        index = (slots.reshape((-1,) + (1,) * len(pixels)),) + pixels
+        column = (slice(None),) + (np.newaxis,) * len(pixels)
+        scale, zero = factors[slots][column], offsets[slots][column]
+        data = self._data[index] * scale
+        data += zero
+        mask = self._mask[index] if self.use_mask else None
+        if self._novar:
+            variance = None
+        else:
+            variance = self._variance[index] * scale
+            variance *= scale
+        stacker = self._stacker
+        rej_args = {arg: stacker._dict[arg]
+                    for arg in stacker._rejector.required_args
+                    if arg in stacker._dict}
+        data, mask, variance = stacker._rejector(data, mask, variance,
+                                                 **rej_args)
+        data, mask, variance = stacker._combiner(data, mask, variance)
+        # Through NDAstroData, which converts them as for NDStacker
+        result = NDAstroData(data, mask=mask)
+        result.variance = variance
+        out_data[pixels] = result.data
+        out_var[pixels] = result.variance
+        if self.use_mask:
+            out_mask[pixels] = result.mask
@@ -0,0 +1,267 @@
+# pytest suite
+
+"""
+Tests for the nddops module.
+
+This is a suite of tests to be run with pytest.
+
+To run:
+   1) py.test -v   (must in gemini_python or have it in PYTHONPATH)
+"""
+
+import numpy as np
+import pytest
+from astropy.nddata import VarianceUncertainty
+
+from astrodata import NDAstroData
+from astrodata.fits import windowedOp
+from astrodata.nddata import NDPlacedAstroData
+from gempy.library.nddops import NDStacker, IncrementalStacker
+
+COMBINERS = ('mean', 'wtmean', 'median', 'lmedian')
+
+
+def make_stack(num_img, shape=(50, 40), seed=0):
+    rng = np.random.RandomState(seed)
+    data = rng.normal(100., 10., (num_img,) + shape).astype(np.float32)
+    variance = rng.uniform(50., 150., data.shape).astype(np.float32)
+    mask = np.zeros(data.shape, dtype=np.uint16)
+    mask[rng.rand(*data.shape) > 0.9] = 1
+    mask[rng.rand(*data.shape) > 0.95] = 4  # saturated
+    mask[:, 3, 5] = 1  # all inputs bad
+    return data, mask, variance
+
+
+def assert_same(result1, result2):
+    for arr1, arr2 in zip(result1, result2):
+        if arr1 is None or arr2 is None:
+            assert arr1 is None and arr2 is None
+        else:
+            np.testing.assert_array_equal(np.asarray(arr1), np.asarray(arr2))
+
+
+@pytest.mark.parametrize("num_img", [1, 2, 7, 10])
+@pytest.mark.parametrize("combine", COMBINERS)
+def test_fast_combiners_identical(combine, num_img):
+    data, mask, variance = make_stack(num_img)
+    slow = getattr(NDStacker, combine)
+    fast = getattr(NDStacker, 'fast' + combine)
+    for m in (None, mask):
+        for v in (None, variance):
+            assert_same(slow(data, None if m is None else m.copy(), v),
+                        fast(data, None if m is None else m.copy(), v))
+
+
+def test_fast_combiners_through_stacker():
+    data, mask, variance = make_stack(8)
+    ndds = [NDAstroData(d, mask=m, uncertainty=VarianceUncertainty(v))
+            for d, m, v in zip(data, mask, variance)]
+    for combine in COMBINERS:
+        result1 = NDStacker(combine=combine, reject='sigclip')(ndds)
+        result2 = NDStacker(combine='fast' + combine, reject='sigclip')(ndds)
+        assert_same((result1.data, result1.mask, result1.variance),
+                    (result2.data, result2.mask, result2.variance))
+
+
+@pytest.mark.parametrize("reject", ['sigclip', 'varclip'])
+def test_clipping_threads(reject):
+    data, mask, variance = make_stack(30)
+    data[::7, ::3, ::5] += 500.
+    result1 = getattr(NDStacker, reject)(data, mask.copy(), variance)
+    result2 = getattr(NDStacker, reject)(data, mask.copy(), variance,
+                                         num_threads=3)
+    assert_same(result1, result2)
+    assert (result1[1] & 1).sum() > (mask & 1).sum()
+
+
+def test_clipping_deep_stack():
+    # There used to be a limit of 10000 images
+    data, mask, variance = make_stack(12000, shape=(5, 6))
+    data[5000] += 1000.
+    _, out_mask, _ = NDStacker.sigclip(data, mask.copy(), variance)
+    assert np.all(out_mask[5000] & 1)
+
+
+def test_stack_placed_inputs():
+    # Stacking images placed in a larger frame gives the same result as
+    # stacking copies padded to the full frame
+    data, mask, variance = make_stack(5, shape=(30, 40))
+    origins = [(0, 5), (3, 0), (10, 12), (-2, 8), (6, 7)]
+    shape = (40, 52)
+    padded, placed = [], []
+    for d, m, v, (y, x) in zip(data, mask, variance, origins):
+        ndd = NDAstroData(d, mask=m, meta={'header': {}})
+        ndd.variance = v
+        placed.append(NDPlacedAstroData(ndd, (y, x), shape, mask_fill=16))
+        arrays = [np.zeros(shape, dtype=np.float32),
+                  np.full(shape, 16, dtype=np.uint16),
+                  np.zeros(shape, dtype=np.float32)]
+        for arr, plane in zip(arrays, (d, m, v)):
+            arr[max(y, 0):y+30, x:x+40] = plane[max(-y, 0):]
+        ndd = NDAstroData(arrays[0], mask=arrays[1], meta={'header': {}})
+        ndd.variance = arrays[2]
+        padded.append(ndd)
+    results = [windowedOp(NDStacker(combine='mean', reject='sigclip'), inputs,
+                          kernel=(7, 52), dtype=np.float32,
+                          with_uncertainty=True, with_mask=True)
+               for inputs in (padded, placed)]
+    assert_same(*[(r.data, r.mask, r.variance) for r in results])
+    assert np.all(results[1].mask[-1, :5] & 16)
+
+
+def test_placed_target_window():
+    # The sections of the frame are clipped to the target's own pixels
+    data = np.arange(1200, dtype=np.float32).reshape(30, 40)
+    placed = NDPlacedAstroData(NDAstroData(data), (10, -5), (50, 50))
+    np.testing.assert_array_equal(placed.target_window().data, data[:, 5:])
+    window = placed.target_window((slice(0, 15), slice(30, 50)))
+    np.testing.assert_array_equal(window.data, data[:5, 35:])
+    assert window.mask is None
+    assert placed.target_window((slice(40, 50), slice(None))) is None
+
+
+@pytest.mark.parametrize("reject", ['none', 'minmax'])
+@pytest.mark.parametrize("combine", COMBINERS)
+def test_incremental_stacker(combine, reject):
+    # Sliding a window along a sequence of frames gives the same results
+    # as stacking each set from scratch
+    data, mask, variance = make_stack(12)
+    data[4, 10, 10] = np.nan
+    levels = np.random.RandomState(1).uniform(80., 120., 12).astype(np.float32)
+    ndds = [NDAstroData(d, mask=m) for d, m in zip(data, mask)]
+    for ndd, v in zip(ndds, variance):
+        ndd.variance = v
+    kwargs = {'nlow': 1, 'nhigh': 1} if reject == 'minmax' else {}
+    for scale, zero in ((False, False), (True, False), (False, True)):
+        stacker = IncrementalStacker(combine=combine, reject=reject,
+                                     scale=scale, zero=zero, **kwargs)
+        for start in range(0, 7):
+            window = range(start, start + 5 + start % 2)
+            for key in stacker.frames:
+                if int(key) not in window:
+                    stacker.remove(key)
+            for i in window:
+                if '{:02d}'.format(i) not in stacker.frames:
+                    stacker.add('{:02d}'.format(i), ndds[i].data,
+                                ndds[i].mask, ndds[i].variance,
+                                level=levels[i])
+            result1 = stacker.result()
+
+            window_levels = levels[list(window)]
+            result2 = NDStacker(combine=combine, reject=reject, **kwargs)(
+                [ndds[i] for i in window],
+                scale=window_levels[0] / window_levels if scale else None,
+                zero=window_levels[0] - window_levels if zero else None)
+            np.testing.assert_array_equal(result1.mask, result2.mask)
+            if 'median' in combine:
+                assert_same((result1.data, result1.variance),
+                            (result2.data, result2.variance))
+            else:
+                np.testing.assert_allclose(result1.data, result2.data,
+                                           rtol=1e-6)
+                np.testing.assert_allclose(result1.variance,
+                                           result2.variance, rtol=1e-6)
+
+
+@pytest.mark.parametrize("combine,reject", [('mean', 'none'),
+                                            ('wtmean', 'minmax'),
+                                            ('median', 'none')])
+def test_incremental_stacker_state(combine, reject):
+    data, mask, variance = make_stack(30, shape=(20, 30))
+    stacker = IncrementalStacker(combine=combine, reject=reject, zero=True)
+    levels = np.random.RandomState(2).uniform(1e4, 2e4, 30)
+    resums = 0
+    for start in range(26):
+        if start > 0:
+            stacker.remove('{:02d}'.format(start - 1))
+        for i in range(start, start + 5):
+            if '{:02d}'.format(i) not in stacker.frames:
+                stacker.add('{:02d}'.format(i), data[i], mask[i],
+                            variance[i], level=levels[i])
+        stacker.result()
+        if combine != 'median' and start > 0 and stacker._removed == 0:
+            # The sums were computed again, as if the frames had just been
+            # added, so the additions and removals leave no rounding errors
+            fresh = IncrementalStacker(combine=combine, reject=reject,
+                                       zero=True)
+            for i in range(start, start + 5):
+                fresh.add('{:02d}'.format(i), data[i], mask[i],
+                          variance[i], level=levels[i])
+            for total, fresh_total in zip(stacker._sums, fresh._sums):
+                np.testing.assert_array_equal(total, fresh_total)
+            resums += 1
+    assert resums == (0 if combine == 'median' else 5)
+
+    # The estimate of the memory used is what is allocated
+    allocated = sum(getattr(stacker, name).nbytes for name in
+                    ('_data', '_mask', '_variance', '_keys', '_rank',
+                     '_ngood', '_nclean', '_nunusable')
+                    if hasattr(stacker, name))
+    allocated += sum(count.nbytes for count in stacker._nflags.values())
+    allocated += sum(total.nbytes for total in stacker._sums)
+    assert stacker.memory_needed((20, 30), 5) == allocated
+
+
+def test_stack_lazy_inputs(tmpdir):
+    # Windows of files read into the stack directly give the same result
+    # as the loaded data, also when scaling
+    import astrodata
+    from astropy.io import fits
+    data, mask, variance = make_stack(4, shape=(60, 50))
+    files, loaded = [], []
+    for i, (d, m, v) in enumerate(zip(data, mask, variance)):
+        filename = str(tmpdir.join('lazy{}.fits'.format(i)))
+        fits.HDUList([fits.PrimaryHDU(), fits.ImageHDU(d, name='SCI', ver=1),
+                      fits.ImageHDU(m, name='DQ', ver=1),
+                      fits.ImageHDU(v, name='VAR', ver=1)]).writeto(filename)
+        files.append(astrodata.open(filename)[0].nddata)
+        assert files[-1]._mask is not None and files[-1]._uncertainty is not None
+        ndd = NDAstroData(d, mask=m)
+        ndd.variance = v
+        loaded.append(ndd)
+    scale = np.array([1., 1.1, 0.9, 1.05], dtype=np.float32)
+    zero = np.array([0., 2., -3., 1.], dtype=np.float32)
+    for kwargs in ({}, {'scale': scale, 'zero': zero}):
+        stacker = NDStacker(combine='mean', reject='sigclip')
+        results = [windowedOp(lambda windows: stacker(windows, **kwargs),
+                              inputs, kernel=(20, 50), dtype=np.float32,
+                              with_uncertainty=True, with_mask=True)
+                   for inputs in (loaded, files)]
+        assert_same(*[(r.data, r.mask, r.variance) for r in results])
+
+
+def test_stack_lazy_inputs_read_once(tmpdir, monkeypatch):
+    # Double precision frames are read from the file once, whether they
+    # are scaled (in double precision) or not
+    import astrodata
+    from astrodata.fits import FitsLazyLoadable
+    from astropy.io import fits
+    rng = np.random.RandomState(3)
+    frames, files = [], []
+    for i in range(3):
+        frame = rng.normal(1000., 30., (40, 30))
+        filename = str(tmpdir.join('double{}.fits'.format(i)))
+        fits.HDUList([fits.PrimaryHDU(),
+                      fits.ImageHDU(frame, name='SCI', ver=1)]).writeto(filename)
+        frames.append(frame)
+        files.append(astrodata.open(filename)[0].nddata)
+
+    reads = []
+    real_read = FitsLazyLoadable.read
+    def counting_read(self, *args, **kwargs):
+        reads.append(self)
+        return real_read(self, *args, **kwargs)
+    monkeypatch.setattr(FitsLazyLoadable, 'read', counting_read)
+
+    scale = np.array([1., 1.1, 0.9])
+    for kwargs in ({}, {'scale': scale, 'zero': [0., 2., -3.]}):
+        del reads[:]
+        result = NDStacker(combine='mean', reject='none')(files, **kwargs)
+        assert len(reads) == len(files)
+        assert all(ndd.plane_dtype('data') == np.float64 for ndd in files)
+        factors = kwargs.get('scale', np.ones(3))
+        offsets = kwargs.get('zero', np.zeros(3))
+        expected = np.mean([(f * s + z).astype(np.float32) for f, s, z
+                            in zip(frames, factors, offsets)], axis=0)
+        np.testing.assert_allclose(result.data, expected, rtol=1e-6)
+
@@ -0,0 +1,97 @@
+# pytest suite
+
+"""
+Tests for the transform module.
+
+This is a suite of tests to be run with pytest.
+
+To run:
+   1) py.test -v   (must in gemini_python or have it in PYTHONPATH)
+"""
+
+import numpy as np
+import pytest
+from scipy import ndimage
+
+from gempy.library import transform
+
+NO_DATA = 16
+
+
+def make_mask(shape, bits=(0, 1, 2, 3, 5), seed=0):
+    rng = np.random.RandomState(seed)
+    mask = np.zeros(shape, dtype=np.uint16)
+    for bit in bits:
+        mask[rng.rand(*shape) > rng.uniform(0.5, 0.99)] |= np.uint16(2**bit)
+    return mask
+
+
+def random_transforms(num, seed=0):
+    rng = np.random.RandomState(seed)
+    for i in range(num):
+        kind = i % 4
+        if kind == 0:  # rotation, magnification and shift
+            angle, mag = rng.uniform(0, 2 * np.pi), rng.uniform(0.8, 1.2)
+            matrix = mag * np.array([[np.cos(angle), -np.sin(angle)],
+                                     [np.sin(angle), np.cos(angle)]])
+            offset = rng.uniform(-10, 10, 2)
+        elif kind == 1:  # integer and half-pixel shifts
+            matrix = np.eye(2)
+            offset = rng.randint(-5, 5, 2) + rng.choice([0, 0.25, 0.5], 2)
+        elif kind == 2:  # multiples of 90 degrees
+            angle = 0.5 * np.pi * rng.randint(4)
+            matrix = np.array([[np.cos(angle), -np.sin(angle)],
+                               [np.sin(angle), np.cos(angle)]])
+            offset = rng.randint(-5, 30, 2).astype(float)
+        else:
+            matrix = rng.uniform(-1.5, 1.5, (2, 2))
+            offset = rng.uniform(-10, 10, 2)
+        yield matrix, offset, tuple(rng.randint(5, 45, 2))
+
+
+@pytest.mark.parametrize("order", [0, 1])
+def test_transform_mask_identical(order):
+    for i, (matrix, offset, out_shape) in enumerate(random_transforms(200)):
+        mask = make_mask((20 + i % 7, 30 - i % 5), seed=i)
+        kwargs = {'matrix': matrix, 'offset': offset, 'order': order,
+                  'output_shape': out_shape, 'cval': NO_DATA}
+        np.testing.assert_array_equal(
+            transform.transform_mask(mask, **kwargs),
+            transform._transform_mask_bitwise(mask, coordinates=None, **kwargs))
+
+
+@pytest.mark.parametrize("order", [0, 1, 3])
+def test_transform_mask_coordinates(order):
+    mask = make_mask((40, 50))
+    y, x = np.mgrid[:45, :55]
+    coords = np.array([0.98 * y + 0.1 * x - 2.3, 1.01 * x - 0.05 * y + 1.7])
+    result = transform.transform_mask(mask, coordinates=coords, order=order,
+                                      cval=NO_DATA)
+    assert result.shape == (45, 55)
+    np.testing.assert_array_equal(result, transform._transform_mask_bitwise(
+        mask, None, None, coords, order, (45, 55), NO_DATA))
+    assert np.all(result[0, :20] & NO_DATA)
+
+
+@pytest.mark.parametrize("order", [0, 1, 3])
+def test_transform_plan_identical(order):
+    rng = np.random.RandomState(1)
+    for i, (matrix, offset, out_shape) in enumerate(random_transforms(40)):
+        shape = (20 + i % 7, 30 - i % 5)
+        data = rng.normal(100., 10., shape).astype(np.float32)
+        data[rng.rand(*shape) > 0.95] = np.nan
+        data[-2, rng.randint(shape[1])] = np.inf
+        variance = rng.uniform(50., 150., shape)
+        mask = make_mask(shape, seed=i)
+        plan = transform.TransformPlan(shape, out_shape, order=order,
+                                       matrix=matrix, offset=offset)
+        (new_data, new_var, none), (new_mask,) = plan.apply(
+            [data, variance, None], [mask], cval=0., mask_cval=NO_DATA)
+        assert none is None
+        assert new_data.dtype == np.float32 and new_var.dtype == np.float64
+        for arr, new_arr in ((data, new_data), (variance, new_var)):
+            np.testing.assert_array_equal(new_arr, ndimage.affine_transform(
+                arr, matrix, offset, output_shape=out_shape, order=order))
+        np.testing.assert_array_equal(new_mask, transform.transform_mask(
+            mask, matrix, offset, order=order, output_shape=out_shape,
+            cval=NO_DATA))
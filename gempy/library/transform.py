@@ -0,0 +1,289 @@
+"""
+The transform module contains functions to resample images onto a new
+pixel grid, including data quality masks, whose bits have to be transformed
+independently of each other.
+"""
+import numpy as np
+from scipy import ndimage
+
+# A pixel is flagged if it had more than 1% influence from a flagged pixel.
+# ndimage returns the transformed bit planes as float32, so the comparison
+# with this threshold used to be done in single precision. The midpoint
+# between 0.01 and the next float32 rounds down to 0.01 (which has an even
+# mantissa) so "float32(value) > 0.01" is the same as "value > THRESHOLD".
+_FLAG_LEVEL = np.float32(0.01)
+THRESHOLD = 0.5 * (np.float64(_FLAG_LEVEL) +
+                   np.float64(np.nextafter(_FLAG_LEVEL, np.float32(1))))
+
+# Subsets of the 4 points of the bilinear stencil (in the order ndimage sums
+# them), each built from a smaller subset (or None) and one more point
+_SUBSETS = [((0,), None, 0), ((1,), None, 1), ((2,), None, 2), ((3,), None, 3),
+            ((0, 1), (0,), 1), ((0, 2), (0,), 2), ((0, 3), (0,), 3),
+            ((1, 2), (1,), 2), ((1, 3), (1,), 3), ((2, 3), (2,), 3),
+            ((0, 1, 2), (0, 1), 2), ((0, 1, 3), (0, 1), 3),
+            ((0, 2, 3), (0, 2), 3), ((1, 2, 3), (1, 2), 3),
+            ((0, 1, 2, 3), (0, 1, 2), 3)]
+
+# Number of output pixels to process at a time (keeps temporaries in cache)
+_BLOCK_SIZE = 32768
+
+
+class TransformPlan(object):
+    """
+    Resamples any number of arrays defined on the same pixel grid (e.g.,
+    the SCI, VAR and DQ planes of an extension) onto an output grid with
+    ndimage's mode='constant' conventions, either via an affine
+    transformation (as ndimage.affine_transform) or explicit input
+    coordinates for each output pixel (as ndimage.map_coordinates).
+
+    For nearest-neighbour and linear interpolation, the input coordinates
+    and interpolation weights are calculated once per block of output pixels
+    and used for all the arrays, with results identical to ndimage's.
+    Higher-order splines need every array to be prefiltered, so they are
+    handed to ndimage one array at a time.
+    """
+    def __init__(self, input_shape, output_shape=None, order=1, matrix=None,
+                 offset=0.0, coordinates=None, origin=None):
+        """
+        Parameters
+        ----------
+        input_shape: tuple
+            shape of the arrays to be transformed
+        output_shape: tuple/None
+            shape of output (default: same as input)
+        order: int
+            spline interpolation order
+        matrix: ndarray/None
+            2x2 transformation matrix (as for ndimage.affine_transform)
+        offset: float/sequence
+            offset into the input array (as for ndimage.affine_transform)
+        coordinates: ndarray/None
+            input coordinates of each output pixel, shape (2,)+output_shape
+            (as for ndimage.map_coordinates). If given, matrix and offset are
+            ignored
+        origin: tuple/None
+            position of the first output pixel in the frame where matrix and
+            offset are defined, to produce only part of a larger output
+        """
+        self.input_shape = tuple(input_shape)
+        self.order = order
+        if coordinates is not None:
+            self.coordinates = np.asarray(coordinates, dtype=np.float64)
+            self.output_shape = self.coordinates.shape[1:]
+            self.matrix = self.offset = self.origin = None
+        else:
+            self.coordinates = None
+            self.matrix = np.asarray(matrix, dtype=np.float64)
+            self.offset = np.broadcast_to(np.asarray(offset, dtype=np.float64),
+                                          (len(self.input_shape),))
+            self.output_shape = tuple(output_shape or self.input_shape)
+            self.origin = (np.zeros_like(self.offset) if origin is None
+                           else np.asarray(origin, dtype=np.float64))
+        self.stencil = (order <= 1 and len(self.input_shape) == 2 and
+                        len(self.output_shape) == 2 and
+                        (self.coordinates is not None or
+                         self.matrix.shape == (2, 2)))
+
+    def apply(self, arrays=(), masks=(), cval=0., mask_cval=0):
+        """
+        Transform arrays of data and bitmasks. A bit is set in an output
+        pixel if it had more than 1% influence from input pixels with that
+        bit set, i.e., as if each bit had been transformed separately.
+
+        Parameters
+        ----------
+        arrays: sequence of ndarrays/None
+            data arrays to be interpolated
+        masks: sequence of ndarrays/None
+            bitmasks to be transformed
+        cval: float
+            value for output data pixels that fall outside the input
+        mask_cval: int
+            bits to set in output mask pixels that fall outside the input
+
+        Returns
+        -------
+        2-tuple of lists: transformed arrays and masks (None where the input
+        was None)
+        """
+        if not self.stencil:
+            return ([None if arr is None else self._ndimage_transform(arr, cval)
+                     for arr in arrays],
+                    [None if mask is None else
+                     _transform_mask_bitwise(np.asarray(mask), self.matrix,
+                         self._shifted_offset(), self.coordinates, self.order,
+                         self.output_shape, mask_cval)
+                     for mask in masks])
+
+        ny, nx = self.input_shape
+        stride = nx + 1
+        # Pad by one row and column so the whole stencil is always in the
+        # array. The extra points only ever get zero weight but, like
+        # ndimage, they are mirrored so 0*inf or 0*nan propagates the same
+        inputs, outputs = [], []
+        for arr, is_mask in ([(arr, False) for arr in arrays] +
+                             [(mask, True) for mask in masks]):
+            if arr is None:
+                outputs.append(None)
+                continue
+            arr = np.asarray(arr)
+            if not (is_mask or arr.dtype.kind == 'f'):
+                outputs.append(self._ndimage_transform(arr, cval))
+                continue
+            if arr.shape != self.input_shape:
+                raise ValueError("Array has shape {} but the transformation "
+                                 "is for {}".format(arr.shape,
+                                                    self.input_shape))
+            padded = np.pad(arr, ((0, 1), (0, 1)), mode='reflect').ravel()
+            outputs.append(np.empty(self.output_shape, dtype=arr.dtype))
+            inputs.append((padded, outputs[-1], is_mask))
+
+        block_rows = max(_BLOCK_SIZE // max(self.output_shape[1], 1), 1)
+        for y1 in range(0, self.output_shape[0], block_rows):
+            y2 = min(y1 + block_rows, self.output_shape[0])
+            if self.coordinates is None:
+                ycoord, xcoord = _affine_coordinates(self.matrix, self.offset,
+                                                     y1, y2,
+                                                     self.output_shape[1],
+                                                     self.origin)
+            else:
+                ycoord, xcoord = self.coordinates[:, y1:y2]
+            outside = ((ycoord < 0) | (ycoord > ny - 1) |
+                       (xcoord < 0) | (xcoord > nx - 1))
+            if self.order == 0:
+                iy, ix = np.floor(ycoord + 0.5), np.floor(xcoord + 0.5)
+            else:
+                iy, ix = np.floor(ycoord), np.floor(xcoord)
+                # ndimage's weights are 1-t and 1-(1-t), not t
+                wy, wx = 1.0 - (ycoord - iy), 1.0 - (xcoord - ix)
+                dy, dx = 1.0 - wy, 1.0 - wx
+                factors = [(wy, wx), (wy, dx), (dy, wx), (dy, dx)]
+            iy[outside] = 0
+            ix[outside] = 0
+            index = iy.astype(np.intp) * stride + ix.astype(np.intp)
+            if self.order == 1:
+                index = [index, index + 1, index + stride, index + stride + 1]
+
+            for padded, output, is_mask in inputs:
+                out_block = output[y1:y2]
+                if self.order == 0:
+                    out_block[:] = padded[index]
+                elif is_mask:
+                    _bilinear_flags([padded[i] for i in index],
+                                    [fy * fx for fy, fx in factors], out_block)
+                else:
+                    # Multiply and sum in the same order as ndimage
+                    result = 0.
+                    for i, (fy, fx) in zip(index, factors):
+                        result = result + padded[i] * fy * fx
+                    out_block[:] = result
+                out_block[outside] = mask_cval if is_mask else cval
+
+        return outputs[:len(arrays)], outputs[len(arrays):]
+
+    def _ndimage_transform(self, arr, cval):
+        if self.coordinates is None:
+            return ndimage.affine_transform(arr, self.matrix,
+                                            self._shifted_offset(),
+                                            output_shape=self.output_shape,
+                                            order=self.order, cval=cval)
+        return ndimage.map_coordinates(arr, self.coordinates, order=self.order,
+                                       cval=cval)
+
+    def _shifted_offset(self):
+        # The offset for ndimage to produce output starting at the origin
+        if self.matrix is None:
+            return None
+        if self.matrix.ndim == 1:
+            return self.offset + self.matrix * self.origin
+        return self.offset + np.dot(self.matrix, self.origin)
+
+
+def transform_mask(mask, matrix=None, offset=0.0, coordinates=None, order=1,
+                   output_shape=None, cval=0):
+    """
+    Transform a bitmask, such as a DQ plane, as if each bit were transformed
+    separately by ndimage.affine_transform() (or map_coordinates(), if
+    coordinates are given) with mode='constant', and an output pixel were
+    flagged with a bit if it had more than 1% influence from input pixels
+    with that bit set. See TransformPlan for details.
+
+    Parameters
+    ----------
+    mask: ndarray
+        2D integer array of flags to transform
+    matrix: ndarray/None
+        2x2 transformation matrix (as for ndimage.affine_transform)
+    offset: float/sequence
+        offset into the input array (as for ndimage.affine_transform)
+    coordinates: ndarray/None
+        input coordinates of each output pixel, shape (2,)+output_shape
+        (as for ndimage.map_coordinates). If given, matrix/offset are ignored
+    order: int
+        spline interpolation order
+    output_shape: tuple/None
+        shape of output (default: same as input)
+    cval: int
+        bits to set in output pixels that fall outside the input
+
+    Returns
+    -------
+    ndarray: transformed mask, of the same dtype as the input mask
+    """
+    mask = np.asarray(mask)
+    plan = TransformPlan(mask.shape, output_shape, order=order, matrix=matrix,
+                         offset=offset, coordinates=coordinates)
+    return plan.apply(masks=[mask], mask_cval=cval)[1][0]
+
+
+def _affine_coordinates(matrix, offset, y1, y2, nx, origin=(0, 0)):
+    """
+    Input coordinates of output rows y1 to y2, calculated in the same order
+    as ndimage so that they are identical to the last bit
+    """
+    y = np.arange(y1, y2, dtype=np.float64)[:, np.newaxis] + origin[0]
+    x = np.arange(nx, dtype=np.float64) + origin[1]
+    return [(offset[i] + matrix[i, 0] * y) + matrix[i, 1] * x
+            for i in range(2)]
+
+
+def _bilinear_flags(values, weights, out):
+    """
+    Linear interpolation of all the bits at once. A bit is flagged if the
+    summed weights of the stencil points with that bit exceed the threshold,
+    i.e., if any subset of stencil points whose weights exceed the threshold
+    all have that bit set.
+    """
+    out[:] = 0
+    sums, ands = {}, {}
+    for points, previous, last in _SUBSETS:
+        if previous is None:
+            sums[points], ands[points] = weights[last], values[last]
+        else:
+            sums[points] = sums[previous] + weights[last]
+            ands[points] = ands[previous] & values[last]
+        np.bitwise_or(out, ands[points], out=out,
+                      where=sums[points] > THRESHOLD)
+
+
+def _transform_mask_bitwise(mask, matrix, offset, coordinates, order,
+                            output_shape, cval):
+    """Transform the mask one bit at a time"""
+    trans_mask = np.zeros(output_shape, dtype=mask.dtype)
+    for j in range(0, mask.dtype.itemsize * 8):
+        bit = 2**j
+        # Only transform bits that have a pixel set. But we always want
+        # to do one transformation so we can pad the data with cval
+        if cval & bit or np.sum(mask & bit) > 0:
+            plane = (mask & bit).astype(np.float32)
+            bitval = bit if cval & bit else 0
+            if coordinates is None:
+                temp_mask = ndimage.affine_transform(plane, matrix, offset,
+                                output_shape=output_shape, order=order,
+                                cval=bitval)
+            else:
+                temp_mask = ndimage.map_coordinates(plane, coordinates,
+                                order=order, cval=bitval)
+            trans_mask += np.where(temp_mask > 0.01*bit, bit,
+                                   0).astype(mask.dtype)
+    return trans_mask
@@ -8,6 +8,8 @@ __version__ = '2.0.0 (beta)'
 import numpy as np
 import scipy.ndimage as nd
 
+from gempy.library.transform import transform_mask
+
 # ------------------------------------------------------------------------------
 DQMap = {'bad_pixel' : 1,
          'non_linear': 2,
@@ -482,60 +484,25 @@ class Transformation(object):
         if self.notransform:
             return data
 
-        # unpack the DQ data into separate masks
-        # NOTE: this method only works for 8-bit masks!
-        unp = data.shape + (8,)
-        unpack_data = np.unpackbits(np.uint8(data)).reshape(unp)
-
-        # transform each mask
-        outdata = np.zeros(data.shape)
-        do_nans = False
-        gnan = None
-        for j in range(0, 8):
-            # skip the transformation if there are no flags set
-            # (but always do the bad pixel mask because it is
-            # needed to mask the part of the array that was
-            # padded out to match the reference image)
-            if not unpack_data[:, :, j].any() and j != 7:
-                # first bit is j=7 because unpack is backwards
-                continue
-            mask = np.float32(unpack_data[:, :, j])
-
-            # if bad pix bit, pad with 1. Otherwise, pad with 0
-            if j == 7:
-                cval = 1
-            else:
-                # Instead of padding with zeros, we mark the
-                # no-data values with Nans
-                cval = np.nan
-                do_nans = True
- 
-            trans_mask = self.map_coordinates(mask, cval=cval)
-
-            # Get the nans indices:
-            if do_nans:
-                gnan = np.where(np.isnan(trans_mask))
-                # We mark only once
-                do_nans = False
-
-            # flag any pixels with >1% influence from bad pixel
-            trans_mask = np.where(np.abs(trans_mask) > 0.01, 2**(7-j), 0)
-            # add the flags into the overall mask
-            outdata += trans_mask
-            del trans_mask
-            trans_mask = None
-
-            # QUESTION: Do we need to put outdata[gnan] for each plane != 7 ?
-        # put nan's back
-        if gnan != None:
-            outdata[gnan] = np.nan
+        # Bad pixels pad the output, as does a bit that is never set in
+        # the input so we can find where the transformed data are missing
+        if not hasattr(self, 'xy_coords'):
+            self.map_coords_init(data.shape)
+        trans_mask = transform_mask(np.uint8(data).astype(np.uint16),
+                                    coordinates=self.xy_coords,
+                                    order=self.order, cval=257)
+        del self.xy_coords
+        outdata = (trans_mask & 255).astype(np.float64)
+        # Other flags mark the missing data with NaNs instead
+        if np.any(np.uint8(data) & 254):
+            outdata[trans_mask & 256 > 0] = np.nan
 
         return outdata
 
     def _transform_16bit(self, mask):
         """
-        Transform the DQ plane, bit by bit. Since np.unpackbits() only works
-        on uint8 data, we have to do this by hand.
+        Transform the DQ plane. All the bits are transformed together
+        by transform_mask().
 
         Parameters
         ----------
@@ -543,14 +510,11 @@ class Transformation(object):
         type: <ndarray>
 
         """
-        trans_mask = np.zeros(mask.shape, dtype=np.uint16)
-        for j in range(0, 16):
-            bit = 2**j
-            # Only transform bits that have a pixel set. But we always want
-            # to do one transformation so we can pad the data with DQ.no_data
-            if bit == DQMap['no_data'] or np.sum(mask & bit) > 0:
-                cval=DQMap['no_data'] if bit == DQMap['no_data'] else 0
-                temp_mask = self.affine_transform((mask & 2**j).astype(np.float32), cval=cval)
-                trans_mask += np.where(np.abs(temp_mask > 0.01*bit), bit, 0).astype(np.uint16)
-
-        return trans_mask
+        if self.notransform:
+            return mask.copy()
+
+        if not hasattr(self, 'offset'):
+            self.affine_init(mask.shape)
+
+        return transform_mask(mask, self.matrix, self.offset,
+                              order=self.order, cval=DQMap['no_data'])
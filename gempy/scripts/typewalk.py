@@ -45,10 +45,16 @@ import re
 import sys
 import time
 
+from multiprocessing import Pool
+
+from astropy.io import fits
+
 import astrodata
 import gemini_instruments
 
 from astrodata.core import AstroDataError
+from gempy.adlibrary.metadata_catalog import (MetadataCatalog, open_catalog,
+                                              DEFAULT_CATALOG)
 
 # ------------------------------------------------------------------------------
 batchno = 100
@@ -94,6 +100,21 @@ def typewalk_argparser():
     parser.add_argument("--xtags", dest="xtags", nargs='+', default=None,
                         help="Exclude <xtags> from reporting.")
 
+    parser.add_argument("--catalog", dest="catalog", default=None,
+                        help="Use this metadata catalog, to avoid opening the "
+                        "files that have not changed since the last run. "
+                        "Eg. {}".format(DEFAULT_CATALOG))
+
+    parser.add_argument("-j", "--processes", dest="processes", type=int,
+                        default=1, help="Number of processes classifying "
+                        "the files. Default is 1.")
+
+    parser.add_argument("--header-only", dest="header_only",
+                        action="store_true", help="Classify the files from "
+                        "their primary header when possible, without reading "
+                        "the extensions. The catalog is then only used for "
+                        "the files that need to be opened.")
+
     return parser.parse_args()
 
 # ------------------------------------------------------------------------------
@@ -157,6 +178,71 @@ class Faces(object):
     UNDERLINE = '\033[4m'
     END       = '\033[0m'
 
+# ------------------------------------------------------------------------------
+def phu_tags(fname):
+    """
+    Classifies a file reading as little of it as possible. The AstroData
+    class is matched against the lazily loaded HDUList, where only the
+    extensions that _matches_data asks for are read (usually none). If the
+    tags of that class only depend on the PHU, they are computed from an
+    instance made of the PHU alone.
+
+    Returns None if the class needs the whole file to compute its tags.
+
+    """
+    with fits.open(fname, memmap=True, do_not_scale_image_data=True,
+                   lazy_load_hdus=True) as hdulist:
+        adclass = astrodata.factory.getAstroDataClass(hdulist)
+        if not astrodata.factory.isPhuSufficient(adclass):
+            return None
+        phu = fits.PrimaryHDU(header=hdulist[0].header.copy(),
+                              data=fits.DELAYED)
+    return adclass.load(fits.HDUList([phu])).tags
+
+def file_tags(fname, catalog=None, header_only=False):
+    """
+    Returns (tags, None) for a file, or (None, message) if it can't be
+    opened. With header_only, the file is only opened completely if its
+    tags can't be computed from the PHU (see phu_tags). Compressed files
+    are always opened, since their PHU is not the one of the original file.
+
+    """
+    if header_only and not fname.endswith('.fz'):
+        try:
+            tags = phu_tags(fname)
+        except Exception:
+            tags = None
+        if tags is not None:
+            return list(tags), None
+    try:
+        if catalog is None:
+            fl = astrodata.open(fname)
+        else:
+            fl = catalog.entry(fname)
+        return list(fl.tags), None
+    except IOError:
+        return None, "     Could not open file: {}".format(fname)
+    except ValueError as err:
+        return None, "     Failed to open: {}, {}".format(fname, str(err))
+    except AstroDataError:
+        return None, "AstroData failed to open file: {}".format(fname)
+
+# Catalog and classification mode of the processes in the typewalk pool
+_worker_options = None
+
+def _init_worker(catalog_path, header_only):
+    global _worker_options
+    catalog = None
+    if catalog_path is not None:
+        # Every process writes to the catalog, so nobody can hold the lock
+        catalog = MetadataCatalog(catalog_path, commit_every=1)
+    _worker_options = (catalog, header_only)
+
+def _worker_file_tags(candidate):
+    catalog, header_only = _worker_options
+    return candidate, file_tags(candidate[-1], catalog=catalog,
+                                header_only=header_only)
+
 # ------------------------------------------------------------------------------
 class DataSpider(object):
     """
@@ -166,12 +252,29 @@ class DataSpider(object):
     """
     def typewalk(self, directory=os.getcwd(), only=None, filemask=None, 
                  or_logic=False, outfile=None, stayTop=False, batchnum=100, 
-                 xtypes=None):
+                 xtypes=None, catalog=None, processes=1, header_only=False):
         """
         Recursively walk <directory> and put type information to stdout
 
+        If a MetadataCatalog is passed, the tags are taken from it, and only
+        new or modified files are opened.
+
+        With processes > 1, the files are classified by a pool of processes
+        while the walk goes on. The results are reported as they arrive, in
+        the same order as a serial walk. With header_only, files are
+        classified from their PHU whenever that's possible.
+
         """
         directory = os.path.abspath(directory)
+        if filemask is None:
+            mask = r".*?\.(fits|FITS|fz)$"
+        else:
+            mask = filemask
+        try:
+            re.compile(mask)
+        except:
+            print("BAD FILEMASK (must be a valid regexp):", mask)
+            return str(sys.exc_info()[1])
 
         # This accumulates files that match --types type if --out is
         # specified.
@@ -182,114 +285,125 @@ class DataSpider(object):
         else:
             walkfunc = os.walk
 
-        for root, dirn, files in walkfunc(directory):
-            fullroot = os.path.abspath(root)
-            if root == ".":
-                rootln = "\n{}directory: {}. ({})".format(Faces.CYAN, Faces.END,
-                                                          fullroot)
+        def matching_files():
+            for batch, (root, dirn, files) in enumerate(walkfunc(directory)):
+                for tfile in files:
+                    if re.match(mask, tfile):
+                        yield batch, root, tfile, os.path.join(root, tfile)
+
+        pool = None
+        if processes > 1:
+            pool = Pool(processes, initializer=_init_worker,
+                        initargs=(None if catalog is None else catalog.path,
+                                  header_only))
+            classified = pool.imap(_worker_file_tags, matching_files())
+        else:
+            classified = ((candidate, file_tags(candidate[-1], catalog=catalog,
+                                                header_only=header_only))
+                          for candidate in matching_files())
+
+        try:
+            self._report(classified, only, or_logic, outfile,
+                         outfile_list, xtypes)
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
 
-            else:
-                rootln = "\n{}directory: {} {}".format(Faces.CYAN, Faces.END, root)
+        if outfile and outfile_list:
+            generate_outfile(outfile, outfile_list, only, or_logic, xtypes)
+        return
+
+    def _report(self, classified, only, or_logic, outfile, outfile_list,
+                xtypes):
+        current_batch = None
+        for (batch, root, tfile, fname), (dtypes, error) in classified:
+            if batch != current_batch:
+                current_batch = batch
+                fullroot = os.path.abspath(root)
+                if root == ".":
+                    rootln = "\n{}directory: {}. ({})".format(Faces.CYAN,
+                                                              Faces.END,
+                                                              fullroot)
 
-            firstfile = True
-            for tfile in files:
-                if filemask is None:
-                    mask = r".*?\.(fits|FITS|fz)$"
                 else:
-                    mask = filemask
+                    rootln = "\n{}directory: {} {}".format(Faces.CYAN,
+                                                           Faces.END, root)
 
-                try:
-                    matched = re.match(mask, tfile)
-                except:
-                    print("BAD FILEMASK (must be a valid regexp):", mask)
-                    return str(sys.exc_info()[1])
+                firstfile = True
+
+            if error is not None:
+                print(error)
+                continue
 
-                if (re.match(mask, tfile)) :
-                    fname = os.path.join(root, tfile)
+            # exclude if dtypes has any xtypes
+            if xtypes:
+                try:
+                    assert set(dtypes).intersection(set(xtypes))
+                    continue
+                except AssertionError:
+                    pass
+
+            # Here we are looking to match *all* caller types.
+            # Logical AND, not OR.
+            if only == "all":
+                found = True
+            else:
+                found = False
+                if or_logic:
                     try:
-                        fl = astrodata.open(fname)
-                        dtypes = list(fl.tags)
-                    except IOError:
-                        print("     Could not open file: {}".format(fname))
-                        continue
-                    except ValueError as err:
-                        print("     Failed to open: {}, {}".format(fname, str(err)))
-                        continue
-                    except AstroDataError:
-                        print("AstroData failed to open file: {}".format(fname))
-                        continue
-
-                    # exclude if dtypes has any xtypes
-                    if xtypes:
-                        try:
-                            assert set(dtypes).intersection(set(xtypes))
-                            continue
-                        except AssertionError:
-                            pass
-
-                    # Here we are looking to match *all* caller types.
-                    # Logical AND, not OR.
-                    if only == "all":
+                        assert(set(only).intersection(set(dtypes)))
                         found = True
-                    else:
-                        found = False
-                        if or_logic:
-                            try:
-                                assert(set(only).intersection(set(dtypes)))
-                                found = True
-                                if outfile:
-                                    outfile_list.append(fname)
-                            except AssertionError:
-                                pass
-                        else:
-                            if set(only).issubset(dtypes):
-                                found = True
-                                if outfile:
-                                    outfile_list.append(fname)
-
-                    if not found:
-                        continue
-
-                    if firstfile:
-                        print(rootln)
-
-                    firstfile = False
-                    # PRINTING OUT THE FILE AND TYPE INFO
-                    indent = 5
-                    pwid = 40
-                    fwid = pwid - indent
-                    while len(tfile) >= (fwid - 1):
-                        print("     {}{}{}".format(Faces.BLUE, tfile, Faces.END))
-                        tfile = ""
-
-                    if len(tfile) > 0:
-                        prlin = "     {} ".format(tfile)
-                        prlincolor = "     {}{}{} ".format(Faces.BLUE, tfile,
-                                                           Faces.END)
-                    else:
-                        prlin = "     "
-                        prlincolor = "     "
-
-                    empty = " " * indent + "." * fwid
-                    fwid  = pwid+indent
-                    lp    = len(prlin)
-                    nsp   = pwid - ( lp % pwid )
-                    print(prlincolor+("."*nsp)+"{}".format(Faces.END), end=' ')
-                    tstr = ""
-                    astr = ""
-                    dtypes.sort()
-                    for dtype in dtypes:
-                        if (dtype is not None):
-                            newtype = "({}) ".format(dtype)
-                        else:
-                            newtype = "(Unknown) "
-
-                        astr += newtype
-
-                    print("{}{}{}".format(Faces.RED, astr, Faces.END))
+                        if outfile:
+                            outfile_list.append(fname)
+                    except AssertionError:
+                        pass
+                else:
+                    if set(only).issubset(dtypes):
+                        found = True
+                        if outfile:
+                            outfile_list.append(fname)
+
+            if not found:
+                continue
+
+            if firstfile:
+                print(rootln)
+
+            firstfile = False
+            # PRINTING OUT THE FILE AND TYPE INFO
+            indent = 5
+            pwid = 40
+            fwid = pwid - indent
+            while len(tfile) >= (fwid - 1):
+                print("     {}{}{}".format(Faces.BLUE, tfile, Faces.END))
+                tfile = ""
+
+            if len(tfile) > 0:
+                prlin = "     {} ".format(tfile)
+                prlincolor = "     {}{}{} ".format(Faces.BLUE, tfile,
+                                                   Faces.END)
+            else:
+                prlin = "     "
+                prlincolor = "     "
+
+            empty = " " * indent + "." * fwid
+            fwid  = pwid+indent
+            lp    = len(prlin)
+            nsp   = pwid - ( lp % pwid )
+            print(prlincolor+("."*nsp)+"{}".format(Faces.END), end=' ')
+            tstr = ""
+            astr = ""
+            dtypes.sort()
+            for dtype in dtypes:
+                if (dtype is not None):
+                    newtype = "({}) ".format(dtype)
+                else:
+                    newtype = "(Unknown) "
 
-        if outfile and outfile_list:
-            generate_outfile(outfile, outfile_list, only, or_logic, xtypes)
+                astr += newtype
+
+            print("{}{}{}".format(Faces.RED, astr, Faces.END))
         return
 
 # ------------------------------------------------------------------------------
@@ -305,7 +419,10 @@ def main(options):
 
     # Gemini Specific class code
     dt = DataSpider()
+    catalog = None
     try:
+        if options.catalog is not None:
+            catalog = open_catalog(options.catalog)
         dt.typewalk(directory=options.twdir,
                     only=options.tags,
                     or_logic=options.or_logic,
@@ -313,11 +430,17 @@ def main(options):
                     filemask=options.filemask,
                     stayTop=options.stayTop,
                     batchnum=int(options.batchnum)-1,
-                    xtypes=options.xtags
+                    xtypes=options.xtags,
+                    catalog=catalog,
+                    processes=options.processes,
+                    header_only=options.header_only
         )
         print("Done DataSpider.typewalk(..)")
     except KeyboardInterrupt:
         print("Interrupted by Control-C")
+    finally:
+        if catalog is not None:
+            catalog.close()
     return
 
 
@@ -53,7 +53,7 @@ class ADCC(with_metaclass(Singleton, object)):
             pass
         else:
             self.dark = args.dark
-            self.events = eventsManager.EventsManager()
+            self.events = eventsManager.EventsManager(max_events=args.max_events)
             self.http_port = args.httpport
             self.sreport = args.adccsrn
             self.racefile = "adccinfo.py"
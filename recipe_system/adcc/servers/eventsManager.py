@@ -10,14 +10,49 @@ __version__ = 'eventsManager, v(new hope)'
 import json
 import time
 import re
+import bisect
+import threading
 
 from astrodata import AstroData
 
 # ------------------------------------------------------------------------------
 class EventsManager(object):
-    def __init__(self):
-        self.event_list = []
-        self.event_index = {}
+    """
+    Thread-safe store of the events (QA metrics, etc.) reported to the adcc.
+
+    Events are kept in the order they arrive. Each one is given a sequence
+    number, which only ever increases, and the latest timestamp seen up to
+    each event is kept in a non-decreasing list, so the events after a given
+    time are found by bisection rather than by a search through the list.
+    If max_events is set, only that many of the most recent events are kept.
+
+    Readers can also wait for new events with wait_since(), which returns as
+    soon as an event with a later sequence number is appended.
+    """
+    def __init__(self, max_events=None):
+        if max_events is not None and max_events < 1:
+            raise ValueError("max_events must be at least 1, not {}"
+                             .format(max_events))
+        self.max_events = max_events
+        self.sequence = 0     # sequence number of the most recent event
+        self._lock = threading.Condition(threading.RLock())
+        self._events = []
+        self._latest = []
+
+    def __len__(self):
+        return len(self._events)
+
+    @property
+    def event_list(self):
+        with self._lock:
+            return list(self._events)
+
+    @event_list.setter
+    def event_list(self, events):
+        with self._lock:
+            self._events = []
+            self._latest = []
+            self._extend(events)
 
     def _get_stacklist(self, ad):
         # Find a list of all images that went into a stack for a stacked image
@@ -103,7 +138,8 @@ class EventsManager(object):
                 if "timestamp" in msg:
                     msg.update({"reported_timestamp":msg["timestamp"]})
                 msg.update({"timestamp":time.time()})
-            self.event_list.extend(ad)
+            with self._lock:
+                self._extend(ad)
             return
 
         elif isinstance(ad, dict):
@@ -116,25 +152,75 @@ class EventsManager(object):
         else:
             raise TypeError("Bad Arguments")
 
-        self.event_list.append(wholed)
-        timestamp = wholed["timestamp"]
-        if timestamp not in self.event_index:
-            self.event_index.update({timestamp:[]})
-
-        ts_list = self.event_index[timestamp]
-        ts_list.append(self.event_list.index(wholed))
+        with self._lock:
+            self._extend([wholed])
         return
 
     def get_list(self, fromtime=None):
-        if not fromtime:
-            return self.event_list
-        else:
-            for i in range(len(self.event_list)):
-                if self.event_list[i]["timestamp"] > fromtime:
-                    return self.event_list[i:]
-        return []
+        """
+        Return the events from the first one (in order of arrival) with a
+        timestamp later than fromtime, or all the events if fromtime is not
+        given.
+        """
+        with self._lock:
+            if not fromtime:
+                return list(self._events)
+            return self._events[bisect.bisect_right(self._latest, fromtime):]
+
+    def get_since(self, sequence):
+        """
+        Return the sequence number of the most recent event, and the events
+        with sequence numbers greater than the one given (as many of them as
+        are still kept).
+        """
+        with self._lock:
+            first = self.sequence - len(self._events) + 1
+            return (self.sequence,
+                    self._events[max(sequence - first + 1, 0):])
+
+    def wait_since(self, sequence, timeout=None):
+        """
+        As get_since(), but if there are no newer events, wait up to timeout
+        seconds (or indefinitely, if None) for one to be appended. A sequence
+        number later than the most recent one (e.g., from a client that was
+        talking to an adcc which has since been restarted) gets all the events.
+        """
+        if timeout is not None and not timeout > 0:
+            # Also catches a NaN, which would make us wait forever
+            timeout = 0
+        with self._lock:
+            if sequence > self.sequence:
+                sequence = 0
+            end = None if timeout is None else time.time() + timeout
+            while self.sequence <= sequence:
+                remaining = None if end is None else end - time.time()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._lock.wait(remaining)
+            return self.get_since(sequence)
 
     def clear_list(self):
-        self.event_list = []
-        self.event_index = {}
+        with self._lock:
+            self._events = []
+            self._latest = []
+        return
+
+    def _extend(self, events):
+        # Must be called with the lock held
+        self._events.extend(events)
+        self.sequence += len(events)
+        self._lock.notify_all()
+
+        # Old events are dropped in batches, to keep appending cheap
+        if (self.max_events is not None and
+                len(self._events) > self.max_events + self.max_events // 4):
+            self._events = self._events[-self.max_events:]
+            self._latest = []
+            events = self._events
+
+        latest = self._latest[-1] if self._latest else None
+        for event in events:
+            if latest is None or event["timestamp"] > latest:
+                latest = event["timestamp"]
+            self._latest.append(latest)
         return
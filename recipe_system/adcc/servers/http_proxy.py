@@ -13,9 +13,11 @@ from past.utils import old_div
 import os
 import sys
 import json
+import math
 import time
 import select
 import datetime
+import threading
 
 import urllib.error
 import urllib.parse
@@ -26,6 +28,11 @@ from http.server import BaseHTTPRequestHandler, HTTPServer
 
 from recipe_system.cal_service import calurl_dict
 # ------------------------------------------------------------------------------
+# Longest time (sec) an events.json request is held waiting for new events
+LONG_POLL_TIMEOUT = 30.
+# Time (sec) for which QA metrics from fitsstore are reused
+FSTORE_CACHE_TTL = 60.
+# ------------------------------------------------------------------------------
 def parsepath(path):
     """
     parsepath w/ urlparse.
@@ -170,6 +177,74 @@ def fstore_get(timestamp):
         qa_data       = json.loads(store_handle.read())
     return qa_data
 
+
+class FitsstoreCache(object):
+    """
+    Cache in front of fstore_get(). Replies are kept for ttl seconds, keyed
+    by operational day (the part of the fitsstore URL that the timestamp
+    determines), and concurrent requests for a day that is not cached share
+    a single fetch: the first requester fetches it and the others wait for
+    its result (or its exception).
+
+    Each call returns a new list, which the caller may modify, but the
+    event dicts in it are shared.
+    """
+    def __init__(self, fetch=fstore_get, ttl=FSTORE_CACHE_TTL):
+        self.fetch = fetch
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._cache = {}
+        self._in_flight = {}
+
+    def get(self, timestamp):
+        """
+        parameters: <float>, time in epoch seconds
+        return:     <list>,  list of dicts (json) of qametrics
+
+        """
+        key = stamp_to_opday(timestamp) if timestamp else None
+        with self._lock:
+            expiry, qa_data = self._cache.get(key, (0, None))
+            if expiry > time.time():
+                return list(qa_data)
+            fetching = self._in_flight.get(key)
+            first = fetching is None
+            if first:
+                fetching = self._in_flight[key] = _Fetch()
+
+        if first:
+            try:
+                fetching.result = self.fetch(timestamp)
+            except Exception as err:
+                fetching.error = err
+            with self._lock:
+                if fetching.error is None:
+                    self._cache[key] = (time.time() + self.ttl,
+                                        fetching.result)
+                del self._in_flight[key]
+            fetching.done.set()
+        else:
+            fetching.done.wait()
+
+        if fetching.error is not None:
+            raise fetching.error
+        return list(fetching.result)
+
+    def clear(self):
+        with self._lock:
+            self._cache = {}
+
+
+class _Fetch(object):
+    """The outcome of a fetch that other requesters can wait for"""
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+fstore_cache = FitsstoreCache()
+
 # ------------------------------------------------------------------------------
 class ADCCHandler(BaseHTTPRequestHandler):
     """
@@ -197,7 +272,8 @@ class ADCCHandler(BaseHTTPRequestHandler):
             assert self.informers["verbose"]
             self.log_message(msg_form, repr(self.requestline), code, size)
         except AssertionError:
-            if "cmdqueue.json" in self.requestline:
+            if ("cmdqueue.json" in self.requestline or
+                    "events.json" in self.requestline):
                 pass
             else:
                 self.log_message(msg_form, repr(self.requestline), code, size)
@@ -263,6 +339,11 @@ class ADCCHandler(BaseHTTPRequestHandler):
             if parms["path"].startswith("/cmdqueue.json"):
                 self._handle_cmdqueue_json(events, parms)
 
+            # ------------------------------------------------------------------
+            # Long-poll alternative to cmdqueue.json
+            elif parms["path"].startswith("/events.json"):
+                self._handle_events_json(events, parms)
+
             # ------------------------------------------------------------------
             # Server time
             # Queried by metrics client
@@ -348,12 +429,12 @@ class ADCCHandler(BaseHTTPRequestHandler):
         # event_list = [] implies a new adcc. Request current op day
         # metrics from fitsstore.
 
-        if not events.event_list:
+        if not events:
             self.log_message(msg_form, "No extant events.", info_code, size)
             self.log_message(msg_form, reqmsg+"@fitsstore", info_code, size)
 
-            events.event_list = fstore_get(current_op_timestamp())
-            self.log_message(msg_form,"Received "+str(len(events.event_list))+" events.",
+            events.event_list = fstore_cache.get(current_op_timestamp())
+            self.log_message(msg_form,"Received "+str(len(events))+" events.",
                              info_code, size)
 
             tdic = events.get_list()
@@ -383,7 +464,7 @@ class ADCCHandler(BaseHTTPRequestHandler):
                 self.log_message(msg_form, "Requested metrics on ... " +
                                  stamp_to_opday(fromtime), info_code, size)
 
-            tdic = fstore_get(fromtime)
+            tdic = fstore_cache.get(fromtime)
             if verbosity:
                 self.log_message(msg_form, "Received " + str(len(tdic)) +
                                     " events from fitsstore.", info_code, size)
@@ -404,10 +485,43 @@ class ADCCHandler(BaseHTTPRequestHandler):
 
         return
 
+    def _handle_events_json(self, events, parms):
+        """Handle HTTP client GET requests on service: events.json
+
+        The client passes the sequence number from its previous reply (none
+        or 0 the first time) and the request is held until there are newer
+        events, or until the timeout (in seconds, at most LONG_POLL_TIMEOUT)
+        has passed. The reply is compact JSON with only the new events:
+
+            {"sequence": <int>, "events": [<event>, ...]}
+
+        """
+        try:
+            sequence = int(parms.get("sequence", [0])[0])
+            timeout = float(parms.get("timeout", [LONG_POLL_TIMEOUT])[0])
+            # min() and max() let a NaN through, and it would never expire
+            if math.isnan(timeout) or math.isinf(timeout):
+                raise ValueError(timeout)
+        except ValueError:
+            self.send_error(400, 'Bad sequence or timeout: %s' % self.path)
+            return
+
+        timeout = max(0., min(timeout, LONG_POLL_TIMEOUT))
+        sequence, new_events = events.wait_since(sequence, timeout=timeout)
+        self.send_response(200)
+        self.send_header('Content-type', "application/json")
+        self.end_headers()
+        self.wfile.write(
+            bytes(json.dumps({"sequence": sequence, "events": new_events},
+                             separators=(',', ':')).encode('utf-8'))
+        )
+        return
 
 
 class MTHTTPServer(ThreadingMixIn, HTTPServer):
     """Handles requests using threads"""
+    # Don't let requests waiting for events hold up a shutdown
+    daemon_threads = True
 
 
 def startInterfaceServer(*args, **informers):
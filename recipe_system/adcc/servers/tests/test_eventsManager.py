@@ -0,0 +1,81 @@
+# pytest suite
+"""
+Tests for the adcc's EventsManager.
+
+This is a suite of tests to be run with pytest.
+
+To run:
+   1) py.test -v   (must in gemini_python or have it in PYTHONPATH)
+"""
+import random
+
+import pytest
+
+from recipe_system.adcc.servers.eventsManager import EventsManager
+
+
+def linear_get_list(event_list, fromtime=None):
+    # How get_list() used to find the events, going through the whole list
+    if not fromtime:
+        return event_list
+    for i in range(len(event_list)):
+        if event_list[i]["timestamp"] > fromtime:
+            return event_list[i:]
+    return []
+
+
+def make_events(number, seed=42):
+    # Timestamps mostly increase, but some events are reported late
+    rng = random.Random(seed)
+    return [{"msgtype": "qametric", "n": i,
+             "timestamp": i + rng.choice([0., 0., 0.5, -3.])}
+            for i in range(number)]
+
+
+def test_get_list_matches_linear_scan():
+    events = EventsManager()
+    for event in make_events(200):
+        events.append_event(event)
+    event_list = events.event_list
+    for fromtime in [None, 0, -10., 250.] + [n / 4. for n in range(-8, 820)]:
+        assert events.get_list(fromtime) == linear_get_list(event_list,
+                                                            fromtime)
+
+    # Replies are copies
+    events.get_list(10.).append({"timestamp": 1000.})
+    assert len(events) == 200
+
+
+def test_get_since():
+    events = EventsManager()
+    assert events.get_since(0) == (0, [])
+    events.append_event(make_events(5))
+    event_list = events.event_list
+    assert events.get_since(0) == (5, event_list)
+    assert events.get_since(3) == (5, event_list[3:])
+    assert events.get_since(5) == (5, [])
+
+
+@pytest.mark.parametrize("max_events", [1, 3, 8])
+def test_retention(max_events):
+    events = EventsManager(max_events=max_events)
+    all_events = make_events(100)
+    for event in all_events:
+        events.append_event(event)
+        assert max_events <= len(events) <= max_events + max_events // 4 or \
+               len(events) == event["n"] + 1
+    kept = events.event_list
+    assert kept == all_events[-len(kept):]
+    assert events.sequence == 100
+
+    # The sequence numbers and the time index follow the trimming
+    assert events.get_since(0) == (100, kept)
+    assert events.get_since(99) == (100, kept[-1:])
+    for fromtime in [n / 2. for n in range(-10, 210)]:
+        assert events.get_list(fromtime) == linear_get_list(kept, fromtime)
+
+
+@pytest.mark.parametrize("max_events", [0, -5])
+def test_bad_max_events(max_events):
+    with pytest.raises(ValueError):
+        EventsManager(max_events=max_events)
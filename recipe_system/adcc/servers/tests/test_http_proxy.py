@@ -0,0 +1,174 @@
+# pytest suite
+"""
+Tests for the adcc's http_proxy.
+
+This is a suite of tests to be run with pytest. They run against a local
+stand-in for fitsstore, so no network access is needed.
+
+To run:
+   1) py.test -v   (must in gemini_python or have it in PYTHONPATH)
+"""
+import json
+import time
+import threading
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from multiprocessing.pool import ThreadPool
+
+import pytest
+
+from recipe_system.cal_service import calurl_dict
+from recipe_system.adcc.servers import http_proxy
+from recipe_system.adcc.servers.eventsManager import EventsManager
+
+
+class StandInFitsstore(BaseHTTPRequestHandler):
+    """Replies to /qaforgui/<date> with one metric, slowly"""
+    requests = []
+
+    def do_GET(self):
+        self.requests.append(self.path)
+        time.sleep(0.2)
+        if self.path.endswith('/bad'):
+            self.send_error(500)
+            return
+        self.send_response(200)
+        self.send_header('Content-type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps([{"msgtype": "qametric",
+                                      "path": self.path,
+                                      "timestamp": 1.}]).encode('utf-8'))
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def fitsstore(monkeypatch):
+    StandInFitsstore.requests = []
+    server = HTTPServer(('127.0.0.1', 0), StandInFitsstore)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    monkeypatch.setitem(calurl_dict.calurl_dict, 'QAQUERYURL',
+                        'http://127.0.0.1:{}/qaforgui'.format(server.server_port))
+    yield StandInFitsstore.requests
+    server.shutdown()
+    server.server_close()
+
+
+def test_fitsstore_cache_shares_fetches(fitsstore):
+    cache = http_proxy.FitsstoreCache(ttl=60.)
+    night = http_proxy.ymd_to_stamp(2018, 3, 1, 20)
+    pool = ThreadPool(6)
+    results = pool.map(cache.get, [night, night + 3600] * 3)
+    pool.close()
+    assert fitsstore == ['/qaforgui/20180302']
+    assert all(result == results[0] for result in results)
+    assert results[0][0]['path'] == '/qaforgui/20180302'
+
+    # Callers get their own lists
+    results[0].append({})
+    assert len(cache.get(night)) == 1
+    assert len(fitsstore) == 1
+
+    # Another night is another fetch
+    cache.get(night - 86400)
+    assert fitsstore[-1] == '/qaforgui/20180301'
+
+
+def test_fitsstore_cache_expiry(fitsstore):
+    cache = http_proxy.FitsstoreCache(ttl=0.5)
+    night = http_proxy.ymd_to_stamp(2018, 3, 1, 20)
+    cache.get(night)
+    cache.get(night)
+    assert len(fitsstore) == 1
+    time.sleep(0.6)
+    cache.get(night)
+    assert len(fitsstore) == 2
+
+
+def test_fitsstore_cache_errors_not_cached(fitsstore):
+    def fetch(timestamp):
+        return http_proxy.fstore_get(timestamp) if timestamp else bad_fetch()
+
+    def bad_fetch():
+        url = calurl_dict.calurl_dict['QAQUERYURL'] + '/bad'
+        return json.loads(http_proxy.urllib.request.urlopen(url).read())
+
+    cache = http_proxy.FitsstoreCache(fetch=fetch)
+    pool = ThreadPool(3)
+    results = [pool.apply_async(cache.get, (0,)) for i in range(3)]
+    pool.close()
+    for result in results:
+        with pytest.raises(http_proxy.urllib.error.HTTPError):
+            result.get()
+    assert len(fitsstore) == 1
+    with pytest.raises(http_proxy.urllib.error.HTTPError):
+        cache.get(0)
+    assert len(fitsstore) == 2
+
+
+def test_events_long_poll():
+    events = EventsManager()
+    events.append_event({"msgtype": "qametric", "timestamp": 1.})
+    assert events.wait_since(0, timeout=0) == (1, events.event_list)
+
+    start = time.time()
+    assert events.wait_since(1, timeout=0.3) == (1, [])
+    assert time.time() - start >= 0.3
+
+    def later():
+        time.sleep(0.2)
+        events.append_event({"msgtype": "qametric", "timestamp": 2.})
+    threading.Thread(target=later).start()
+    sequence, new_events = events.wait_since(1, timeout=10)
+    assert sequence == 2 and new_events[0]["timestamp"] == 2.
+    assert time.time() - start < 5
+
+    # A client that knew a restarted adcc gets everything
+    assert events.wait_since(50, timeout=0) == (2, events.event_list)
+
+    # Timeouts that can't expire don't block
+    assert events.wait_since(2, timeout=float('nan')) == (2, [])
+    assert events.wait_since(2, timeout=-1) == (2, [])
+
+
+@pytest.fixture
+def adcc(monkeypatch):
+    events = EventsManager()
+    monkeypatch.setattr(http_proxy.ADCCHandler, 'informers',
+                        {'events': events, 'dark': False, 'verbose': False})
+    monkeypatch.setattr(http_proxy, 'LONG_POLL_TIMEOUT', 0.3)
+    monkeypatch.setattr(http_proxy.ADCCHandler, 'log_message',
+                        lambda *args: None)
+    server = http_proxy.MTHTTPServer(('127.0.0.1', 0), http_proxy.ADCCHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield events, 'http://127.0.0.1:{}/events.json'.format(server.server_port)
+    server.shutdown()
+    server.server_close()
+
+
+def get_json(url):
+    return json.loads(http_proxy.urllib.request.urlopen(url, timeout=10)
+                      .read().decode('utf-8'))
+
+
+def test_events_json(adcc):
+    events, url = adcc
+    events.append_event({"msgtype": "qametric", "timestamp": 1.})
+    assert get_json(url) == {"sequence": 1, "events": events.event_list}
+
+    # Long timeouts are capped, negative ones don't wait
+    for timeout, least in (('1e9', 0.3), ('-5', 0.)):
+        start = time.time()
+        assert get_json(url + '?sequence=1&timeout=' + timeout) == {
+            "sequence": 1, "events": []}
+        assert least <= time.time() - start < 5
+
+    for timeout in ('nan', 'inf', '-inf', 'soon'):
+        with pytest.raises(http_proxy.urllib.error.HTTPError) as err:
+            get_json(url + '?timeout=' + timeout)
+        assert err.value.code == 400
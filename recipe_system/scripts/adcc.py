@@ -9,12 +9,18 @@ Automated Dataflow Coordination Center
 """
 import sys
 
-from argparse import ArgumentParser
+from argparse import ArgumentParser, ArgumentTypeError
 
 from recipe_system import __version__
 
 from recipe_system.adcc.adcclib import ADCC
 # ------------------------------------------------------------------------------
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise ArgumentTypeError("must be at least 1, not {}".format(value))
+    return number
+
 def buildArgs():
     parser = ArgumentParser(description="Automated Data Communication Center "
                             "(ADCC), v{}".format(__version__))
@@ -33,6 +39,10 @@ def buildArgs():
                         "i.e. http://localhost:<http-port>. "
                         "Default is 8777.")
 
+    parser.add_argument("--max-events", dest="max_events", default=None,
+                        type=positive_int, help="Maximum number of events to keep. "
+                        "Default is to keep all of them.")
+
     args = parser.parse_args()
     return args
 
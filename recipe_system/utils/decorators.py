@@ -138,6 +138,8 @@ def parameter_override(fn):
         # Can update config now it only has parameters it knows about
         config.update(**params)
         config.validate()
+        # Stack of running primitives, which PrimitivesBASE.myself() reads
+        names = getattr(pobj, '_primitive_names', [])
 
         if len(args) == 0 and adinputs is None:
             # Use appropriate stream input/output
@@ -148,21 +150,27 @@ def parameter_override(fn):
             else:
                 # Allow a non-existent stream to be passed
                 adinputs = pobj.streams.get(instream, [])
+            names.append(pname)
             try:
                 ret_value = fn(pobj, adinputs=adinputs, **dict(config.items()))
             except Exception:
                 zeroset()
                 raise
+            finally:
+                names.pop()
             # And place the outputs in the appropriate stream
             pobj.streams[outstream] = ret_value
         else:
             if args:  # if not, adinputs has already been assigned from params
                 adinputs = args[0]
+            names.append(pname)
             try:
                 ret_value = fn(pobj, adinputs=adinputs, **dict(config.items()))
             except Exception:
                 zeroset()
                 raise
+            finally:
+                names.pop()
         unset_logging()
         return ret_value
     return gn
@@ -18,6 +18,7 @@ Usage:
 import os
 import os.path
 import re
+import sys
 
 
 from setuptools import setup
@@ -209,9 +210,18 @@ if use_cython:
     suffix = 'pyx'
 else:
     suffix = 'c'
+# cyclip uses OpenMP (via cython.parallel) to clip on several cores. The
+# default compiler on macOS doesn't support it, in which case the code still
+# works but is single-threaded.
+if sys.platform.startswith('linux'):
+    openmp_args = ['-fopenmp']
+else:
+    openmp_args = []
 cyextensions = [Extension(
                         "gempy.library.cyclip",
                         [os.path.join('gempy', 'library', 'cyclip.'+suffix)],
+                        extra_compile_args=openmp_args,
+                        extra_link_args=openmp_args,
                         ),
                 ]
 if use_cython: